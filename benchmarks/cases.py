@@ -0,0 +1,196 @@
+"""Benchmark cases. Each one runs in a fresh interpreter against the tango-cho in HOME/.tangocho:
+
+    HOME=/tmp/deck python -m benchmarks.cases prioritize_study --repeat 5
+
+prints a JSON list with the time in seconds of each repetition. Use run.py to run them all.
+"""
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+
+CASES = {}
+
+
+def case(writes=False, calls_per_sample=1, unit="seconds"):
+    """Register a benchmark function, which takes the number of samples to take and returns their
+    times (or other measurements in unit). Cases that write to the database get their own copy of it."""
+    def register(function):
+        function.writes = writes
+        function.calls_per_sample = calls_per_sample
+        function.unit = unit
+        CASES[function.__name__] = function
+        return function
+
+    return register
+
+
+def _timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _random_tango(count, seed=0):
+    from tango import model
+    tango_model = model.get_model()
+    rng = random.Random(seed)
+    tango = []
+    for lang in tango_model.get_languages():
+        ids = [t['id'] for t in tango_model.iter_tango(lang, columns=['id'])]
+        tango.extend({"lang": lang, "id": tango_id} for tango_id in rng.sample(ids, min(count, len(ids))))
+    rng.shuffle(tango)
+    return tango[:count]
+
+
+@case()
+def python_startup(repeat):
+    """Wall time of an empty Python process, the floor for cli_cold_start"""
+    return _timed(lambda: subprocess.run([sys.executable, "-c", "pass"], check=True), repeat)
+
+
+@case()
+def cli_cold_start(repeat):
+    """Wall time of 'tango --help' in a new process"""
+    return _timed(lambda: subprocess.run([sys.executable, "-m", "tango.cli", "--help"], check=True,
+                                         stdout=subprocess.DEVNULL), repeat)
+
+
+@case()
+def model_init(repeat):
+    from tango import model
+    return _timed(model.Model, repeat)
+
+
+@case()
+def get_tango_for_language_all(repeat):
+    from tango import model
+    tango_model = model.get_model()
+    return _timed(lambda: tango_model.get_tango_for_language('all'), repeat)
+
+
+def _dict_row(cursor, row):
+    # how rows were read before model.Record, for comparison
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+@case()
+def get_tango_for_language_all_dicts(repeat):
+    """get_tango_for_language_all with a dict per row"""
+    from tango import model
+    tango_model = model.get_model()
+    tango_model._db.row_factory = _dict_row
+    return _timed(lambda: tango_model.get_tango_for_language('all'), repeat)
+
+
+def _bytes_per_tango(tango_model, repeat):
+    import tracemalloc
+    samples = []
+    for _ in range(repeat):
+        tracemalloc.start()
+        tango = tango_model.get_tango_for_language('all')
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        samples.append(size / max(1, len(tango)))
+        del tango
+    return samples
+
+
+@case(unit="bytes")
+def memory_per_tango(repeat):
+    """Memory taken by each tango loaded with get_tango_for_language, values included"""
+    from tango import model
+    return _bytes_per_tango(model.get_model(), repeat)
+
+
+@case(unit="bytes")
+def memory_per_tango_dicts(repeat):
+    """memory_per_tango with a dict per row"""
+    from tango import model
+    tango_model = model.get_model()
+    tango_model._db.row_factory = _dict_row
+    return _bytes_per_tango(tango_model, repeat)
+
+
+@case()
+def prioritize_study(repeat):
+    from tango import model, sm2_plus
+    model.get_model()
+    return _timed(lambda: sm2_plus.prioritize_study('all'), repeat)
+
+
+@case(calls_per_sample=100)
+def get_tango(repeat):
+    from tango import model
+    tango_model = model.get_model()
+    tango = _random_tango(100)
+    return _timed(lambda: [tango_model.get_tango(t['lang'], t['id']) for t in tango], repeat)
+
+
+@case(writes=True, calls_per_sample=100)
+def update_sm2p(repeat):
+    from tango import model, sm2_plus
+    model.get_model()
+    tango = _random_tango(100)
+    return _timed(lambda: [sm2_plus.update_sm2p(t, 0.5) for t in tango], repeat)
+
+
+@case(writes=True, calls_per_sample=100)
+def log_study(repeat):
+    from tango import model
+    tango_model = model.get_model()
+    tango = _random_tango(100)
+    return _timed(lambda: [tango_model.log_study(t, model.Score.OK) for t in tango], repeat)
+
+
+@case(writes=True, calls_per_sample=100)
+def record_review(repeat):
+    from tango import model, sm2_plus
+    model.get_model()
+    tango = _random_tango(100)
+    return _timed(lambda: [sm2_plus.record_review(t, model.Score.OK) for t in tango], repeat)
+
+
+@case(writes=True, calls_per_sample=100)
+def study_session(repeat):
+    """Starting a StudySession and reviewing 100 tango through it, as the study TUI does"""
+    from tango import model
+    from tango.study_session import StudySession
+    model.get_model()
+    scores = list(model.Score)
+
+    def review():
+        session = StudySession('all')
+        for index in range(100):
+            tango = session.next()
+            if tango is None:
+                break
+            session.record(tango, scores[index % len(scores)])
+        session.finish()
+    return _timed(review, repeat)
+
+
+@case(writes=True, calls_per_sample=1000)
+def review_batch(repeat):
+    """Wall time of 1000 reviews with 'tango review --batch' in a new process, scores piped to stdin"""
+    scores = "".join(f'{{"score": "{("BAD", "OK", "GREAT")[index % 3]}"}}\n' for index in range(1000))
+    return _timed(lambda: subprocess.run([sys.executable, "-m", "tango.cli", "review", "--batch"], check=True,
+                                         input=scores, universal_newlines=True, stdout=subprocess.DEVNULL), repeat)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("case", choices=sorted(CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+    json.dump(CASES[args.case](args.repeat), sys.stdout)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Generate a synthetic tango-cho for benchmarking.
+
+The deck is written to HOME/.tangocho/tango.db through tango's own Model API, so the HOME
+environment variable must point at the target directory (run.py takes care of this):
+
+    HOME=/tmp/deck python -m benchmarks.generate_deck --cards 100000 --languages 2
+"""
+import argparse
+import json
+import random
+import sys
+
+from tango import model, sm2_plus
+from tango.utils import get_current_timestamp
+
+DAY_TO_SECONDS = sm2_plus.DAY_TO_SECONDS
+
+SCORE_WEIGHTS = {"BAD": 0.15, "OK": 0.35, "GREAT": 0.5}
+
+
+def _words(rng, count, length):
+    return " ".join("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, length)))
+                    for _ in range(count))
+
+
+def _synthetic_tango(rng, lang, count, image_fraction):
+    for i in range(count):
+        yield {
+            "headword": f"{lang}-{i}-{_words(rng, 1, 8)}",
+            "pronunciation": _words(rng, 1, 8),
+            "definition": _words(rng, 6, 8),
+            "example": _words(rng, 12, 8),
+            "notes": _words(rng, 3, 8),
+            "source": "synthetic",
+            "image_url": f"synthetic://{lang}/{i}" if rng.random() < image_fraction else "",
+        }
+
+
+def generate(languages=2, cards=10000, image_fraction=0.1, image_size=50000, distinct_images=100,
+             history_depth=5, history_days=365, seed=0):
+    """Fill the current tango-cho with synthetic tango, images and review history. Returns a summary."""
+    rng = random.Random(seed)
+    tango_model = model.get_model()
+    now = get_current_timestamp()
+    langs = [f"lang{n}" for n in range(languages)]
+    images = [rng.randbytes(image_size) for _ in range(distinct_images)]
+    per_language = cards // languages
+
+    if tango_model.get_languages():
+        raise SystemExit("The tango-cho to generate into must be empty")
+    for lang in langs:
+        tango_model.add_language(lang)
+        tango_model.import_tango(lang, _synthetic_tango(rng, lang, per_language, image_fraction))
+
+    # the simulated history starts history_days ago, so the tango have to be at least that old
+    with tango_model._db:
+        tango_model._db.execute("UPDATE cards SET created = ?", (now - history_days * DAY_TO_SECONDS,))
+
+    # "download" the queued images, several tango sharing each one
+    image_count = 0
+    for download in tango_model.get_image_downloads():
+        tango_model.finish_image_download(download, rng.choice(images))
+        image_count += 1
+
+    # review every tango as it comes due, starting history_days ago, up to history_depth times
+    review_count = 0
+    scores = list(SCORE_WEIGHTS)
+    weights = list(SCORE_WEIGHTS.values())
+    tango_model.enable_write_behind(interval=3600)
+    for lang in langs:
+        for tango_id in [tango['id'] for tango in tango_model.iter_tango(lang, columns=['id'])]:
+            tango = {"lang": lang, "id": tango_id}
+            sm2p_vars = sm2_plus.get_default_variables({"created": now - history_days * DAY_TO_SECONDS})
+            for _ in range(history_depth):
+                review_time = int(sm2p_vars["nextDue"] + rng.random() * DAY_TO_SECONDS)
+                if review_time > now:
+                    break
+                score = model.Score[rng.choices(scores, weights)[0]]
+                sm2p_vars = sm2_plus.get_updated_variables(sm2p_vars, sm2_plus.performance_ratings[score.name],
+                                                           review_time)
+                tango_model.record_review(tango, score, sm2p_vars, review_time)
+                review_count += 1
+    tango_model.flush()
+    return {"languages": languages, "cards": per_language * languages, "images": image_count,
+            "distinct_images": distinct_images, "image_size": image_size, "reviews": review_count}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--languages", type=int, default=2)
+    parser.add_argument("--cards", type=int, default=10000, help="total number of tango")
+    parser.add_argument("--image-fraction", type=float, default=0.1, help="fraction of tango with an image")
+    parser.add_argument("--image-size", type=int, default=50000, help="bytes per image")
+    parser.add_argument("--distinct-images", type=int, default=100)
+    parser.add_argument("--history-depth", type=int, default=5, help="maximum reviews per tango")
+    parser.add_argument("--history-days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    summary = generate(args.languages, args.cards, args.image_fraction, args.image_size, args.distinct_images,
+                       args.history_depth, args.history_days, args.seed)
+    json.dump(summary, sys.stdout)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Run the benchmark cases against a synthetic (or existing) tango-cho and report the timings as JSON.
+
+    python -m benchmarks.run --cards 100000 --output results.json
+    python -m benchmarks.run --deck /tmp/deck --cases prioritize_study,model_init
+
+With --deck, the tango-cho in DECK/.tangocho is used (and generated there first if it doesn't
+exist). Otherwise a deck is generated in a temporary directory. Cases that write get a copy.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .cases import CASES
+
+repo_root = Path(__file__).resolve().parent.parent
+
+
+def _run_module(module, home, *args):
+    env = dict(os.environ, HOME=str(home), PYTHONPATH=str(repo_root))
+    result = subprocess.run([sys.executable, "-m", module, *args], env=env, cwd=str(repo_root),
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=str(repo_root), check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summarize(name, samples):
+    calls = CASES[name].calls_per_sample
+    return {
+        "name": name,
+        "unit": CASES[name].unit,
+        "calls_per_sample": calls,
+        "samples": samples,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "max": max(samples),
+        "median_per_call": statistics.median(samples) / calls,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deck", help="directory to use as HOME for the tango-cho")
+    parser.add_argument("--cases", help="comma-separated cases to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per case")
+    parser.add_argument("--output", help="file to write the JSON results to (default: stdout)")
+    parser.add_argument("--languages", type=int, default=2)
+    parser.add_argument("--cards", type=int, default=10000)
+    parser.add_argument("--image-fraction", type=float, default=0.1)
+    parser.add_argument("--image-size", type=int, default=50000)
+    parser.add_argument("--distinct-images", type=int, default=100)
+    parser.add_argument("--history-depth", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    cases = args.cases.split(",") if args.cases else list(CASES)
+    unknown = [name for name in cases if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory(prefix="tango-bench-") as tmp_dir:
+        deck = Path(args.deck) if args.deck else Path(tmp_dir) / "deck"
+        deck_summary = None
+        if not (deck / ".tangocho" / "tango.db").exists():
+            deck.mkdir(parents=True, exist_ok=True)
+            print(f"Generating deck in {deck}...", file=sys.stderr)
+            start = time.perf_counter()
+            deck_summary = _run_module("benchmarks.generate_deck", deck,
+                                       "--languages", str(args.languages), "--cards", str(args.cards),
+                                       "--image-fraction", str(args.image_fraction),
+                                       "--image-size", str(args.image_size),
+                                       "--distinct-images", str(args.distinct_images),
+                                       "--history-depth", str(args.history_depth))
+            deck_summary["generate_seconds"] = time.perf_counter() - start
+
+        results = []
+        for name in cases:
+            home = deck
+            if CASES[name].writes:
+                home = Path(tmp_dir) / f"copy-{name}"
+                shutil.copytree(str(deck / ".tangocho"), str(home / ".tangocho"))
+            samples = _run_module("benchmarks.cases", home, name, "--repeat", str(args.repeat))
+            result = _summarize(name, samples)
+            results.append(result)
+            if result['unit'] == "seconds":
+                print(f"{name:30} median {result['median'] * 1000:10.2f} ms"
+                      f"  ({result['median_per_call'] * 1000:.3f} ms/call)", file=sys.stderr)
+            else:
+                print(f"{name:30} median {result['median']:10.0f} {result['unit']}", file=sys.stderr)
+            if home != deck:
+                shutil.rmtree(str(home))
+
+        report = {
+            "meta": {
+                "time": int(time.time()),
+                "git_revision": _git_revision(),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "platform": platform.platform(),
+                "deck": str(deck) if args.deck else None,
+                "generated": deck_summary,
+                "repeat": args.repeat,
+            },
+            "results": results,
+        }
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            json.dump(report, sys.stdout, indent=2)
+            print()
+
+
+if __name__ == "__main__":
+    main()
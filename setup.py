@@ -15,10 +15,16 @@ requirements = [
     'Click>=6.0', 'asciimatics', 'requests', 'python-dateutil',
 ]
 
+extra_requirements = {
+    'forecast': ['numpy'],
+    'images': ['Pillow'],
+}
+
 setup_requirements = [
 ]
 
 test_requirements = [
+    'pytest',
 ]
 
 setup(
@@ -37,6 +43,7 @@ setup(
     },
     include_package_data=True,
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="MIT license",
     zip_safe=False,
     keywords=['education', 'vocabulary', 'spaced repetition'],
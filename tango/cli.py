@@ -2,27 +2,197 @@
 
 import click
 
-from .commands.add import tui as tui_add
-from .commands.study import tui as tui_study
+# Each command imports its module when it runs, so that 'tango --help' and the other commands don't
+# pay for importing asciimatics, requests etc. Keep the imports at the top of this module cheap.
+
+# the choices for import/export --format, here rather than in the command modules for the same reason
+IMPORT_FORMATS = ['csv', 'tsv', 'jsonl', 'anki']
+EXPORT_FORMATS = ['jsonl', 'csv']
 
 
 @click.group()
-def main():
-    pass
+@click.option('--db', 'db_path', type=click.Path(dir_okay=False), envvar='TANGO_DB',
+              help="Database file to use instead of ~/.tangocho/tango.db; ':memory:' for a throwaway one.")
+@click.option('--engine', type=click.Choice(['sqlite', 'memory']), default='sqlite', envvar='TANGO_ENGINE',
+              help="Storage engine; 'memory' keeps the tango-cho in memory until tango exits.")
+def main(db_path, engine):
+    if engine == 'memory' and db_path is not None and db_path != ':memory:':
+        raise click.UsageError("--engine memory doesn't use a database file; leave out --db (or TANGO_DB)")
+    if db_path is not None or engine != 'sqlite':
+        from .storage import configure
+        configure(engine, db_path)
 
 
 @main.command()
 @click.argument('language')
 @click.argument('headword', default="")
 def add(language, headword):
+    from .commands.add import tui as tui_add
     tui_add(language, headword)
 
 
 @main.command()
 @click.argument('language', default='all')
 def study(language):
+    from .commands.study import tui as tui_study
     tui_study(language)
 
 
+@main.command()
+@click.argument('language', default='all')
+@click.option('--batch', is_flag=True,
+              help="Read scores as JSONL from stdin and write the tango to review as JSONL to stdout.")
+def review(language, batch):
+    """Review the tango that are due, like 'tango study'. With --batch, no terminal is needed: each tango
+    is written as a line of JSON, and its score is read as a line like {"score": "OK"} (BAD, OK or GREAT;
+    null skips it)."""
+    if batch:
+        from .commands.review import batch as review_batch
+        review_batch(language)
+    else:
+        from .commands.study import tui as tui_study
+        tui_study(language)
+
+
+@main.command(name='import')
+@click.argument('language')
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(IMPORT_FORMATS),
+              help="File format; guessed from the file extension by default.")
+@click.option('--columns', help="Comma-separated fields of a CSV/TSV file without a header row, or of "
+                                "Anki notes (default: headword,definition).")
+@click.option('--batch-size', default=5000, help="Number of tango to write at once.")
+def import_(language, file, file_format, columns, batch_size):
+    """Add or update (by headword) tango from a CSV, TSV, JSONL or Anki file."""
+    from .commands.bulk_import import run as run_import
+    run_import(language, file, file_format, columns, batch_size)
+
+
+@main.command()
+@click.argument('language', default='all')
+@click.argument('output_dir', default='tango-export', type=click.Path(file_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(EXPORT_FORMATS), default='jsonl')
+@click.option('--schedule/--no-schedule', default=False, help="Include each tango's SM2+ variables.")
+@click.option('--history/--no-history', default=False, help="Also export the review history.")
+@click.option('--images/--no-images', default=True, help="Write images to OUTPUT_DIR/images.")
+def export(language, output_dir, file_format, schedule, history, images):
+    """Export tango to OUTPUT_DIR as JSONL or CSV."""
+    from .commands.export import run as run_export
+    run_export(language, output_dir, file_format, schedule, history, images)
+
+
+@main.command()
+@click.argument('query', nargs=-1, required=True)
+@click.option('--lang', 'language', default='all', help="Only search this language.")
+@click.option('--limit', default=20, help="Maximum number of results.")
+@click.option('--json', 'as_json', is_flag=True, help="Print each result as a line of JSON.")
+def search(query, language, limit, as_json):
+    """Search the headword, pronunciation, definition, example and notes of all tango. End a word with
+    * to match words starting with it."""
+    from .commands.search import run as run_search
+    run_search(" ".join(query), language, limit, as_json)
+
+
+@main.command()
+@click.argument('language', default='all')
+@click.option('--days', default=30, help="Number of days to forecast.")
+@click.option('--scores', default="0.1,0.3,0.6",
+              help="Assumed probabilities of scoring Bad, OK and Great.")
+@click.option('--seed', type=int, help="Random seed, for repeatable forecasts.")
+@click.option('--json', 'as_json', is_flag=True, help="Print the forecast as JSON.")
+def forecast(language, days, scores, seed, as_json):
+    """Forecast the number of reviews due each day."""
+    from .commands.forecast import run as run_forecast
+    run_forecast(language, days, scores, seed, as_json)
+
+
+@main.command()
+@click.argument('language', default='all')
+@click.option('--days', default=30, help="Number of days to show reviews for.")
+@click.option('--json', 'as_json', is_flag=True, help="Print the statistics as JSON.")
+def stats(language, days, as_json):
+    """Show review counts, retention and the number of tango due."""
+    from .commands.stats import run as run_stats
+    run_stats(language, days, as_json)
+
+
+@main.command(name='rebuild-schedule')
+@click.option('--batch-size', default=10000, help="Number of rows to write at once.")
+@click.confirmation_option(prompt="This replaces the study schedule of every tango. Continue?")
+def rebuild_schedule(batch_size):
+    """Recompute the study schedule of every tango by replaying the review history."""
+    from .commands.rebuild_schedule import run as run_rebuild_schedule
+    run_rebuild_schedule(batch_size)
+
+
+@main.command(name='sync-export')
+@click.argument('peer')
+@click.argument('output_file', type=click.Path(dir_okay=False))
+@click.option('--full', is_flag=True, help="Export every tango and review, not just those since the last export.")
+@click.option('--images/--no-images', default=True,
+              help="Include the images of changed tango; without them, the peer downloads them again.")
+def sync_export(peer, output_file, full, images):
+    """Write the tango changed and the reviews logged since the last export to PEER (any name for the
+    other tango-cho) to OUTPUT_FILE, for 'tango sync-import' there."""
+    from .commands.sync import export
+    export(peer, output_file, full, images)
+
+
+@main.command(name='sync-import')
+@click.argument('peer')
+@click.argument('input_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=1000, help="Number of tango or reviews to merge at once.")
+def sync_import(peer, input_file, batch_size):
+    """Merge the changes in INPUT_FILE, written by 'tango sync-export' on PEER, into this tango-cho. They
+    won't be exported back to PEER."""
+    from .commands.sync import import_
+    import_(peer, input_file, batch_size)
+
+
+@main.group()
+def images():
+    """Manage the images of tango."""
+
+
+@images.command(name='backfill')
+@click.option('--workers', default=8, help="Number of images to download at once.")
+@click.option('--per-host', default=2, help="Number of images to download at once from the same host.")
+@click.option('--batch-size', default=50, help="Number of downloads to write at once.")
+@click.option('--max-attempts', type=int, help="Skip images that already failed this many times.")
+def images_backfill(workers, per_host, batch_size, max_attempts):
+    """Download the images of all tango with an image URL but no image, including those that failed
+    before. Can be interrupted and run again to continue."""
+    from .commands.images import backfill
+    backfill(workers, per_host, batch_size, max_attempts)
+
+
+@main.group()
+def profile():
+    """Summarize the timings recorded by running tango with TANGO_PROFILE=1."""
+
+
+@profile.command(name='report')
+@click.option('--json', 'as_json', is_flag=True, help="Print each operation's summary as a line of JSON.")
+def profile_report(as_json):
+    """Show percentiles of the time taken by each model query, SM2+ update and screen."""
+    from .commands.profile import report
+    report(as_json)
+
+
+@profile.command(name='clear')
+def profile_clear():
+    """Delete the recorded timings."""
+    from .commands.profile import clear
+    clear()
+
+
+@main.command()
+@click.option('--batch-size', default=10000, help="Number of rows to rewrite per transaction.")
+def migrate(batch_size):
+    """Update an existing tango-cho to the current database format."""
+    from .commands.migrate import run as run_migrate
+    run_migrate(batch_size)
+
+
 if __name__ == "__main__":
     main()
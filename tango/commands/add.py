@@ -10,32 +10,38 @@ from asciimatics.widgets import Frame, Layout, Text, \
     Button, TextBox
 
 from .. import utils
+from ..downloads import ImageDownloader, MAX_DOWNLOAD_ATTEMPTS
+from ..lookups import LookupCache, LookupWarmer
 from ..model import get_model
-from ..utils import debug_print, PRON_LANGS, ExternalCallException
+from ..profiling import profiled
+from ..utils import PRON_LANGS, ExternalCallException, DictionaryLookupException
 
 class TangoModel(object):
     def __init__(self, language, headword):
         self.language = language
         self.default_headword = headword
         self._model = get_model()
+        # Fills in images for added tango without holding up the TUI
+        self.downloader = ImageDownloader()
+        # Dictionary entries are looked up while the headword is typed, so that ctrl-f shows them instantly
+        self.lookup_cache = LookupCache()
+        self.lookup_warmer = LookupWarmer(self.lookup_cache)
         # Current tango when editing.
         self.current_id = None
 
     def add(self, tango):
         tango['image_url'] = tango['image_url'].strip()
-        if tango['image_url']:
-            try:
-                tango['image_base64'] = utils.get_url_as_base64text(tango['image_url'])
-            except Exception as e:
-                debug_print("Error: Could not download image: " + str(e))
+        # add_tango queues the image download
         self.current_id = self._model.add_tango(self.language, tango)
+        if tango['image_url'] and not tango.get('image_hash'):
+            self.downloader.notify(self.current_id)
 
     def get_current_contact(self):
         if self.current_id is None:
             headword = self.default_headword if self.default_headword else ""
             pronunciation = headword if headword else ""
             return {"headword": headword, "pronunciation": pronunciation, "morphology": "", "definition": "", "example": "", "notes": "",
-                    "image_url": "", "image_base64": "", "source": ""}
+                    "image_url": "", "image_hash": None, "source": ""}
         else:
             return self._model.get_tango(self.language, self.current_id)
 
@@ -74,7 +80,8 @@ class TangoView(Frame):
         layout = Layout([100], fill_frame=True)
         self.add_layout(layout)
 
-        headword_widget = Text("Headword", "headword")
+        headword_widget = Text("Headword", "headword",
+                               on_change=lambda: model.lookup_warmer.warm(model.language, headword_widget.value))
         headword_widget._on_focus = note_focus("headword")
         layout.add_widget(headword_widget)
 
@@ -94,6 +101,7 @@ class TangoView(Frame):
         layout2.add_widget(Button("Cancel", self._quit), 3)
         self.fix()
 
+    @profiled("screen.TangoView")
     def reset(self):
         # Do standard reset to clear out form, then populate with new data.
         super(TangoView, self).reset()
@@ -137,7 +145,7 @@ class TangoView(Frame):
             elif c == 6 and self.data['headword'].strip():
                 if self._model.current_focus in ['definition', 'headword', 'pronunciation', 'morphology', 'source']:
                     self.save()
-                    raise ExternalCallException(self._scene, utils.get_dictionary_command(self._model.language, self.data["headword"].strip()))
+                    raise DictionaryLookupException(self._scene, self._model.language, self.data["headword"].strip())
                     # webbrowser.open(utils.get_dictionary_url(self._model.language, self.data['headword']))
                 if self._model.current_focus == 'example':
                     for url in utils.get_example_urls(self._model.language, self.data["headword"]):
@@ -161,6 +169,9 @@ def tui(language, headword):
     tango_model = TangoModel(language, headword)
     if not get_model().validate_language(language):
         return
+    # only downloads the images of the tango added now; others are left to 'tango images backfill'
+    tango_model.downloader.start()
+    tango_model.lookup_warmer.start()
     last_scene = None
     while True:
         try:
@@ -169,9 +180,23 @@ def tui(language, headword):
                 print("Saved word and quit")
             else:
                 print("Quit without saving word")
+            tango_model.lookup_warmer.stop()
+            try:
+                if get_model().get_image_downloads(MAX_DOWNLOAD_ATTEMPTS, tango_model.downloader.tango_ids):
+                    print("Finishing image downloads (Ctrl-C to leave them for next time)...")
+                tango_model.downloader.stop(finish_queue=True)
+            except KeyboardInterrupt:
+                pass
             sys.exit(0)
         except ResizeScreenError as e:
             last_scene = e.scene
+        except DictionaryLookupException as e:
+            last_scene = e.last_scene
+            try:
+                e.page(tango_model.lookup_cache)
+            except KeyboardInterrupt:
+                # let less handle this, -K will exit cleanly
+                pass
         except ExternalCallException as e:
             last_scene = e.last_scene
             try:
@@ -0,0 +1,130 @@
+import csv
+import json
+import sqlite3
+import tempfile
+import zipfile
+from pathlib import Path
+
+import click
+
+from ..model import get_model, lang_fields
+
+# columns assumed for files without a header row, and for Anki note fields
+DEFAULT_COLUMNS = ['headword', 'definition']
+
+# fields that can be imported; the rest are managed by tango
+IMPORT_FIELDS = [field for field in lang_fields if field not in ('created', 'image_hash')]
+
+
+def _guess_format(path):
+    suffix = path.suffix.lower()
+    if suffix == '.csv':
+        return 'csv'
+    elif suffix in ('.tsv', '.tab', '.txt'):
+        return 'tsv'
+    elif suffix in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    elif suffix in ('.apkg', '.anki2', '.anki21'):
+        return 'anki'
+    raise click.UsageError(f"Can't tell the format of {path}; use --format")
+
+
+def _to_tango(values, columns):
+    tango = {column: value for column, value in zip(columns, values) if column in IMPORT_FIELDS}
+    if tango.get('headword'):
+        return tango
+    return None
+
+
+def read_delimited(path, delimiter, columns=None):
+    """Generate tango from a CSV/TSV file. The first row is used as the header if it names a headword
+    column; otherwise the given columns (default: headword, definition) are assumed."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        rows = csv.reader(f, delimiter=delimiter)
+        first_row = next(rows, None)
+        if first_row is None:
+            return
+        if columns is None and 'headword' in [c.strip().lower() for c in first_row]:
+            columns = [c.strip().lower() for c in first_row]
+        else:
+            columns = columns or DEFAULT_COLUMNS
+            rows = _chain_row(first_row, rows)
+        for row in rows:
+            tango = _to_tango(row, columns)
+            if tango:
+                yield tango
+
+
+def _chain_row(first_row, rows):
+    yield first_row
+    yield from rows
+
+
+def read_jsonl(path):
+    """Generate tango from a file with one JSON object per line"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                tango = _to_tango(entry.values(), entry.keys())
+                if tango:
+                    yield tango
+
+
+def read_anki(path, columns=None):
+    """Generate tango from the notes of an Anki deck package (.apkg) or collection (.anki2). Note
+    fields are mapped to the given columns in order (default: headword, definition)."""
+    columns = columns or DEFAULT_COLUMNS
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as package:
+                names = package.namelist()
+                # newer Anki versions put the real collection in collection.anki21
+                if 'collection.anki21' in names:
+                    name = 'collection.anki21'
+                elif 'collection.anki21b' in names:
+                    # Anki 2.1.50 and later compress it with zstd and leave only a note asking to
+                    # update Anki in collection.anki2
+                    raise click.ClickException(
+                        f"{path} was exported in the format of Anki 2.1.50 and later, which tango can't read. "
+                        "Export the deck again with 'Support older Anki versions' checked.")
+                else:
+                    name = 'collection.anki2'
+                collection_path = package.extract(name, tmp_dir)
+        else:
+            collection_path = path
+        collection = sqlite3.connect(str(collection_path))
+        try:
+            for (fields,) in collection.execute("SELECT flds FROM notes ORDER BY id"):
+                tango = _to_tango(fields.split('\x1f'), columns)
+                if tango:
+                    yield tango
+        finally:
+            collection.close()
+
+
+def read_tango(path, file_format, columns=None):
+    if file_format == 'csv':
+        return read_delimited(path, ',', columns)
+    elif file_format == 'tsv':
+        return read_delimited(path, '\t', columns)
+    elif file_format == 'jsonl':
+        return read_jsonl(path)
+    else:
+        return read_anki(path, columns)
+
+
+def run(lang, path, file_format, columns, batch_size):
+    """Add or update (by headword) the tango in the given file."""
+    path = Path(path)
+    file_format = file_format or _guess_format(path)
+    if columns:
+        columns = [c.strip().lower() for c in columns.split(',')]
+        unknown = [c for c in columns if c not in IMPORT_FIELDS]
+        if unknown:
+            raise click.UsageError(f"Unknown columns: {', '.join(unknown)}. Choose from {', '.join(IMPORT_FIELDS)}")
+    model = get_model()
+    if not model.validate_language(lang):
+        return
+    added, updated = model.import_tango(lang, read_tango(path, file_format, columns), batch_size)
+    click.echo(f"Added {added} and updated {updated} tango for {lang}", err=True)
@@ -0,0 +1,76 @@
+import csv
+import json
+from pathlib import Path
+
+import click
+
+from ..model import get_model, lang_fields
+
+TANGO_COLUMNS = ['lang', 'id'] + lang_fields
+SCHEDULE_COLUMNS = ['difficulty', 'daysBetweenReviews', 'dateLastReviewed', 'nextDue']
+HISTORY_COLUMNS = ['id', 'lang', 'tango_id', 'timestamp', 'score', 'data']
+
+
+class _RowWriter:
+    """Writes rows with the given columns to a JSONL or CSV file"""
+
+    def __init__(self, f, file_format, columns):
+        self._f = f
+        self._columns = columns
+        if file_format == 'csv':
+            self._csv = csv.writer(f)
+            self._csv.writerow(columns)
+        else:
+            self._csv = None
+
+    def write(self, row):
+        if self._csv:
+            self._csv.writerow([row.get(column) for column in self._columns])
+        else:
+            self._f.write(json.dumps({column: row.get(column) for column in self._columns}, ensure_ascii=False))
+            self._f.write('\n')
+
+
+def _export_image(model, image_hash, image_dir):
+    """Write the image to image_dir/<hash>, unless an earlier tango already did"""
+    path = image_dir / image_hash
+    if path.exists():
+        return
+    image_dir.mkdir(exist_ok=True)
+    partial_path = path.with_suffix('.part')
+    with open(partial_path, 'wb') as f:
+        for chunk in model.iter_image_chunks(image_hash):
+            f.write(chunk)
+    partial_path.rename(path)
+
+
+def run(lang, output_dir, file_format, with_schedule, with_history, with_images):
+    """Write the tango (and optionally their schedules, review history and images) of the given
+    language to output_dir. Rows are streamed from the database, so memory use doesn't depend on
+    the size of the deck. Images are written to output_dir/images, named by their image_hash."""
+    model = get_model()
+    if lang != 'all' and lang not in model.get_languages():
+        raise click.BadParameter(f"No tango-cho for '{lang}' exists", param_hint='LANGUAGE')
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    image_dir = output_dir / 'images'
+
+    columns = TANGO_COLUMNS + (SCHEDULE_COLUMNS if with_schedule else [])
+    count = 0
+    with open(output_dir / f'tango.{file_format}', 'w', newline='', encoding='utf-8') as f:
+        writer = _RowWriter(f, file_format, columns)
+        for tango in model.iter_tango(lang, with_schedule, TANGO_COLUMNS):
+            writer.write(tango)
+            if with_images and tango['image_hash']:
+                _export_image(model, tango['image_hash'], image_dir)
+            count += 1
+    click.echo(f"Exported {count} tango", err=True)
+
+    if with_history:
+        count = 0
+        with open(output_dir / f'review_history.{file_format}', 'w', newline='', encoding='utf-8') as f:
+            writer = _RowWriter(f, file_format, HISTORY_COLUMNS)
+            for review in model.iter_review_history(lang):
+                writer.write(review)
+                count += 1
+        click.echo(f"Exported {count} reviews", err=True)
@@ -0,0 +1,42 @@
+import json
+import time
+
+import click
+
+from ..utils import get_current_timestamp
+
+
+def _parse_probabilities(text):
+    try:
+        probabilities = [float(p) for p in text.split(',')]
+    except ValueError:
+        probabilities = []
+    if len(probabilities) != 3 or min(probabilities) < 0 or sum(probabilities) <= 0:
+        raise click.BadParameter("expected three non-negative numbers, like 0.1,0.3,0.6", param_hint='--scores')
+    return probabilities
+
+
+def run(lang, days, scores, seed, as_json):
+    """Print how many reviews will be due on each of the next days, simulating the scores given."""
+    try:
+        import numpy as np
+        from ..forecast import Schedule, simulate
+    except ImportError:
+        raise click.ClickException("tango forecast needs NumPy; install it with 'pip install numpy'")
+    probabilities = _parse_probabilities(scores)
+    schedule = Schedule.load(lang)
+    now = get_current_timestamp()
+    overdue = int(np.count_nonzero(schedule.percent_overdue(now) >= 1))
+    # days start at local midnight
+    start = int(time.mktime(time.localtime(now)[:3] + (0, 0, 0, 0, 0, -1)))
+    counts = simulate(schedule, start, days, probabilities, np.random.default_rng(seed))
+    dates = [time.strftime('%Y-%m-%d', time.localtime(start + day * 24 * 60 * 60)) for day in range(days)]
+
+    if as_json:
+        click.echo(json.dumps({"tango": len(schedule), "due_now": overdue,
+                               "days": [{"date": date, "reviews": count} for date, count in zip(dates, counts)]}))
+        return
+    click.echo(f"{len(schedule)} tango, {overdue} due now")
+    width = max(counts + [1])
+    for date, count in zip(dates, counts):
+        click.echo(f"{date} {count:>8} {'#' * round(40 * count / width)}")
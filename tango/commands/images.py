@@ -0,0 +1,110 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+import click
+
+from ..model import get_model
+from ..utils import debug_print, get_url_content
+
+
+def _host(url):
+    # data: URLs need no connection, but are still limited like any other host
+    parts = urlsplit(url)
+    return parts.hostname or parts.scheme
+
+
+class _Scheduler:
+    """Hands out queued downloads for at most per_host concurrent downloads from the same host, going
+    round the hosts so that one slow host doesn't hold up the others"""
+
+    def __init__(self, downloads, per_host):
+        self._per_host = per_host
+        self._pending = {}
+        for download in downloads:
+            self._pending.setdefault(_host(download['url']), deque()).append(download)
+        self._hosts = deque(self._pending)
+        self._active = dict.fromkeys(self._pending, 0)
+
+    def __bool__(self):
+        return bool(self._hosts)
+
+    def next(self):
+        """Return the next download that can be started now, or None"""
+        for _ in range(len(self._hosts)):
+            host = self._hosts[0]
+            self._hosts.rotate(-1)
+            if self._active[host] < self._per_host:
+                download = self._pending[host].popleft()
+                if not self._pending[host]:
+                    self._hosts.remove(host)
+                self._active[host] += 1
+                return download
+        return None
+
+    def done(self, download):
+        self._active[_host(download['url'])] -= 1
+
+
+def backfill(workers, per_host, batch_size, max_attempts):
+    """Download the images of all tango with an image_url but no image."""
+    model = get_model()
+    queued = model.queue_missing_image_downloads()
+    downloads = [download for download in model.get_image_downloads()
+                 if max_attempts is None or download['attempts'] < max_attempts]
+    if not downloads:
+        click.echo("No images left to download")
+        return
+    click.echo(f"Downloading {len(downloads)} images ({queued} newly queued)...", err=True)
+
+    start = time.perf_counter()
+    scheduler = _Scheduler(downloads, per_host)
+    finished = []
+    failed = []
+    finished_count = failed_count = 0
+
+    def write(force=False):
+        # each batch is one transaction, and only removes the downloads it stores from the queue, so an
+        # interrupted backfill picks up where it left off
+        nonlocal finished, failed, finished_count, failed_count
+        if not (finished or failed) or not (force or len(finished) + len(failed) >= batch_size):
+            return
+        if finished:
+            model.finish_image_downloads(finished)
+            finished_count += len(finished)
+            finished = []
+        if failed:
+            model.fail_image_downloads(failed)
+            failed_count += len(failed)
+            failed = []
+        click.echo(f"{finished_count} downloaded, {failed_count} failed, "
+                   f"{len(downloads) - finished_count - failed_count} to go", err=True)
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill")
+    running = {}
+    try:
+        while scheduler or running:
+            while len(running) < workers:
+                download = scheduler.next()
+                if download is None:
+                    break
+                running[executor.submit(get_url_content, download['url'])] = download
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                download = running.pop(future)
+                scheduler.done(download)
+                try:
+                    finished.append((download, future.result()))
+                except Exception as e:
+                    debug_print(f"Error: Could not download image {download['url']}: {e}")
+                    failed.append((download, e))
+            write()
+    except KeyboardInterrupt:
+        click.echo("Interrupted; run 'tango images backfill' again to download the rest", err=True)
+    finally:
+        # downloads still running are abandoned and stay queued
+        executor.shutdown(wait=False, cancel_futures=True)
+        write(force=True)
+    click.echo(f"Downloaded {finished_count} images and failed {failed_count} in "
+               f"{time.perf_counter() - start:.1f}s", err=True)
@@ -0,0 +1,20 @@
+import click
+
+from ..migrations import migrate
+from ..storage import get_engine
+
+
+def run(batch_size):
+    """Bring the tango-cho database up to date with this version of tango."""
+    engine = get_engine()
+    if not engine.exists():
+        click.echo("No tango-cho exists yet; nothing to migrate")
+        return
+    db = engine.connect()
+    try:
+        if migrate(db, batch_size, echo=click.echo):
+            click.echo("Migration complete")
+        else:
+            click.echo("The tango-cho is already up to date")
+    finally:
+        db.close()
@@ -0,0 +1,45 @@
+import json
+
+import click
+
+from ..profiling import percentile, profile_path, read_profile
+
+PERCENTILES = [0.5, 0.9, 0.99]
+
+
+def report(as_json):
+    """Print the count, percentiles and total time of each operation recorded with TANGO_PROFILE=1."""
+    if not profile_path.exists():
+        click.echo("No profile recorded yet; run tango with TANGO_PROFILE=1 first")
+        return
+    summaries = []
+    for operation, timings in read_profile().items():
+        timings.sort()
+        summaries.append({
+            "operation": operation,
+            "count": len(timings),
+            # in milliseconds
+            **{f"p{round(fraction * 100)}": percentile(timings, fraction) * 1000 for fraction in PERCENTILES},
+            "max": timings[-1] * 1000,
+            "total": sum(timings) * 1000,
+        })
+    # the operations that took the most time overall first
+    summaries.sort(key=lambda summary: summary["total"], reverse=True)
+
+    if as_json:
+        for summary in summaries:
+            click.echo(json.dumps(summary))
+        return
+    width = max([len(summary["operation"]) for summary in summaries] + [len("Operation")]) + 2
+    click.echo(f"{'Operation':<{width}}{'Count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'Max ms':>10}"
+               f"{'Total ms':>11}")
+    for summary in summaries:
+        click.echo(f"{summary['operation']:<{width}}{summary['count']:>8}{summary['p50']:>10.2f}"
+                   f"{summary['p90']:>10.2f}{summary['p99']:>10.2f}{summary['max']:>10.2f}{summary['total']:>11.1f}")
+
+
+def clear():
+    """Delete the recorded timings."""
+    if profile_path.exists():
+        profile_path.unlink()
+    click.echo("Cleared the profile")
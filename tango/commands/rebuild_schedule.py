@@ -0,0 +1,16 @@
+import time
+
+import click
+
+from ..model import get_model
+from ..sm2_plus import rebuild_schedule
+from ..utils import get_current_timestamp
+
+
+def run(batch_size):
+    """Recompute every tango's SM2+ variables from the review history."""
+    start = time.perf_counter()
+    count = rebuild_schedule(batch_size)
+    due = len(get_model().get_due_tango('all', get_current_timestamp()))
+    click.echo(f"Rebuilt the schedule of {count} tango in {time.perf_counter() - start:.1f}s; {due} are due now",
+               err=True)
@@ -0,0 +1,61 @@
+import json
+import sys
+
+import click
+
+from ..model import get_model, Score
+from ..study_session import StudySession
+
+
+def _write_line(line_type, **fields):
+    click.echo(json.dumps({"type": line_type, **fields}, ensure_ascii=False))
+
+
+def _parse_answer(line, tango):
+    """Return the Score (or None to skip) of an answer line about the tango, or raise ValueError"""
+    answer = json.loads(line)
+    if not isinstance(answer, dict):
+        raise ValueError("expected a JSON object")
+    if 'id' in answer and (answer['id'], answer.get('lang', tango['lang'])) != (tango['id'], tango['lang']):
+        raise ValueError(f"expected a score for tango {tango['lang']}:{tango['id']}")
+    if 'score' not in answer:
+        raise ValueError("missing score")
+    if answer['score'] is None:
+        return None
+    try:
+        return Score[str(answer['score']).upper()]
+    except KeyError:
+        raise ValueError(f"unknown score {answer['score']!r}; expected one of {', '.join(Score.__members__)}")
+
+
+def batch(lang):
+    """Review without a terminal: write each tango to study to stdout as a line of JSON, and read its score
+    from stdin as a line of JSON, e.g. {"score": "OK"}. A null score skips the tango. Ends when no tango
+    are left or stdin is closed, with a line counting the reviews."""
+    if lang != 'all' and lang not in get_model().get_languages():
+        raise click.BadParameter(f"no tango-cho for '{lang}' exists", param_hint='LANGUAGE')
+    session = StudySession(lang)
+    tango = session.next()
+    try:
+        if tango is not None:
+            _write_line("tango", **tango)
+        while tango is not None:
+            line = sys.stdin.readline()
+            if not line:
+                break
+            try:
+                score = _parse_answer(line, tango)
+            except ValueError as e:
+                # the same tango is still waiting for its score
+                _write_line("error", message=str(e))
+                continue
+            if score is not None:
+                session.record(tango, score)
+            tango = session.next()
+            if tango is not None:
+                _write_line("tango", **tango)
+    finally:
+        session.finish()
+    # a tango that was shown but not answered is left as well
+    _write_line("end", reviewed=session.reviewed, scores=session.scores,
+                left=len(session) + (tango is not None))
@@ -0,0 +1,30 @@
+import json
+
+import click
+
+from ..model import get_model
+
+
+def _one_line(text, width):
+    text = " ".join((text or "").split())
+    return text if len(text) <= width else text[:width - 1] + "…"
+
+
+def run(query, lang, limit, as_json):
+    """Print the tango that best match the query."""
+    model = get_model()
+    if lang != 'all' and lang not in model.get_languages():
+        raise click.BadParameter(f"no tango-cho for '{lang}' exists", param_hint='--lang')
+    results = model.search_tango(query, lang, limit)
+    if as_json:
+        for tango in results:
+            click.echo(json.dumps(dict(tango), ensure_ascii=False))
+        return
+    if not results:
+        click.echo("No matches", err=True)
+        return
+    for tango in results:
+        pronunciation = f" [{tango['pronunciation']}]" if tango['pronunciation'] else ""
+        click.echo(f"{tango['lang']}:{tango['id']}  {tango['headword']}{pronunciation}")
+        if tango['definition']:
+            click.echo(f"    {_one_line(tango['definition'], 76)}")
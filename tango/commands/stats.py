@@ -0,0 +1,68 @@
+import json
+import time
+
+import click
+
+from ..model import get_model
+from ..sm2_plus import correct_threshold, performance_ratings
+from ..utils import get_current_timestamp
+
+
+def _is_correct(score):
+    # scores are stored as str(Score), e.g. 'Score.GREAT'
+    return performance_ratings.get(score.split('.')[-1], 0) >= correct_threshold
+
+
+def _retention(reviews, correct):
+    return correct / reviews if reviews else None
+
+
+def _percent(fraction):
+    return "-" if fraction is None else f"{fraction:.1%}"
+
+
+def run(lang, days, as_json):
+    """Print review counts per day, retention by score and per-language counts."""
+    model = get_model()
+    if lang != 'all' and lang not in model.get_languages():
+        raise click.BadParameter(f"no tango-cho for '{lang}' exists", param_hint='LANGUAGE')
+    now = get_current_timestamp()
+    daily_since = time.strftime('%Y-%m-%d', time.localtime(now - (days - 1) * 24 * 60 * 60))
+
+    languages = {row['lang']: dict(row, reviews=0, correct=0) for row in model.get_language_counts(now)
+                 if lang in ('all', row['lang'])}
+    scores = {}
+    per_day = {}
+    for row in model.get_review_stats(lang):
+        score = row['score'].split('.')[-1]
+        correct = row['reviews'] if _is_correct(row['score']) else 0
+        if row['lang'] in languages:
+            languages[row['lang']]['reviews'] += row['reviews']
+            languages[row['lang']]['correct'] += correct
+        scores[score] = scores.get(score, 0) + row['reviews']
+        if row['day'] >= daily_since:
+            day = per_day.setdefault(row['day'], {"day": row['day'], "reviews": 0, "correct": 0})
+            day['reviews'] += row['reviews']
+            day['correct'] += correct
+    for stats in list(languages.values()) + list(per_day.values()):
+        stats['retention'] = _retention(stats['reviews'], stats['correct'])
+    total = sum(scores.values())
+
+    if as_json:
+        click.echo(json.dumps({"languages": list(languages.values()), "scores": scores,
+                               "days": [per_day[day] for day in sorted(per_day)]}))
+        return
+    click.echo(f"{'Language':<12}{'Tango':>9}{'Due':>9}{'Reviews':>10}{'Retention':>11}")
+    for stats in languages.values():
+        click.echo(f"{stats['lang']:<12}{stats['tango']:>9}{stats['due']:>9}{stats['reviews']:>10}"
+                   f"{_percent(stats['retention']):>11}")
+    click.echo()
+    click.echo("Reviews by score: " + (", ".join(f"{score} {count} ({count / total:.1%})"
+                                                 for score, count in sorted(scores.items())) or "none"))
+    click.echo()
+    click.echo(f"Reviews per day, last {days} days:")
+    width = max([day['reviews'] for day in per_day.values()] + [1])
+    for day in sorted(per_day):
+        stats = per_day[day]
+        click.echo(f"{day} {stats['reviews']:>6} {_percent(stats['retention']):>7} "
+                   f"{'#' * round(40 * stats['reviews'] / width)}")
@@ -1,35 +1,114 @@
-from subprocess import Popen, PIPE
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import sys
+import threading
+import time
 
+import click
 from asciimatics.event import KeyboardEvent
 from asciimatics.exceptions import ResizeScreenError, NextScene, StopApplication
 from asciimatics.scene import Scene
 from asciimatics.screen import Screen
 from asciimatics.widgets import Frame, Layout, Text, Button, TextBox
 
-from ..model import get_model, Score
-from ..sm2_plus import update_sm2p, prioritize_study
-from ..utils import debug_print, ascii_ctrl_diff, PRON_LANGS, ImgCatException
+from .. import profiling
+from ..model import get_model, Model, Score
+from ..study_session import StudySession
+from ..utils import debug_print, ascii_ctrl_diff, PRON_LANGS, suspended_screen
+
+class TangoLoader():
+    """Loads the full tango for (lang, id) keys on demand. Only the current, previous and next few
+    tango are kept in memory, and the next ones are fetched in the background."""
+    prefetch_count = 3
+
+    def __init__(self):
+        # (lang, id) -> Future for the loaded tango
+        self._loaded = {}
+        self._current = None
+        # the loading thread reads through its own connection, so that it doesn't contend with the UI
+        # thread for its connection and the review transaction that may be open on it
+        self._thread_data = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=1, initializer=self._open_model)
+
+    def _open_model(self):
+        self._thread_data.model = Model()
+
+    def _load(self, key):
+        return self._thread_data.model.get_tango(*key)
+
+    def _request(self, key):
+        if key not in self._loaded:
+            self._loaded[key] = self._executor.submit(self._load, key)
+        return self._loaded[key]
+
+    def get(self, key, upcoming=()):
+        """Return the tango for key, and start loading the upcoming ones"""
+        future = self._request(key)
+        for upcoming_key in upcoming:
+            self._request(upcoming_key)
+        keep = {key, self._current, *upcoming}
+        for loaded_key in list(self._loaded):
+            if loaded_key not in keep:
+                del self._loaded[loaded_key]
+        self._current = key
+        return future.result()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PaintLatency():
+    """Measures the time from a keypress to the screen being painted with its result. Only the most
+    recent measurements are kept, so this stays small however long the session gets."""
+
+    def __init__(self, window=1000):
+        self._pressed = None
+        self.recent = deque(maxlen=window)
+
+    def key_pressed(self):
+        # several keys read in the same frame are painted together; time from the first one
+        if self._pressed is None:
+            self._pressed = time.perf_counter()
+
+    def painted(self):
+        if self._pressed is None:
+            return
+        latency = time.perf_counter() - self._pressed
+        self._pressed = None
+        self.recent.append(latency)
+        if profiling.enabled:
+            profiling.record("study.keypress_to_paint", latency)
 
-performance_ratings = {
-    Score.BAD: 0.0,
-    Score.OK: 0.5,
-    Score.GREAT: 1.0,
-}
+    def summary(self):
+        if not self.recent:
+            return "Keypress to paint: no keypresses"
+        latencies = sorted(self.recent)
+        return (f"Keypress to paint over the last {len(latencies)} keypresses: "
+                f"p50 {profiling.percentile(latencies, 0.5) * 1000:.1f}ms, "
+                f"p99 {profiling.percentile(latencies, 0.99) * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms")
 
 
 class ViewState():
-    def __init__(self, entries, lang):
-        self.entries = entries
-        self.lang = lang
+    def __init__(self, session):
+        self.session = session
+        self.queue = session.queue
+        self.lang = session.lang
+        # (lang, id) of the tango shown so far, so that we can go back to them
+        self.shown = [session.next_key()]
         self.tango_index = 0
+        self.loader = TangoLoader()
+        self.latency = PaintLatency()
 
     def current_tango(self):
-        return self.entries[self.tango_index]
+        upcoming = self.shown[self.tango_index + 1:] + self.queue.peek(self.loader.prefetch_count)
+        return self.loader.get(self.shown[self.tango_index], upcoming[:self.loader.prefetch_count])
 
     def next_tango(self):
-        if len(self.entries) == self.tango_index - 1:
-            raise StopApplication("Reached end of tango")
+        if self.tango_index + 1 == len(self.shown):
+            key = self.session.next_key()
+            if key is None:
+                raise StopApplication("Reached end of tango")
+            self.shown.append(key)
         self.tango_index += 1
 
     def previous_tango(self):
@@ -37,19 +116,50 @@ class ViewState():
             return
         self.tango_index -= 1
 
+    def reviewed(self, tango, score):
+        self.session.record(tango, score)
+
+
+class TangoFrame(Frame):
+    """A view of the current tango. The frame and its widgets are built once per screen; moving to
+    another tango only updates the widgets' contents."""
 
-class FrontView(Frame):
-    def __init__(self, screen, entries, view_state):
-        super(FrontView, self).__init__(screen,
-                                        screen.height * 2 // 3,
-                                        screen.width * 2 // 3,
-                                        hover_focus=True,
-                                        title="Tango",
-                                        reduce_cpu=True)
+    def __init__(self, screen, view_state):
+        super(TangoFrame, self).__init__(screen,
+                                         screen.height * 2 // 3,
+                                         screen.width * 2 // 3,
+                                         hover_focus=True,
+                                         title="Tango",
+                                         reduce_cpu=True)
         self.disabled = True
-        self.entries = entries
         self.view_state = view_state
-        self.data = view_state.current_tango()
+        # added to a layout by the subclass; only enabled for tango with an image
+        self._pic_button = Button("Pic [p]", self._pic)
+
+    @staticmethod
+    def _exit():
+        raise StopApplication("User terminated app")
+
+    def reset(self):
+        # Do standard reset to clear out form, then populate with new data.
+        super(TangoFrame, self).reset()
+        self._show_tango()
+
+    def _show_tango(self):
+        self.data = self.view_state.current_tango()
+        self._pic_button.disabled = not self.data["image_hash"]
+
+    def _pic(self):
+        if self.data["image_hash"]:
+            from ..images import print_image
+            # show the picture without tearing down the screen
+            with suspended_screen(self.screen):
+                print_image(get_model(), self.data)
+
+
+class FrontView(TangoFrame):
+    def __init__(self, screen, view_state):
+        super(FrontView, self).__init__(screen, view_state)
 
         # Create the form for displaying the list of contacts.
         layout = Layout([100], fill_frame=True)
@@ -64,36 +174,29 @@ class FrontView(Frame):
         layout2.add_widget(Button("Back [b]", self._back), 0)
         layout2.add_widget(Button("Next [n]", self._next), 0)
         layout2.add_widget(Button("Flip [f]", self._flip), 2)
-        if(self.data["image_base64"]):
-            layout2.add_widget(Button("Pic [p]", self._pic), 2)
+        layout2.add_widget(self._pic_button, 2)
         layout2.add_widget(Button("Exit [q]", self._exit), 3)
         self.fix()
+        self._show_tango()
 
-    @staticmethod
-    def _exit():
-        raise StopApplication("User terminated app")
-
-    def reset(self):
-        # Do standard reset to clear out form, then populate with new data.
-        super(FrontView, self).reset()
-        self.data = self.view_state.current_tango()
+    @profiling.profiled("screen.FrontView")
+    def _show_tango(self):
+        super(FrontView, self)._show_tango()
 
     def _next(self):
         self.view_state.next_tango()
-        raise NextScene("FrontView")
+        self._show_tango()
 
     def _back(self):
         self.view_state.previous_tango()
-        raise NextScene("FrontView")
+        self._show_tango()
 
     def _flip(self):
         raise NextScene("BackView")
 
-    def _pic(self):
-        raise ImgCatException(self._scene, self.data)
-
     def process_event(self, event):
         if isinstance(event, KeyboardEvent):
+            self.view_state.latency.key_pressed()
             c = event.key_code
             # b for back
             if c in (2, 2 + ascii_ctrl_diff):
@@ -122,18 +225,9 @@ class FrontView(Frame):
         return super(FrontView, self).process_event(event)
 
 
-class BackView(Frame):
-    def __init__(self, screen, entries, view_state):
-        super(BackView, self).__init__(screen,
-                                       screen.height * 2 // 3,
-                                       screen.width * 2 // 3,
-                                       hover_focus=True,
-                                       title="Tango",
-                                       reduce_cpu=True)
-        self.disabled = True
-        self.entries = entries
-        self.view_state = view_state
-        self.data = view_state.current_tango()
+class BackView(TangoFrame):
+    def __init__(self, screen, view_state):
+        super(BackView, self).__init__(screen, view_state)
 
         # Create the form for displaying the list of contacts.
         layout = Layout([100], fill_frame=True)
@@ -159,20 +253,15 @@ class BackView(Frame):
 
         layout2.add_widget(Button("Back [b]", self._back), 0)
         layout2.add_widget(Button("Flip [f]", self._flip), 0)
-        if(self.data["image_base64"]):
-            layout2.add_widget(Button("Pic [p]", self._pic), 0)
+        layout2.add_widget(self._pic_button, 0)
         layout2.add_widget(Button("Exit [q]", self._exit), 1)
 
         self.fix()
+        self._show_tango()
 
-    @staticmethod
-    def _exit():
-        raise StopApplication("User terminated app")
-
-    def reset(self):
-        # Do standard reset to clear out form, then populate with new data.
-        super(BackView, self).reset()
-        self.data = self.view_state.current_tango()
+    @profiling.profiled("screen.BackView")
+    def _show_tango(self):
+        super(BackView, self)._show_tango()
 
     def _back(self):
         self.view_state.previous_tango()
@@ -185,19 +274,16 @@ class BackView(Frame):
     def _flip(self):
         raise NextScene("FrontView")
 
-    def _pic(self):
-        raise ExternalCallException(self._scene, get_imgcat_command(self.data), should_page=False)
-
     def _score_function(self, score):
         def record_in_model():
-            get_model().log_study(self.data, score)
-            update_sm2p(self.data, performance_ratings[score])
+            self.view_state.reviewed(self.data, score)
             self._next()
 
         return record_in_model
 
     def process_event(self, event):
         if isinstance(event, KeyboardEvent):
+            self.view_state.latency.key_pressed()
             c = event.key_code
             # scores are arranged like the qwerty arrow alternative: asd = bad good great
             if c in (1, 1 + ascii_ctrl_diff):
@@ -232,29 +318,40 @@ class BackView(Frame):
 
 def tui(lang):
     """Review the tango for the selected language. If 'all' (default), review all tango for all languages."""
-    entries = prioritize_study(get_model().get_tango_for_language(lang))
+    # reviews are committed in groups in the background (and on exit) so scoring never waits on the disk
+    try:
+        session = StudySession(lang)
+    except ValueError:
+        raise click.BadParameter(f"no tango-cho for '{lang}' exists", param_hint='LANGUAGE')
+    if not session:
+        print("No tango are due for study")
+        return
 
-    # index- the index of the tango currently shown
-    view_state = ViewState(entries, lang)
+    view_state = ViewState(session)
 
     def show_cards(screen, start_scene):
         scenes = [
-            Scene([FrontView(screen, entries, view_state)], -1, name="FrontView"),
-            Scene([BackView(screen, entries, view_state)], -1, name="BackView")
+            Scene([FrontView(screen, view_state)], -1, name="FrontView"),
+            Scene([BackView(screen, view_state)], -1, name="BackView")
         ]
+        # the screen is painted once the effects of each frame's keypresses are drawn
+        refresh = screen.refresh
+
+        def refresh_and_measure():
+            refresh()
+            view_state.latency.painted()
+
+        screen.refresh = refresh_and_measure
         screen.play(scenes, stop_on_resize=True, start_scene=start_scene)
 
     current_scene = None
     while True:
         try:
             Screen.wrapper(show_cards, catch_interrupt=True, arguments=[current_scene])
+            view_state.loader.close()
+            session.finish()
+            debug_print(view_state.latency.summary())
             sys.exit(0)
         except ResizeScreenError as e:
+            # the frames are sized to the screen, so they are built again; the study session carries on
             current_scene = e.scene
-        except ImgCatException as e:
-            last_scene = e.last_scene
-            try:
-                e.print()
-            except KeyboardInterrupt:
-                # let less handle this, -K will exit cleanly
-                pass
@@ -0,0 +1,129 @@
+import base64
+import json
+from pathlib import Path
+
+import click
+
+from ..migrations import SCHEMA_VERSION, sync_fields
+from ..model import get_model
+from ..sm2_plus import rebuild_schedule
+
+# version of the sync file format
+SYNC_FORMAT = 1
+CARD_COLUMNS = ['guid', 'lang', 'modified', 'image_hash'] + sync_fields
+REVIEW_COLUMNS = ['card', 'timestamp', 'score', 'data']
+
+
+def _write_line(f, line_type, row, columns):
+    f.write(json.dumps({"type": line_type, **{column: row[column] for column in columns}}, ensure_ascii=False))
+    f.write('\n')
+
+
+def export(peer, output_file, full, with_images):
+    """Write the cards changed and the reviews logged since the last export to peer (or all of them with
+    full) to output_file, as JSONL. Changes imported from peer are left out. The peer is only marked as up
+    to date once the file is complete."""
+    model = get_model()
+    # reviews held back in write-behind mode are part of the export
+    model.flush()
+    since = {"card_seq": 0, "review_id": 0} if full else model.get_sync_peer(peer)
+    marks = model.get_sync_marks()
+    output_path = Path(output_file)
+    partial_path = output_path.with_name(output_path.name + '.part')
+    card_count = review_count = 0
+    # images are written before the first card that uses them
+    written_images = set()
+    with open(partial_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"type": "header", "format": SYNC_FORMAT, "schema": SCHEMA_VERSION}) + '\n')
+        for card in model.iter_changed_cards(peer, since['card_seq'], marks['card_seq']):
+            image_hash = card['image_hash']
+            if with_images and image_hash and image_hash not in written_images:
+                data = b"".join(model.iter_image_chunks(image_hash))
+                f.write(json.dumps({"type": "image", "hash": image_hash,
+                                    "data": base64.b64encode(data).decode('ascii')}) + '\n')
+                written_images.add(image_hash)
+            _write_line(f, "card", card, CARD_COLUMNS)
+            card_count += 1
+        for review in model.iter_new_reviews(peer, since['review_id'], marks['review_id']):
+            _write_line(f, "review", review, REVIEW_COLUMNS)
+            review_count += 1
+        # lets the importer tell a complete file from a truncated one
+        f.write(json.dumps({"type": "end", "cards": card_count, "reviews": review_count}) + '\n')
+    partial_path.replace(output_path)
+    model.set_sync_peer(peer, marks['card_seq'], marks['review_id'])
+    click.echo(f"Exported {card_count} changed tango, {len(written_images)} images and {review_count} reviews "
+               f"for {peer} to {output_path}", err=True)
+
+
+def _read_lines(input_file):
+    with open(input_file, encoding='utf-8') as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('type') != 'header':
+            raise click.ClickException(f"{input_file} is not a tango sync file")
+        if header.get('format', 0) > SYNC_FORMAT:
+            raise click.ClickException(f"{input_file} was made by a newer version of tango; update tango to import it")
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # the rest of a file cut short; what came before it is merged as usual
+                return
+
+
+def import_(peer, input_file, batch_size):
+    """Merge a file written by 'tango sync-export' on peer into this tango-cho. Cards are merged by guid, review
+    histories are combined, and the schedules of the cards with new reviews are recomputed by replaying
+    their histories, so importing the same file twice changes nothing."""
+    model = get_model()
+    model.flush()
+    image_count = 0
+    added = []
+    updated = []
+    reviewed = set()
+    unknown = 0
+    end = None
+    cards = []
+    reviews = []
+
+    def merge_cards():
+        batch_added, batch_updated = model.merge_synced_cards(peer, cards)
+        added.extend(batch_added)
+        updated.extend(batch_updated)
+        cards.clear()
+
+    def merge_reviews():
+        nonlocal unknown
+        batch_reviewed, batch_unknown = model.merge_synced_reviews(peer, reviews)
+        reviewed.update(batch_reviewed)
+        unknown += batch_unknown
+        reviews.clear()
+
+    for line in _read_lines(input_file):
+        if line['type'] == 'image':
+            model.add_image(base64.b64decode(line['data']))
+            image_count += 1
+        elif line['type'] == 'card':
+            cards.append(line)
+            if len(cards) >= batch_size:
+                merge_cards()
+        elif line['type'] == 'review':
+            # reviews come after all of the cards, which have to be merged first
+            if cards:
+                merge_cards()
+            reviews.append(line)
+            if len(reviews) >= batch_size:
+                merge_reviews()
+        elif line['type'] == 'end':
+            end = line
+    if cards:
+        merge_cards()
+    if reviews:
+        merge_reviews()
+    if end is None:
+        click.echo("Warning: the sync file is incomplete; export it again to get the rest", err=True)
+
+    rebuild_schedule(batch_size, set(added) | reviewed)
+    click.echo(f"Added {len(added)} and updated {len(updated)} tango, stored {image_count} images and added "
+               f"reviews to {len(reviewed)} tango", err=True)
+    if unknown:
+        click.echo(f"Skipped {unknown} reviews of tango that don't exist here", err=True)
@@ -0,0 +1,80 @@
+# Downloads the images of the tango added in a session in the background. The queue of downloads lives
+# in the image_downloads table, so downloads that haven't finished when tango quits stay queued; those,
+# and the ones queued by 'tango import', are left to 'tango images backfill'.
+import threading
+
+from . import model
+from .images import prepare_variant
+from .utils import debug_print, get_url_content
+
+# after this many failed attempts a download is left for 'tango images backfill'
+MAX_DOWNLOAD_ATTEMPTS = 3
+
+
+class ImageDownloader:
+    """Downloads queued images on a daemon thread. Only the downloads of the tango it is notified about are
+    done; call notify(tango_id) after queueing the download of a tango."""
+
+    def __init__(self, model_factory=model.Model):
+        self._model_factory = model_factory
+        self._tango_ids = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._finishing = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ImageDownloader", daemon=True)
+            self._thread.start()
+
+    def notify(self, tango_id):
+        with self._lock:
+            self._tango_ids.add(tango_id)
+        self._wake.set()
+
+    @property
+    def tango_ids(self):
+        """The ids of the tango whose downloads this downloader does"""
+        with self._lock:
+            return list(self._tango_ids)
+
+    def stop(self, finish_queue=False, timeout=None):
+        """Stop the worker after the current download, or once its downloads are done if finish_queue is
+        set. Unfinished downloads stay queued either way."""
+        if finish_queue:
+            self._finishing.set()
+        else:
+            self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        # the worker writes through its own connection, so that its transactions don't contend with
+        # those of the command's connection
+        worker_model = self._model_factory()
+        # downloads that failed during this run are not retried until the next one
+        failed = set()
+        while not self._stopped.is_set():
+            self._wake.clear()
+            tango_ids = self.tango_ids
+            downloads = [d for d in worker_model.get_image_downloads(MAX_DOWNLOAD_ATTEMPTS, tango_ids)
+                         if d['id'] not in failed] if tango_ids else []
+            for download in downloads:
+                if self._stopped.is_set():
+                    return
+                try:
+                    image_hash = worker_model.finish_image_download(download, get_url_content(download['url']))
+                except Exception as e:
+                    debug_print(f"Error: Could not download image {download['url']}: {e}")
+                    worker_model.fail_image_download(download, e)
+                    failed.add(download['id'])
+                    continue
+                # downscale the image for the terminal now, so that showing it later is quick
+                prepare_variant(worker_model, image_hash)
+            if not downloads:
+                if self._finishing.is_set():
+                    return
+                self._wake.wait()
@@ -0,0 +1,80 @@
+# Batch version of the SM2+ scheduler in sm2_plus, working on NumPy arrays that hold the variables
+# of a whole deck at once. Used to forecast how many reviews will be due over the coming days.
+import numpy as np
+
+from . import model
+from .sm2_plus import correct_threshold, performance_ratings, DAY_TO_SECONDS, _get_difficulty_weight
+
+# the order of the score probabilities given to simulate()
+SCORE_NAMES = ['BAD', 'OK', 'GREAT']
+
+
+class Schedule:
+    """The SM2+ variables of many tango, as parallel arrays"""
+
+    def __init__(self, difficulty, days_between_reviews, date_last_reviewed):
+        self.difficulty = difficulty
+        self.days_between_reviews = days_between_reviews
+        self.date_last_reviewed = date_last_reviewed
+
+    @classmethod
+    def load(cls, lang):
+        """Load the variables of every tango of the given language (or 'all') from the model"""
+        batches = [np.array(batch, dtype=np.float64) for batch in model.get_model().iter_sm2p_batches(lang)]
+        data = np.concatenate(batches) if batches else np.empty((0, 3))
+        return cls(data[:, 0].copy(), data[:, 1].copy(), data[:, 2].copy())
+
+    def __len__(self):
+        return len(self.difficulty)
+
+    def copy(self):
+        return Schedule(self.difficulty.copy(), self.days_between_reviews.copy(), self.date_last_reviewed.copy())
+
+    def next_due(self):
+        return self.date_last_reviewed + self.days_between_reviews * DAY_TO_SECONDS
+
+    def percent_overdue(self, now):
+        """Same as sm2_plus._get_percent_overdue, for every tango at once"""
+        return (now - self.date_last_reviewed) / DAY_TO_SECONDS / self.days_between_reviews
+
+    def review(self, mask, ratings, date_now):
+        """Update the tango selected by mask as sm2_plus.get_updated_variables would after reviews with
+        the given performance ratings (one per selected tango) at date_now (a number or an array)"""
+        difficulty = self.difficulty[mask]
+        days_between_reviews = self.days_between_reviews[mask]
+        date_last_reviewed = self.date_last_reviewed[mask]
+        correct = ratings >= correct_threshold
+        percent_overdue = (date_now - date_last_reviewed) / DAY_TO_SECONDS / days_between_reviews
+        percent_overdue = np.where(correct, np.minimum(2, percent_overdue), 1)
+        difficulty += percent_overdue * 1 / 17 * (8 - 9 * ratings)
+        difficulty_weight = _get_difficulty_weight(difficulty)
+        days_between_reviews *= np.where(correct,
+                                         1 + (difficulty_weight - 1) * percent_overdue,
+                                         1 / difficulty_weight ** 2)
+        self.difficulty[mask] = difficulty
+        self.days_between_reviews[mask] = days_between_reviews
+        self.date_last_reviewed[mask] = date_now
+
+
+def simulate(schedule, start, days, score_probabilities, rng=None):
+    """Simulate studying every due tango each day for the given number of days, starting at start
+    (epoch seconds). Each review gets a random score drawn with score_probabilities (for BAD, OK and
+    GREAT). Tango are reviewed when they become due, or at the start of the day if they are already
+    overdue then; a tango that comes due again on the day it was reviewed is counted the next day.
+    Returns the number of reviews for each day. The schedule is not modified."""
+    rng = rng or np.random.default_rng()
+    schedule = schedule.copy()
+    ratings = np.array([performance_ratings[name] for name in SCORE_NAMES])
+    probabilities = np.asarray(score_probabilities, dtype=np.float64)
+    probabilities = probabilities / probabilities.sum()
+    due_counts = []
+    for day in range(days):
+        day_start = start + day * DAY_TO_SECONDS
+        next_due = schedule.next_due()
+        due = next_due < day_start + DAY_TO_SECONDS
+        count = int(np.count_nonzero(due))
+        due_counts.append(count)
+        if count:
+            review_times = np.maximum(next_due[due], day_start)
+            schedule.review(due, rng.choice(ratings, size=count, p=probabilities), review_times)
+    return due_counts
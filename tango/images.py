@@ -0,0 +1,108 @@
+# Shows tango images in the terminal. Instead of the original download, which can be a photo of
+# several MB, a variant downscaled to the area of the terminal it is shown in is sent. Variants are
+# made with Pillow (the 'images' extra) and stored next to the original, keyed by that area in
+# character cells; without Pillow the original is sent as before.
+import base64
+import io
+import shutil
+import struct
+import sys
+
+from .utils import debug_print
+
+# used when the terminal doesn't report its size in pixels
+DEFAULT_CELL_PIXELS = (8, 16)
+# keeps variants small on terminals that report high-DPI pixel sizes
+MAX_VARIANT_PIXELS = 1280
+JPEG_QUALITY = 80
+
+
+def terminal_area():
+    """Return the (columns, rows, cell_width, cell_height) an image is shown in, leaving a row for the
+    prompt below it, or None if stdout is not a terminal. Cell sizes are in pixels."""
+    if not sys.stdout.isatty():
+        return None
+    columns, rows = shutil.get_terminal_size()
+    try:
+        # only on Unix, and only needed once there is an image to show
+        import fcntl
+        import termios
+        _, _, width_pixels, height_pixels = struct.unpack(
+            "HHHH", fcntl.ioctl(sys.stdout.fileno(), termios.TIOCGWINSZ, b"\0" * 8))
+    except (ImportError, OSError):
+        width_pixels = height_pixels = 0
+    if width_pixels and height_pixels:
+        cell_width, cell_height = width_pixels // columns, height_pixels // rows
+    else:
+        cell_width, cell_height = DEFAULT_CELL_PIXELS
+    return columns, max(1, rows - 1), cell_width, cell_height
+
+
+def make_variant(data, max_width, max_height):
+    """Return the image data downscaled to fit max_width x max_height pixels and re-encoded (JPEG, or
+    PNG for images with transparency), or None if that wouldn't make it any smaller"""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEG images can be decoded at a fraction of their size, which is much faster for big photos
+        image.draft("RGB", (max_width, max_height))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_width, max_height))
+        output = io.BytesIO()
+        if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+            image.save(output, "PNG", optimize=True)
+        else:
+            image.convert("RGB").save(output, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    variant = output.getvalue()
+    return variant if len(variant) < len(data) else None
+
+
+def get_variant(model, image_hash, area):
+    """Return the bytes of the stored variant of the image for the terminal area (see terminal_area),
+    making it first if needed. Returns None if the original should be shown instead."""
+    columns, rows, cell_width, cell_height = area
+    row = model.get_image_variant(image_hash, columns, rows)
+    if row is not None:
+        return row['data']
+    try:
+        data = b"".join(model.iter_image_chunks(image_hash))
+        variant = make_variant(data, min(columns * cell_width, MAX_VARIANT_PIXELS),
+                               min(rows * cell_height, MAX_VARIANT_PIXELS))
+    except ImportError:
+        # Pillow isn't installed; don't remember that, it may be installed later
+        return None
+    except Exception as e:
+        debug_print(f"Error: Could not make a thumbnail of image {image_hash}: {e}")
+        variant = None
+    model.add_image_variant(image_hash, columns, rows, variant)
+    return variant
+
+
+def prepare_variant(model, image_hash):
+    """Make the image's variant for the current terminal ahead of time, e.g. right after downloading it"""
+    area = terminal_area()
+    if area is not None:
+        get_variant(model, image_hash, area)
+
+
+def print_image(model, tango):
+    """Show the tango's image inline (iTerm2 protocol), sized to the terminal"""
+    image_hash = tango['image_hash']
+    area = terminal_area()
+    variant = get_variant(model, image_hash, area) if area is not None else None
+    if variant is not None:
+        chunks = [variant]
+        size = len(variant)
+    else:
+        # stream the original from the model's image store
+        chunks = model.iter_image_chunks(image_hash)
+        size = model.get_image_size(image_hash)
+    # the terminal scales the image to fit the area, keeping its aspect ratio
+    fit = f";width={area[0]};height={area[1]}" if area is not None else ""
+    sys.stdout.write(f"\033]1337;File=size={size}{fit};inline=1:")
+    # chunks are a multiple of 3 bytes long, so their base64 encodings can simply be concatenated
+    for chunk in chunks:
+        sys.stdout.write(base64.b64encode(chunk).decode('ascii'))
+    sys.stdout.write("\a\n")
+    sys.stdout.flush()
+    input("Press Enter to continue...")
@@ -0,0 +1,141 @@
+# Caches the output of dictionary commands (see utils.get_dictionary_command) in a database of its own
+# next to the tango-cho, so that looking up a word again shows it instantly. Entries expire after a
+# while, and the least recently used ones are evicted when the cache grows too big.
+import sqlite3
+import subprocess
+import threading
+
+from .utils import app_data_path, debug_print, get_app_data_path, get_current_timestamp, get_dictionary_command
+
+cache_path = app_data_path / "lookup_cache.db"
+
+# cached output older than this (in seconds) is looked up again
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 50 * 2 ** 20
+# seconds the headword has to stay the same before it is looked up in the background
+DEFAULT_WARM_DELAY = 0.5
+
+
+class LookupCache:
+    """Dictionary command output keyed by (lang, headword, command). Can be shared between threads."""
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        if path is None:
+            get_app_data_path()
+            path = cache_path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS lookups (
+                lang TEXT,
+                headword TEXT,
+                command TEXT,
+                output BLOB,
+                fetched INTEGER,
+                last_used INTEGER,
+                PRIMARY KEY (lang, headword, command)
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS lookups_last_used ON lookups (last_used)")
+        self._db.commit()
+
+    def get(self, lang, headword, command):
+        """Return the cached output of command for the headword, or None if there is none or it has expired"""
+        now = get_current_timestamp()
+        with self._lock:
+            row = self._db.execute("SELECT rowid, output, fetched FROM lookups WHERE lang=? AND headword=? AND command=?",
+                                   (lang, headword, command)).fetchone()
+            if row is None:
+                return None
+            rowid, output, fetched = row
+            if fetched + self.ttl <= now:
+                self._db.execute("DELETE FROM lookups WHERE rowid=?", (rowid,))
+                output = None
+            else:
+                self._db.execute("UPDATE lookups SET last_used=? WHERE rowid=?", (now, rowid))
+            self._db.commit()
+            return output
+
+    def put(self, lang, headword, command, output):
+        now = get_current_timestamp()
+        with self._lock:
+            self._db.execute("""INSERT OR REPLACE INTO lookups (lang, headword, command, output, fetched, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)""", (lang, headword, command, output, now, now))
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM lookups WHERE fetched <= ?", (now - self.ttl,))
+        excess = self._db.execute("SELECT coalesce(sum(length(output)), 0) FROM lookups").fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for rowid, size in self._db.execute("SELECT rowid, length(output) FROM lookups ORDER BY last_used"):
+            evicted.append((rowid,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM lookups WHERE rowid=?", evicted)
+
+    def lookup(self, lang, headword):
+        """Return the output of the dictionary command for the headword, running it only if the output
+        isn't cached yet. Output of failed commands is returned, but not cached."""
+        command = get_dictionary_command(lang, headword)
+        output = self.get(lang, headword, command)
+        if output is None:
+            result = subprocess.run(command, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            output = result.stdout
+            if result.returncode == 0:
+                self.put(lang, headword, command, output)
+            else:
+                debug_print(f"Error: dictionary command {command} exited with {result.returncode}")
+        return output
+
+
+class LookupWarmer:
+    """Looks up headwords on a daemon thread, so that their dictionary entries are cached by the time
+    they're wanted. Call warm() whenever the headword changes; a headword is looked up once it has
+    stayed the same for delay seconds."""
+
+    def __init__(self, cache, delay=DEFAULT_WARM_DELAY):
+        self._cache = cache
+        self._delay = delay
+        self._pending = None
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="LookupWarmer", daemon=True)
+            self._thread.start()
+
+    def warm(self, lang, headword):
+        headword = headword.strip()
+        if headword:
+            with self._pending_lock:
+                self._pending = (lang, headword)
+            self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait()
+            # wait for the typing to stop
+            while self._wake.is_set() and not self._stopped.is_set():
+                self._wake.clear()
+                self._wake.wait(self._delay)
+            with self._pending_lock:
+                pending, self._pending = self._pending, None
+            if pending and not self._stopped.is_set():
+                try:
+                    self._cache.lookup(*pending)
+                except Exception as e:
+                    debug_print(f"Error: Could not look up {pending}: {e}")
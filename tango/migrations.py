@@ -0,0 +1,489 @@
+# One-time rewrites of existing tango-cho databases. The schema version is kept in sqlite's
+# user_version pragma; each migration brings the database from the previous version to its own.
+# Migrations copy data in batches and commit after each one, so an interrupted migration can
+# simply be run again.
+import base64
+import binascii
+import datetime
+import hashlib
+import uuid
+
+DAY_TO_SECONDS = 24 * 60 * 60
+
+# the text format that dates were stored in before schema version 1
+legacy_date_format = "%a %b %d %H:%M:%S %Z %Y"
+
+reserved_tables = ["review_history", "sm2_plus", "images", "image_downloads", "languages", "cards",
+                   "cards_legacy_ids"]
+
+# the full-text search table of a language is named '{lang}_search'; FTS5 adds shadow tables named after it
+search_table_suffix = "_search"
+
+
+def _to_epoch(value):
+    """Convert a stored date (legacy text, ISO-8601 text or an already converted number) to epoch seconds"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if value.isdigit():
+        return int(value)
+    try:
+        # dates were always written in UTC, but strptime drops the %Z time zone
+        date = datetime.datetime.strptime(value, legacy_date_format).replace(tzinfo=datetime.timezone.utc)
+    except ValueError:
+        try:
+            # datetime objects stored directly by sqlite3 end up as ISO-8601 text
+            date = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            from dateutil import parser
+            date = parser.parse(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return int(date.timestamp())
+
+
+def _get_table_names(db):
+    return [row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()]
+
+
+def _get_languages(db):
+    return [name for name in _get_table_names(db) if
+            not name.startswith('sqlite') and name not in reserved_tables and not name.endswith('_migrating')
+            and search_table_suffix not in name]
+
+
+def _rewrite_table(db, table, create_sql, columns, convert_row, batch_size, echo, new_columns=None):
+    """Copy every row of table into a new table created by create_sql (which must create a table
+    named '{table}_migrating'), passing each row (rowid first, then the given columns) through
+    convert_row, which returns the values for rowid and new_columns (default: the same columns).
+    Rowids are kept, so columns should not include an INTEGER PRIMARY KEY. Afterwards the new
+    table replaces the old one."""
+    new_table = f"{table}_migrating"
+    table_names = _get_table_names(db)
+    if new_table not in table_names:
+        db.execute(create_sql)
+        db.commit()
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    new_columns = new_columns or columns
+    new_column_list = ", ".join(f'"{c}"' for c in new_columns)
+    placeholders = ", ".join("?" for _ in new_columns)
+    insert_sql = f"INSERT INTO '{new_table}' (rowid, {new_column_list}) VALUES (?, {placeholders})"
+    last_rowid = db.execute(f"SELECT coalesce(max(rowid), 0) FROM '{new_table}'").fetchone()[0]
+    copied = 0
+    while True:
+        rows = db.execute(f"SELECT rowid, {column_list} FROM '{table}' WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                          (last_rowid, batch_size)).fetchall()
+        if not rows:
+            break
+        # convert the whole batch first so that convert_row may run its own queries
+        db.executemany(insert_sql, [convert_row(row) for row in rows])
+        db.commit()
+        last_rowid = rows[-1][0]
+        copied += len(rows)
+        echo(f"  {table}: {copied} rows")
+    # keep AUTOINCREMENT ids from reusing those of deleted rows
+    last_seq = None
+    if "sqlite_sequence" in table_names:
+        last_seq = db.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    db.execute("BEGIN")
+    db.execute(f"DROP TABLE '{table}'")
+    db.execute(f"ALTER TABLE '{new_table}' RENAME TO '{table}'")
+    if last_seq:
+        db.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?", (last_seq[0], table))
+    db.commit()
+
+
+def _migrate_epoch_timestamps(db, batch_size, echo):
+    """Store created, dateLastReviewed and review_history.timestamp as integer epoch seconds
+    instead of "%a %b %d %H:%M:%S %Z %Y" text"""
+    lang_fields = ["created", "headword", "pronunciation", "morphology", "definition", "example", "image_url",
+                   "image_base64", "notes", "source"]
+    for lang in _get_languages(db):
+        create_sql = (f"CREATE TABLE '{lang}_migrating' (id INTEGER PRIMARY KEY AUTOINCREMENT, 'created' INTEGER," +
+                      ",".join([f"'{field}' TEXT" for field in lang_fields[1:]]) + ")")
+
+        def convert_tango(row):
+            return (row[0], _to_epoch(row[1])) + tuple(row[2:])
+
+        _rewrite_table(db, lang, create_sql, lang_fields, convert_tango, batch_size, echo)
+
+    if "review_history" in _get_table_names(db):
+        def convert_review(row):
+            return row[0], row[1], row[2], _to_epoch(row[3]), row[4], row[5]
+
+        _rewrite_table(db, "review_history", """CREATE TABLE review_history_migrating (
+                id INTEGER PRIMARY KEY,
+                lang TEXT,
+                tango_id INTEGER,
+                timestamp INTEGER,
+                score TEXT,
+                data TEXT
+            )""", ["lang", "tango_id", "timestamp", "score", "data"], convert_review, batch_size, echo)
+
+    if "sm2_plus" in _get_table_names(db):
+        languages = _get_languages(db)
+
+        def convert_sm2p(row):
+            date_last_reviewed = _to_epoch(row[5])
+            if date_last_reviewed is None or row[4] is None:
+                # without them the tango would never be due again; it starts over as a new tango
+                # (see sm2_plus.get_default_variables) instead
+                tango = None
+                if row[1] in languages:
+                    tango = db.execute(f"""SELECT created FROM "{row[1]}" WHERE id = ?""", (row[2],)).fetchone()
+                created = (_to_epoch(tango[0]) if tango else None) or 0
+                return row[0], row[1], row[2], 0.3, 0.25, created, int(created + 0.25 * DAY_TO_SECONDS)
+            next_due = int(date_last_reviewed + row[4] * DAY_TO_SECONDS)
+            return row[0], row[1], row[2], row[3], row[4], date_last_reviewed, next_due
+
+        _rewrite_table(db, "sm2_plus", """CREATE TABLE sm2_plus_migrating (
+                lang TEXT,
+                tango_id INTEGER,
+                difficulty REAL,
+                daysBetweenReviews REAL,
+                dateLastReviewed INTEGER,
+                nextDue INTEGER,
+                PRIMARY KEY  (lang, tango_id)
+            )""", ["lang", "tango_id", "difficulty", "daysBetweenReviews", "dateLastReviewed"], convert_sm2p,
+                       batch_size, echo,
+                       new_columns=["lang", "tango_id", "difficulty", "daysBetweenReviews", "dateLastReviewed", "nextDue"])
+        db.execute("CREATE INDEX IF NOT EXISTS sm2_plus_due ON sm2_plus (lang, nextDue)")
+        db.commit()
+
+
+def _migrate_image_store(db, batch_size, echo):
+    """Move images out of the image_base64 column of the language tables into the images table,
+    where each distinct image is stored once as raw bytes, keyed by its SHA-256 hash"""
+    db.execute("CREATE TABLE IF NOT EXISTS images (hash TEXT PRIMARY KEY, data BLOB)")
+    db.commit()
+    old_fields = ["created", "headword", "pronunciation", "morphology", "definition", "example", "image_url",
+                  "image_base64", "notes", "source"]
+    new_fields = [field if field != "image_base64" else "image_hash" for field in old_fields]
+    image_column = old_fields.index("image_base64") + 1
+    for lang in _get_languages(db):
+        create_sql = (f"CREATE TABLE '{lang}_migrating' (id INTEGER PRIMARY KEY AUTOINCREMENT, 'created' INTEGER," +
+                      ",".join([f"'{field}' TEXT" for field in new_fields[1:]]) + ")")
+
+        def convert_tango(row):
+            image_hash = None
+            if row[image_column]:
+                try:
+                    data = base64.b64decode(row[image_column])
+                except binascii.Error:
+                    echo(f"  Dropping undecodable image of {lang} tango {row[0]}")
+                else:
+                    image_hash = hashlib.sha256(data).hexdigest()
+                    db.execute("INSERT OR IGNORE INTO images (hash, data) VALUES (?, ?)", (image_hash, data))
+            return row[:image_column] + (image_hash,) + row[image_column + 1:]
+
+        _rewrite_table(db, lang, create_sql, old_fields, convert_tango, batch_size, echo, new_columns=new_fields)
+
+
+def _migrate_image_downloads(db, batch_size, echo):
+    """Add the queue of images still to be downloaded"""
+    db.execute("""CREATE TABLE IF NOT EXISTS image_downloads (
+            id INTEGER PRIMARY KEY,
+            lang TEXT,
+            tango_id INTEGER,
+            url TEXT,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT
+        )""")
+    db.commit()
+
+
+def _migrate_headword_indexes(db, batch_size, echo):
+    """Index the headword of every language table, for importing by headword"""
+    for lang in _get_languages(db):
+        db.execute(f"CREATE INDEX IF NOT EXISTS '{lang}_headword' ON '{lang}' (headword)")
+    db.commit()
+
+
+# the fields covered by full-text search, and their weights in the bm25 ranking
+search_fields = ["headword", "pronunciation", "definition", "example", "notes"]
+search_weights = [10.0, 5.0, 2.0, 1.0, 1.0]
+
+
+def _create_search_index(db, table, search_table, unindexed_fields=()):
+    """Create an FTS5 index of the search_fields of table (which must have an integer id column), and
+    the triggers that keep it in sync with table. unindexed_fields are stored in the index for
+    filtering, but aren't searched. Doesn't commit; existing rows still have to be indexed with
+    _rebuild_search_index."""
+    fields = search_fields + list(unindexed_fields)
+    field_list = ", ".join(fields)
+    new_values = ", ".join(f"new.{field}" for field in fields)
+    old_values = ", ".join(f"old.{field}" for field in fields)
+    columns = ", ".join(search_fields + [f"{field} UNINDEXED" for field in unindexed_fields])
+    # the index refers to the rows of the table instead of storing a copy of the text
+    db.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS "{search_table}" USING fts5({columns},
+            content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""")
+    # make ORDER BY rank use the weights, which lets FTS5 sort and limit matches itself
+    db.execute(f"""INSERT INTO "{search_table}" ("{search_table}", rank)
+            VALUES ('rank', 'bm25({", ".join(str(w) for w in search_weights)})')""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS "{search_table}_insert" AFTER INSERT ON "{table}" BEGIN
+            INSERT INTO "{search_table}" (rowid, {field_list}) VALUES (new.id, {new_values});
+        END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS "{search_table}_delete" AFTER DELETE ON "{table}" BEGIN
+            INSERT INTO "{search_table}" ("{search_table}", rowid, {field_list}) VALUES ('delete', old.id, {old_values});
+        END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS "{search_table}_update" AFTER UPDATE OF {field_list} ON "{table}" BEGIN
+            INSERT INTO "{search_table}" ("{search_table}", rowid, {field_list}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO "{search_table}" (rowid, {field_list}) VALUES (new.id, {new_values});
+        END""")
+
+
+def _rebuild_search_index(db, search_table):
+    db.execute(f"""INSERT INTO "{search_table}" ("{search_table}") VALUES ('rebuild')""")
+
+
+def create_search_index(db):
+    """Create the full-text search index of the cards table. Doesn't commit."""
+    _create_search_index(db, "cards", "cards_search", unindexed_fields=["lang"])
+
+
+def _migrate_search_indexes(db, batch_size, echo):
+    """Add a full-text search index to every language table"""
+    for lang in _get_languages(db):
+        echo(f"  Indexing {lang}")
+        _create_search_index(db, lang, f"{lang}{search_table_suffix}")
+        _rebuild_search_index(db, f"{lang}{search_table_suffix}")
+        db.commit()
+
+
+def _get_sequence(db, table):
+    row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    return row[0] if row else 0
+
+
+def _migrate_cards_table(db, batch_size, echo):
+    """Move the tango of all of the language tables into a single cards table with a lang column.
+    Card ids are unique across languages, so the ids of each language are shifted past those of the
+    languages moved before it, along with the references to them in sm2_plus, review_history and
+    image_downloads. Each language is moved in a single transaction. The id each card had in its
+    language table is kept in cards_legacy_ids until migration 9 has derived the card's guid from it."""
+    lang_fields = ["created", "headword", "pronunciation", "morphology", "definition", "example", "image_url",
+                   "image_hash", "notes", "source"]
+    db.execute("CREATE TABLE IF NOT EXISTS languages (name TEXT PRIMARY KEY)")
+    db.execute("CREATE TABLE IF NOT EXISTS cards (id INTEGER PRIMARY KEY AUTOINCREMENT, lang TEXT NOT NULL, "
+               "created INTEGER, " + ", ".join(f"{field} TEXT" for field in lang_fields[1:]) + ")")
+    db.execute("CREATE INDEX IF NOT EXISTS cards_lang_headword ON cards (lang, headword)")
+    db.execute("CREATE TABLE IF NOT EXISTS cards_legacy_ids (card_id INTEGER PRIMARY KEY, lang_id INTEGER)")
+    db.commit()
+    field_list = ", ".join(lang_fields)
+    table_names = _get_table_names(db)
+    for lang in _get_languages(db):
+        echo(f"  Moving {lang}")
+        # ids continue after the highest one ever used, so that ids of deleted tango aren't reused
+        offset = _get_sequence(db, "cards")
+        last_id = max(_get_sequence(db, lang),
+                      db.execute(f"""SELECT coalesce(max(id), 0) FROM "{lang}" """).fetchone()[0])
+        db.execute("BEGIN")
+        db.execute("INSERT OR IGNORE INTO languages (name) VALUES (?)", (lang,))
+        db.execute(f"""INSERT INTO cards (id, lang, {field_list})
+            SELECT id + ?, ?, {field_list} FROM "{lang}" ORDER BY id""", (offset, lang))
+        db.execute(f"""INSERT INTO cards_legacy_ids (card_id, lang_id) SELECT id + ?, id FROM "{lang}" """, (offset,))
+        if "sm2_plus" in table_names:
+            # go through negative ids, so that no shifted id collides with one that isn't shifted yet
+            db.execute("UPDATE sm2_plus SET tango_id = -(tango_id + ?) WHERE lang = ?", (offset, lang))
+            db.execute("UPDATE sm2_plus SET tango_id = -tango_id WHERE lang = ? AND tango_id < 0", (lang,))
+        for table in ("review_history", "image_downloads"):
+            if table in table_names:
+                db.execute(f"UPDATE {table} SET tango_id = tango_id + ? WHERE lang = ?", (offset, lang))
+        if not db.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'cards'", (offset + last_id,)).rowcount:
+            db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('cards', ?)", (offset + last_id,))
+        db.execute(f"""DROP TABLE IF EXISTS "{lang}{search_table_suffix}" """)
+        db.execute(f"""DROP TABLE "{lang}" """)
+        db.commit()
+    echo("  Indexing cards")
+    if "cards_search" not in _get_table_names(db):
+        create_search_index(db)
+        _rebuild_search_index(db, "cards_search")
+    db.commit()
+
+
+def _migrate_review_stats(db, batch_size, echo):
+    """Index the review history by tango, and add the daily review counts that 'tango stats' reads.
+    The counts are filled in from the history the first time they are read."""
+    db.execute("CREATE INDEX IF NOT EXISTS review_history_tango ON review_history (lang, tango_id, timestamp)")
+    db.execute("""CREATE TABLE IF NOT EXISTS review_stats_daily (
+            day TEXT,
+            lang TEXT,
+            score TEXT,
+            reviews INTEGER,
+            PRIMARY KEY (day, lang, score)
+        )""")
+    db.execute("CREATE TABLE IF NOT EXISTS review_stats_state (name TEXT PRIMARY KEY, value INTEGER)")
+    db.commit()
+
+
+# (version, description, function) in the order they must be applied
+def create_image_variants_table(db):
+    # images downscaled to fit an area of the terminal, see tango.images; data is NULL when the
+    # original is already small enough
+    db.execute("""CREATE TABLE IF NOT EXISTS image_variants (
+            hash TEXT,
+            columns INTEGER,
+            rows INTEGER,
+            data BLOB,
+            PRIMARY KEY (hash, columns, rows)
+        )""")
+    db.commit()
+
+
+def _migrate_image_variants(db, batch_size, echo):
+    """Add the store of downscaled images; they are made the first time each image is shown"""
+    create_image_variants_table(db)
+
+
+# guids of the cards that existed before syncing are uuid5s in this namespace
+legacy_guid_namespace = uuid.UUID("5d1c1f4e-8f0b-4d53-9a43-0e6f3c2b7a91")
+
+# fields whose changes are synced; image_hash is local to each tango-cho, see Model.merge_synced_cards
+sync_fields = ["created", "headword", "pronunciation", "morphology", "definition", "example", "image_url", "notes",
+               "source"]
+
+# the guid of a new card, in the same form as the legacy ones (uuid.UUID.hex); cards are inserted with their
+# guid and modified time, see Model.add_tango
+new_guid_sql = "lower(hex(randomblob(16)))"
+
+
+def create_sync_tables(db):
+    """Add the change tracking that 'tango sync-export' reads. Every card has a guid that identifies it
+    in every tango-cho and a modified time that is kept up to date by a trigger. card_changes holds the
+    ids of changed cards, each once, in the order of their last change, along with the peer the change
+    was imported from (NULL for changes made here); sync_peers has how far the changes (and the review
+    history) have been exported to each peer."""
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS cards_guid ON cards (guid)")
+    db.execute("""CREATE TABLE IF NOT EXISTS card_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            card_id INTEGER UNIQUE,
+            origin TEXT
+        )""")
+    db.execute("""CREATE TABLE IF NOT EXISTS sync_peers (
+            name TEXT PRIMARY KEY,
+            card_seq INTEGER,
+            review_id INTEGER
+        )""")
+    # new cards come with their guid and modified time (new_guid_sql and their created time), so that
+    # inserting a card doesn't also update it, which would record the change a second time
+    db.execute("""CREATE TRIGGER IF NOT EXISTS cards_sync_insert AFTER INSERT ON cards BEGIN
+            INSERT OR REPLACE INTO card_changes (card_id) VALUES (new.id);
+        END""")
+    # edits bump modified, unless the writer sets it itself (as merging a synced card does; a merge that keeps
+    # the same modified time puts it back afterwards, see Model.merge_synced_cards)
+    changed = " OR ".join(f"new.{field} IS NOT old.{field}" for field in sync_fields)
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS cards_sync_modified AFTER UPDATE OF {', '.join(sync_fields)} ON cards
+            WHEN new.modified IS old.modified AND ({changed}) BEGIN
+            UPDATE cards SET modified = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = new.id;
+        END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS cards_sync_update AFTER UPDATE ON cards
+            WHEN new.modified IS NOT old.modified OR {changed} BEGIN
+            INSERT OR REPLACE INTO card_changes (card_id) VALUES (new.id);
+        END""")
+    db.commit()
+
+
+def _migrate_sync(db, batch_size, echo):
+    """Give every card a guid and a modified time, note which peer reviews were imported from, and add
+    the change tracking for syncing. The guids of existing cards are derived from their language, the
+    id they had in their language table and their creation time, so that copies of the same tango-cho
+    migrated separately agree on them, even when the copies have different tango (which shifts the
+    card ids of the languages after the first, see migration 6). Every card starts out as changed."""
+    for table, column, column_type in (("cards", "guid", "TEXT"), ("cards", "modified", "INTEGER"),
+                                       ("review_history", "origin", "TEXT")):
+        if column not in [row[1] for row in db.execute(f"PRAGMA table_info({table})")]:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+    db.commit()
+    cursor = db.cursor()
+    cursor.row_factory = None
+    # cards added after migration 6 have no legacy id; their ids never changed
+    legacy_ids = "cards_legacy_ids" in _get_table_names(db)
+    rows = cursor.execute(f"""SELECT c.id, c.lang, {"coalesce(l.lang_id, c.id)" if legacy_ids else "c.id"}, c.created
+        FROM cards c {"LEFT JOIN cards_legacy_ids l ON l.card_id = c.id" if legacy_ids else ""}
+        WHERE c.guid IS NULL ORDER BY c.id""").fetchall()
+    for start in range(0, len(rows), batch_size):
+        db.executemany("UPDATE cards SET guid = ?, modified = coalesce(modified, created, 0) WHERE id = ?",
+                       [(uuid.uuid5(legacy_guid_namespace, f"{lang}:{lang_id}:{created}").hex, tango_id)
+                        for tango_id, lang, lang_id, created in rows[start:start + batch_size]])
+        db.commit()
+    create_sync_tables(db)
+    db.execute("INSERT OR IGNORE INTO card_changes (card_id) SELECT id FROM cards ORDER BY id")
+    db.execute("DROP TABLE IF EXISTS cards_legacy_ids")
+    db.commit()
+
+
+def _migrate_default_schedules(db, batch_size, echo):
+    """Give the default SM2+ variables (see sm2_plus.get_default_variables) to the tango that have none,
+    or no due time. These used to be filled in whenever the due tango were listed; every way of adding a
+    tango now adds them along with it."""
+    # schedules that migration 1 left without a due time, which would never be due again, start over too
+    db.execute(f"""UPDATE sm2_plus SET difficulty = 0.3, daysBetweenReviews = 0.25,
+            dateLastReviewed = coalesce((SELECT created FROM cards WHERE id = tango_id), 0),
+            nextDue = CAST(coalesce((SELECT created FROM cards WHERE id = tango_id), 0) + 0.25 * {DAY_TO_SECONDS}
+                AS INTEGER)
+        WHERE nextDue IS NULL""")
+    db.commit()
+    max_id = db.execute("SELECT coalesce(max(id), 0) FROM cards").fetchone()[0]
+    added = 0
+    for start in range(0, max_id, batch_size):
+        added += db.execute(f"""INSERT INTO sm2_plus
+                (lang, tango_id, difficulty, daysBetweenReviews, dateLastReviewed, nextDue)
+            SELECT c.lang, c.id, 0.3, 0.25, coalesce(c.created, 0),
+                CAST(coalesce(c.created, 0) + 0.25 * {DAY_TO_SECONDS} AS INTEGER)
+            FROM cards c
+            WHERE c.id > ? AND c.id <= ?
+                AND NOT EXISTS (SELECT 1 FROM sm2_plus s WHERE s.lang = c.lang AND s.tango_id = c.id)""",
+                            (start, start + batch_size)).rowcount
+        db.commit()
+    echo(f"  Added schedules for {added} tango")
+
+
+def _migrate_sync_insert_trigger(db, batch_size, echo):
+    """Replace the trigger that gave new cards their guid and modified time with one that only notes the
+    change; the statements adding cards now set both"""
+    db.execute("DROP TRIGGER IF EXISTS cards_sync_insert")
+    create_sync_tables(db)
+
+
+MIGRATIONS = [
+    (1, "store dates as epoch seconds", _migrate_epoch_timestamps),
+    (2, "move images into a deduplicated image store", _migrate_image_store),
+    (3, "add the image download queue", _migrate_image_downloads),
+    (4, "index headwords", _migrate_headword_indexes),
+    (5, "add full-text search indexes", _migrate_search_indexes),
+    (6, "move all tango into one cards table", _migrate_cards_table),
+    (7, "add review statistics", _migrate_review_stats),
+    (8, "add downscaled image variants", _migrate_image_variants),
+    (9, "track changes for syncing", _migrate_sync),
+    (10, "give every tango a schedule", _migrate_default_schedules),
+    (11, "stop updating new cards from a trigger", _migrate_sync_insert_trigger),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(db):
+    cursor = db.cursor()
+    cursor.row_factory = None
+    return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+
+def set_schema_version(db, version):
+    db.execute(f"PRAGMA user_version = {int(version)}")
+    db.commit()
+
+
+def get_pending_migrations(db):
+    version = get_schema_version(db)
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+
+def migrate(db, batch_size=10000, echo=print):
+    """Apply all pending migrations to the given sqlite3 connection. Returns the number applied."""
+    pending = get_pending_migrations(db)
+    for version, description, apply in pending:
+        echo(f"Migrating to version {version}: {description}")
+        apply(db, batch_size, echo)
+        set_schema_version(db, version)
+    return len(pending)
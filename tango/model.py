@@ -1,17 +1,22 @@
-import sqlite3
+import atexit
+import hashlib
+import json
+import threading
+from collections.abc import Mapping
 from enum import Enum, auto
 
 import click
 
-from .sm2_plus import get_default_variables as get_default_sm2p
-from .utils import app_data_path, debug_print, get_current_datetime, get_formatted_datetime
-
-db_path = app_data_path / "tango.db"
-
-reserved_tables = ["review_history", "sm2_plus"]
+from .migrations import SCHEMA_VERSION, get_schema_version, set_schema_version, create_search_index, \
+    create_image_variants_table, create_sync_tables, new_guid_sql, sync_fields
+from .profiling import profile_methods
+from .sm2_plus import get_default_variables as get_default_sm2p, DAY_TO_SECONDS
+from .storage import get_engine
+from .utils import debug_print, get_current_timestamp
 
 lang_fields = ["created", "headword", "pronunciation", "morphology", "definition", "example", "image_url",
-               "image_base64", "notes", "source"]
+               "image_hash", "notes", "source"]
+card_columns = {"id", "lang", "guid", "modified", *lang_fields}
 
 
 class Score(Enum):
@@ -20,39 +25,127 @@ class Score(Enum):
     GREAT = auto()
 
 
-# We use regular dictionaries instead of Sqlite3.Row because they can be used with cursor.execute()
-def dict_factory(cursor, row):
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+class Record(Mapping):
+    """A row read from the database, looked up by column name like a read-only dict. The values stay in the
+    tuple sqlite returns, and all of the rows of a query share one map from column names to positions, so a
+    record takes a fraction of the memory of a dict. Use dict(record) for a copy that can be changed."""
+    __slots__ = ('_columns', '_values')
+
+    def __init__(self, columns, values):
+        self._columns = columns
+        self._values = values
+
+    def __getitem__(self, column):
+        return self._values[self._columns[column]]
+
+    def get(self, column, default=None):
+        index = self._columns.get(column)
+        return default if index is None else self._values[index]
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+# (cursor.description, column map) of the last query read; description is the same object for every row
+# of a query, so the map is only built once per query
+_last_columns = (None, None)
+
+
+def record_factory(cursor, row):
+    global _last_columns
+    description, columns = _last_columns
+    if cursor.description is not description:
+        description = cursor.description
+        columns = {column[0]: index for index, column in enumerate(description)}
+        _last_columns = description, columns
+    return Record(columns, row)
 
 
 class Model:
-    def __init__(self):
-        self._db = sqlite3.connect(str(db_path))
-        self._db.row_factory = dict_factory
+    def __init__(self, engine=None):
+        """Open the tango-cho of the given storage engine, by default the one selected for this invocation"""
+        self.engine = engine if engine is not None else get_engine()
+        # the connection is shared with the write-behind commit timer, see enable_write_behind
+        self._db = self.engine.connect()
+        self._db.row_factory = record_factory
+        self._write_lock = threading.RLock()
+        self._write_behind_interval = None
+        self._commit_timer = None
         self._check_tables()
 
     def _check_tables(self):
         cursor = self._db.cursor()
         tables = cursor.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()
         table_names = [t['name'] for t in tables]
-        self._all_languages = [name for name in table_names if
-                               not name.startswith('sqlite') and name not in reserved_tables]
+        if not table_names:
+            set_schema_version(self._db, SCHEMA_VERSION)
+        elif get_schema_version(self._db) < SCHEMA_VERSION:
+            raise click.ClickException("This tango-cho was made by an older version of tango. "
+                                       "Run 'tango migrate' to update it.")
+        if "languages" not in table_names:
+            cursor.execute("CREATE TABLE languages (name TEXT PRIMARY KEY)")
+            self._db.commit()
+        self._all_languages = [row['name'] for row in cursor.execute("SELECT name FROM languages ORDER BY rowid")]
+        if "cards" not in table_names:
+            # the tango of all languages; ids are unique across languages
+            cursor.execute("CREATE TABLE cards (id INTEGER PRIMARY KEY AUTOINCREMENT, lang TEXT NOT NULL, " +
+                           ", ".join(f"{field} {'INTEGER' if field == 'created' else 'TEXT'}"
+                                     for field in lang_fields) + ", guid TEXT, modified INTEGER)")
+            cursor.execute("CREATE INDEX cards_lang_headword ON cards (lang, headword)")
+            create_search_index(self._db)
+            create_sync_tables(self._db)
+            self._db.commit()
         if "review_history" not in table_names:
             cursor.execute("""CREATE TABLE review_history (
                     id INTEGER PRIMARY KEY,
                     lang TEXT,
                     tango_id INTEGER,
-                    timestamp TEXT,
+                    timestamp INTEGER,
                     score TEXT,
-                    data TEXT
+                    data TEXT,
+                    origin TEXT
                 )
             """)
+            cursor.execute("CREATE INDEX review_history_tango ON review_history (lang, tango_id, timestamp)")
+            self._db.commit()
+        if "review_stats_daily" not in table_names:
+            # the number of reviews with each score per day, rolled up from review_history by
+            # _update_review_stats; review_stats_state has the id of the last review counted
+            cursor.execute("""CREATE TABLE review_stats_daily (
+                    day TEXT,
+                    lang TEXT,
+                    score TEXT,
+                    reviews INTEGER,
+                    PRIMARY KEY (day, lang, score)
+                )
+            """)
+            cursor.execute("CREATE TABLE review_stats_state (name TEXT PRIMARY KEY, value INTEGER)")
             self._db.commit()
         if "sm2_plus" not in table_names:
             self._init_sm2p_table()
+        if "images" not in table_names:
+            # images are stored once, as raw bytes, keyed by the SHA-256 hash of those bytes
+            cursor.execute("CREATE TABLE images (hash TEXT PRIMARY KEY, data BLOB)")
+            self._db.commit()
+        if "image_variants" not in table_names:
+            create_image_variants_table(self._db)
+        if "image_downloads" not in table_names:
+            cursor.execute("""CREATE TABLE image_downloads (
+                    id INTEGER PRIMARY KEY,
+                    lang TEXT,
+                    tango_id INTEGER,
+                    url TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT
+                )
+            """)
+            self._db.commit()
 
     def _init_sm2p_table(self):
         cursor = self._db.cursor()
@@ -61,111 +154,632 @@ class Model:
                 tango_id INTEGER,
                 difficulty REAL,
                 daysBetweenReviews REAL,
-                dateLastReviewed TEXT,
+                dateLastReviewed INTEGER,
+                nextDue INTEGER,
                 PRIMARY KEY  (lang, tango_id)
             )
         """)
-        for tango in self.get_tango_for_language('all'):
-            starting_vals = get_default_sm2p(tango)
-            row_data = {**tango, **starting_vals}
-            cursor.execute("""INSERT INTO sm2_plus
-                (lang, tango_id, difficulty, daysBetweenReviews, dateLastReviewed)
-                VALUES (:lang, :id, :difficulty, :daysBetweenReviews, :dateLastReviewed)
-                """, row_data)
+        cursor.execute("CREATE INDEX sm2_plus_due ON sm2_plus (lang, nextDue)")
+        self._insert_default_sm2p(cursor, self.get_tango_for_language('all', ['lang', 'id', 'created']))
         self._db.commit()
 
+    @staticmethod
+    def _insert_default_sm2p(cursor, tango_list):
+        cursor.executemany("""INSERT INTO sm2_plus
+            (lang, tango_id, difficulty, daysBetweenReviews, dateLastReviewed, nextDue)
+            VALUES (:lang, :id, :difficulty, :daysBetweenReviews, :dateLastReviewed, :nextDue)
+            """, ({**tango, **get_default_sm2p(tango)} for tango in tango_list))
+
     def get_sm2p_vars(self, tango):
         cursor = self._db.cursor()
         return cursor.execute("""SELECT * FROM sm2_plus
-            WHERE lang=:lang AND tango_id=:id""", dict(tango)).fetchone()
+            WHERE lang=:lang AND tango_id=:id""", {"lang": tango['lang'], "id": tango['id']}).fetchone()
 
     def update_sm2p_vars(self, tango, sm2p_vars):
         row_vars = {**tango, **sm2p_vars}
+        with self._write_lock:
+            self._db.cursor().execute('''
+                INSERT OR REPLACE INTO sm2_plus (lang, tango_id, difficulty, daysBetweenReviews, dateLastReviewed, nextDue) VALUES(:lang, :id, :difficulty, :daysBetweenReviews, :dateLastReviewed, :nextDue)''',
+                                      row_vars)
+            self._db.commit()
+
+    def iter_sm2p_batches(self, lang, batch_size=100000):
+        """Generate lists of (difficulty, daysBetweenReviews, dateLastReviewed) tuples covering every tango
+        of the given language (or all languages if lang is 'all'), batch_size tuples at a time"""
+        lang_filter, params = self._filter_language(lang)
         cursor = self._db.cursor()
-        self._db.cursor().execute('''
-            INSERT OR REPLACE INTO sm2_plus (lang, tango_id, difficulty, daysBetweenReviews, dateLastReviewed) VALUES(:lang, :id, :difficulty, :daysBetweenReviews, :dateLastReviewed)''',
-                                  row_vars)
-        self._db.commit()
+        cursor.row_factory = None
+        cursor.execute(f"""SELECT difficulty, daysBetweenReviews, dateLastReviewed FROM sm2_plus
+            WHERE {lang_filter}""", params)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield batch
+
+    def iter_review_replay(self, tango_ids=None):
+        """Generate (lang, id, created, timestamp, score) tuples for every review of every tango (or of the
+        tango with the given ids), ordered by tango and then by time. Tango without reviews give a single
+        tuple with timestamp and score None. Rows are read from the database as they are consumed."""
+        cursor = self._db.cursor()
+        cursor.row_factory = None
+        # cards are scanned in id order and each one's reviews come in order from the review_history_tango index;
+        # reviews at the same time are ordered by score so that every tango-cho replays them the same way
+        query = """SELECT c.lang, c.id, c.created, h.timestamp, h.score FROM cards c
+            LEFT JOIN review_history h ON h.lang = c.lang AND h.tango_id = c.id
+            {where} ORDER BY c.id, h.timestamp, h.score"""
+        if tango_ids is None:
+            yield from cursor.execute(query.format(where=""))
+            return
+        tango_ids = sorted(tango_ids)
+        for start in range(0, len(tango_ids), 500):
+            chunk = tango_ids[start:start + 500]
+            yield from cursor.execute(query.format(where=f"WHERE c.id IN ({', '.join('?' for _ in chunk)})"), chunk)
+
+    def save_sm2p_vars(self, sm2p_rows):
+        """Set the SM2+ variables of the tango in sm2p_rows, (lang, id, difficulty, daysBetweenReviews,
+        dateLastReviewed, nextDue) tuples"""
+        with self._write_lock, self._db:
+            self._db.executemany("""INSERT OR REPLACE INTO sm2_plus
+                (lang, tango_id, difficulty, daysBetweenReviews, dateLastReviewed, nextDue)
+                VALUES (?, ?, ?, ?, ?, ?)""", sm2p_rows)
+
+    def replace_sm2p_vars(self, sm2p_rows, batch_size=10000):
+        """Replace the SM2+ variables of all tango with those in sm2p_rows, (lang, id, difficulty,
+        daysBetweenReviews, dateLastReviewed, nextDue) tuples read lazily and written batch_size at a
+        time, all in one transaction. Returns the number of rows written."""
+        written = 0
+        with self._write_lock, self._db:
+            self._db.execute("DELETE FROM sm2_plus")
+            for batch in _batches(sm2p_rows, batch_size):
+                self._db.executemany("""INSERT INTO sm2_plus
+                    (lang, tango_id, difficulty, daysBetweenReviews, dateLastReviewed, nextDue)
+                    VALUES (?, ?, ?, ?, ?, ?)""", batch)
+                written += len(batch)
+        return written
+
+    def get_due_tango(self, lang, now, since=None):
+        """Return (lang, id, percent_overdue) tuples for the tango of the given language (or all
+        languages if lang is 'all') which are due for review at the given time (epoch seconds), most
+        overdue first. percent_overdue is at least 1 for a due tango. With since, only the tango that
+        became due after since are returned. Use get_tango to load the tango themselves."""
+        if lang != 'all' and lang not in self._all_languages:
+            raise ValueError("No such language: " + lang)
+        # listing every language lets sqlite use the (lang, nextDue) index for 'all' as well
+        languages = self._all_languages if lang == 'all' else [lang]
+        # plain tuples keep the list small for large decks
+        cursor = self._db.cursor()
+        cursor.row_factory = None
+        # nextDue = dateLastReviewed + daysBetweenReviews, so this is the same ratio as
+        # sm2_plus._get_percent_overdue, but it only needs the indexed column. Dividing by an interval
+        # of 0 gives NULL; such a tango is simply due.
+        return cursor.execute(f"""SELECT lang, tango_id,
+                coalesce(1 + (? - nextDue) / (daysBetweenReviews * {DAY_TO_SECONDS}.0), 1) as percent_overdue
+            FROM sm2_plus
+            WHERE lang IN ({", ".join("?" for _ in languages)}) AND nextDue <= ? AND nextDue > ?
+            ORDER BY percent_overdue DESC""", [now, *languages, now, -1 if since is None else since]).fetchall()
+
+    def get_languages(self):
+        return list(self._all_languages)
+
+    def _filter_language(self, lang, column="lang"):
+        """Return an SQL condition on column selecting the given language (or any if lang is 'all'),
+        and its parameters"""
+        if lang == 'all':
+            return "1", ()
+        if lang not in self._all_languages:
+            raise ValueError("No such language: " + lang)
+        return f"{column} = ?", (lang,)
 
     def validate_language(self, lang):
-        """Check if the given language is legal to use and create a new table for it if needed"""
-        if lang.startswith("sqlite"):
+        """Check if the given language is legal to use and create it if needed"""
+        if not _is_legal_language(lang):
             raise ValueError("Illegal language name: " + lang)
         if lang in self._all_languages:
             return True
         else:
             if click.confirm(f"No tango-cho for '{lang}' exists. Create?", default=False):
-                self._db.cursor().execute(f"CREATE TABLE '{lang}' (" +
-                                          "id INTEGER PRIMARY KEY AUTOINCREMENT," +
-                                          ",".join([f"'{field}' TEXT" for field in lang_fields]) +
-                                          ")"
-                                          )
-                self._db.commit()
-                self._all_languages.extend(lang)
+                self.add_language(lang)
                 return True
             else:
                 return False
 
+    def add_language(self, lang):
+        """Create a new, empty language"""
+        if not _is_legal_language(lang):
+            raise ValueError("Illegal language name: " + lang)
+        with self._write_lock:
+            self._db.execute("INSERT OR IGNORE INTO languages (name) VALUES (?)", (lang,))
+            self._db.commit()
+        if lang not in self._all_languages:
+            self._all_languages.append(lang)
+
     def get_tango(self, lang, tango_id):
         if lang not in self._all_languages:
             raise ValueError("No such language: " + lang)
-        return self._db.cursor().execute(
-            f"SELECT *, '{lang}' as lang from '{lang}' WHERE id=:id", {"id": tango_id}).fetchone()
+        return self._db.cursor().execute("SELECT * FROM cards WHERE id=? AND lang=?", (tango_id, lang)).fetchone()
 
-    def get_tango_for_language(self, lang):
+    def get_tango_for_language(self, lang, columns=None):
         """Return a list of all of the tango for the given language. If lang is 'all', then
-        all tango for all languages are returned."""
+        all tango for all languages are returned. With columns, only those columns are read."""
+        lang_filter, params = self._filter_language(lang)
+        return self._db.cursor().execute(f"SELECT {_select_columns(columns)} FROM cards WHERE {lang_filter}",
+                                         params).fetchall()
 
-        def get_for_one_language(lang):
-            return self._db.cursor().execute(f"SELECT *, '{lang}' as lang FROM '{lang}';").fetchall()
+    def iter_tango(self, lang, with_schedule=False, columns=None):
+        """Generate all of the tango for the given language (or all languages if lang is 'all'), reading
+        them from the database one at a time. With with_schedule, each tango also has its SM2+ variables.
+        With columns, only those columns of the tango are read."""
+        lang_filter, params = self._filter_language(lang, "c.lang")
+        if with_schedule:
+            query = f"""SELECT {_select_columns(columns, "c")}, s.difficulty, s.daysBetweenReviews,
+                    s.dateLastReviewed, s.nextDue
+                FROM cards c LEFT JOIN sm2_plus s ON s.lang = c.lang AND s.tango_id = c.id
+                WHERE {lang_filter} ORDER BY c.id"""
+        else:
+            query = f"SELECT {_select_columns(columns, 'c')} FROM cards c WHERE {lang_filter} ORDER BY c.id"
+        yield from self._db.cursor().execute(query, params)
 
+    def iter_review_history(self, lang):
+        """Generate the review history of the given language (or all languages if lang is 'all'), oldest first"""
         if lang == 'all':
-            entries = []
-            for language in self._all_languages:
-                entries.extend(get_for_one_language(language))
-            return entries
-        else:
-            if lang not in self._all_languages:
-                raise ValueError("No such language: " + lang)
-            return get_for_one_language(lang)
+            return iter(self._db.cursor().execute("SELECT * FROM review_history ORDER BY id"))
+        return iter(self._db.cursor().execute("SELECT * FROM review_history WHERE lang=? ORDER BY id", (lang,)))
+
+    def _update_review_stats(self):
+        """Add the reviews logged since the last update to the daily review counts"""
+        with self._write_lock, self._db:
+            row = self._db.execute("SELECT value FROM review_stats_state WHERE name='last_review_id'").fetchone()
+            last_counted = row['value'] if row else 0
+            last_id = self._db.execute("SELECT coalesce(max(id), 0) AS id FROM review_history").fetchone()['id']
+            if last_id <= last_counted:
+                return
+            self._db.execute("""INSERT INTO review_stats_daily (day, lang, score, reviews)
+                SELECT date(timestamp, 'unixepoch', 'localtime') AS day, lang, score, count(*) FROM review_history
+                WHERE id > ? AND id <= ? GROUP BY day, lang, score
+                ON CONFLICT (day, lang, score) DO UPDATE SET reviews = reviews + excluded.reviews""",
+                             (last_counted, last_id))
+            self._db.execute("INSERT OR REPLACE INTO review_stats_state (name, value) VALUES ('last_review_id', ?)",
+                             (last_id,))
+
+    def get_review_stats(self, lang, since_day=None):
+        """Return the number of reviews of the given language (or all languages if lang is 'all') per
+        day, language and score, as dicts with day (local YYYY-MM-DD), lang, score and reviews. With
+        since_day, only the days from since_day on are returned."""
+        lang_filter, params = self._filter_language(lang)
+        self._update_review_stats()
+        return self._db.execute(f"""SELECT * FROM review_stats_daily WHERE {lang_filter} AND day >= ?
+            ORDER BY day, lang, score""", (*params, since_day or "")).fetchall()
+
+    def get_language_counts(self, now):
+        """Return the number of tango and of tango due at now (epoch seconds) of each language, as dicts
+        with lang, tango and due"""
+        counts = {lang: {"lang": lang, "tango": 0, "due": 0} for lang in self._all_languages}
+        for row in self._db.execute("SELECT lang, count(*) AS tango FROM cards GROUP BY lang"):
+            counts[row['lang']]['tango'] = row['tango']
+        for lang in self._all_languages:
+            counts[lang]['due'] = self._db.execute("SELECT count(*) AS due FROM sm2_plus WHERE lang = ? AND nextDue <= ?",
+                                                   (lang, now)).fetchone()['due']
+        return list(counts.values())
 
     def add_tango(self, lang, tango):
-        """Add the tango to the database and return the automatically created ID"""
+        """Add the tango to the database and return the automatically created ID. If the tango has an
+        image_url but no image yet, the image download is queued (see get_image_downloads)."""
         if lang not in self._all_languages:
             raise ValueError("No such language: " + lang)
 
         debug_print(f"Inserting {tango}")
+        created = get_current_timestamp()
         cursor = self._db.cursor()
         cursor.execute(f'''
-            INSERT INTO {lang} (created, headword, pronunciation, morphology, definition, example, image_url, image_base64, notes, source)
-            VALUES('{get_formatted_datetime(get_current_datetime())}', :headword, :pronunciation, :morphology, :definition, :example, :image_url, :image_base64, :notes, :source)''',
-                       tango)
+            INSERT INTO cards (lang, created, headword, pronunciation, morphology, definition, example, image_url, image_hash, notes, source, guid, modified)
+            VALUES(:lang, :created, :headword, :pronunciation, :morphology, :definition, :example, :image_url, :image_hash, :notes, :source, {new_guid_sql}, :created)''',
+                       {**tango, "lang": lang, "created": created})
+        tango_id = cursor.lastrowid
+        self._insert_default_sm2p(cursor, [{"lang": lang, "id": tango_id, "created": created}])
+        if tango.get('image_url') and not tango.get('image_hash'):
+            cursor.execute("INSERT INTO image_downloads (lang, tango_id, url) VALUES (?, ?, ?)",
+                           (lang, tango_id, tango['image_url']))
         self._db.commit()
-        return cursor.lastrowid
+        return tango_id
+
+    def import_tango(self, lang, tango_iter, batch_size=5000, commit_every=100000):
+        """Add or update (matching on headword) all of the given tango, reading them lazily from
+        tango_iter. Fields a tango doesn't have are left unchanged for existing tango and empty for
+        new ones. Rows are written with executemany in batches and committed every commit_every
+        tango. Returns the numbers of (added, updated) tango."""
+        if lang not in self._all_languages:
+            raise ValueError("No such language: " + lang)
+        fields = [field for field in lang_fields if field not in ('created', 'image_hash')]
+        changed = " OR ".join(f"coalesce(?, {field}) IS NOT {field}" for field in fields)
+        # parameters are positional (each field twice, then the id), which binds faster than names
+        update_sql = ("UPDATE cards SET " + ", ".join(f"{field} = coalesce(?, {field})" for field in fields) +
+                      f" WHERE id = ? AND ({changed})")
+        insert_sql = (f"INSERT INTO cards (lang, created, modified, guid, {', '.join(fields)}) "
+                      f"VALUES (?, ?2, ?2, {new_guid_sql}, " + ", ".join("coalesce(?, '')" for _ in fields) + ")")
+        added = updated = uncommitted = 0
+        with self._write_lock:
+            for batch in _batches(tango_iter, batch_size):
+                # the last of several tango with the same headword wins
+                by_headword = {}
+                for tango in batch:
+                    # headwords are stored as text, so a number (e.g. from JSON) has to match its text
+                    headword = str(tango['headword'])
+                    by_headword[headword] = tuple(headword if field == 'headword' else tango.get(field)
+                                                  for field in fields)
+                existing = self._get_ids_by_headword(lang, list(by_headword))
+                new_rows = []
+                update_rows = []
+                for headword, row in by_headword.items():
+                    if headword in existing:
+                        update_rows.append(row + (existing[headword],) + row)
+                    else:
+                        new_rows.append(row)
+                if update_rows:
+                    updated += self._db.executemany(update_sql, update_rows).rowcount
+                if new_rows:
+                    created = get_current_timestamp()
+                    last_id = self._db.execute("SELECT coalesce(max(id), 0) AS id FROM cards").fetchone()['id']
+                    self._db.executemany(insert_sql, [(lang, created) + row for row in new_rows])
+                    # ids are autoincremented, so the new tango are exactly those after last_id
+                    defaults = get_default_sm2p({"created": created})
+                    self._db.execute("""INSERT INTO sm2_plus
+                        (lang, tango_id, difficulty, daysBetweenReviews, dateLastReviewed, nextDue)
+                        SELECT lang, id, ?, ?, ?, ? FROM cards WHERE id > ?""",
+                                     (defaults['difficulty'], defaults['daysBetweenReviews'],
+                                      defaults['dateLastReviewed'], defaults['nextDue'], last_id))
+                    self._db.execute("""INSERT INTO image_downloads (lang, tango_id, url)
+                        SELECT lang, id, image_url FROM cards WHERE id > ? AND image_url != ''""", (last_id,))
+                    added += len(new_rows)
+                uncommitted += len(batch)
+                if uncommitted >= commit_every:
+                    self._db.commit()
+                    uncommitted = 0
+            self._db.commit()
+        return added, updated
+
+    def _get_ids_by_headword(self, lang, headwords):
+        ids = {}
+        cursor = self._db.cursor()
+        cursor.row_factory = None
+        # stay well below sqlite's limit on the number of query parameters
+        for start in range(0, len(headwords), 500):
+            chunk = headwords[start:start + 500]
+            ids.update((headword, tango_id) for tango_id, headword in cursor.execute(
+                f"SELECT id, headword FROM cards WHERE lang = ? AND headword IN ({', '.join('?' for _ in chunk)})",
+                [lang, *chunk]))
+        return ids
+
+    def search_tango(self, query, lang='all', limit=20):
+        """Return the tango (with their lang) whose headword, pronunciation, definition, example or
+        notes contain all of the words of query, best matches first. A word ending in * matches any
+        word starting with it. If lang is 'all', every language is searched."""
+        lang_filter, params = self._filter_language(lang)
+        match = _to_search_query(query)
+        if not match:
+            return []
+        # limit the matches before joining, so that FTS5 only has to rank and sort the index
+        return self._db.execute(f"""
+            SELECT c.*, s.rank AS rank
+            FROM (SELECT rowid, rank FROM cards_search WHERE cards_search MATCH ? AND {lang_filter}
+                  ORDER BY rank LIMIT ?) s
+            JOIN cards c ON c.id = s.rowid
+            ORDER BY s.rank""", (match, *params, limit)).fetchall()
 
     def update_tango(self, lang, tango):
         if lang not in self._all_languages:
             raise ValueError("No such language: " + lang)
-        self._db.cursor().execute(f'''
-            UPDATE {lang} SET headword=:headword, pronunciation=:pronunciation, morphology=:morphology, definition=:definition, example=:example, image_url=:image_url, image_base64=:image_base64, notes=:notes, source=:source
-            WHERE id=:id''',
-                                  tango)
+        self._db.cursor().execute('''
+            UPDATE cards SET headword=:headword, pronunciation=:pronunciation, morphology=:morphology, definition=:definition, example=:example, image_url=:image_url, image_hash=:image_hash, notes=:notes, source=:source
+            WHERE id=:id AND lang=:lang''',
+                                  {**tango, "lang": lang})
+        self._db.commit()
+
+    def add_image(self, data):
+        """Store the image bytes (if they are not stored already) and return the hash to reference them by"""
+        image_hash = hashlib.sha256(data).hexdigest()
+        self._db.execute("INSERT OR IGNORE INTO images (hash, data) VALUES (?, ?)", (image_hash, data))
         self._db.commit()
+        return image_hash
+
+    def get_image_size(self, image_hash):
+        row = self._db.execute("SELECT length(data) AS size FROM images WHERE hash=?", (image_hash,)).fetchone()
+        if row is None:
+            raise ValueError("No such image: " + image_hash)
+        return row['size']
+
+    def iter_image_chunks(self, image_hash, chunk_size=3 * 2 ** 16):
+        """Generate the bytes of the image in chunks, without ever loading the whole image into memory"""
+        row = self._db.execute("SELECT rowid, length(data) AS size FROM images WHERE hash=?", (image_hash,)).fetchone()
+        if row is None:
+            raise ValueError("No such image: " + image_hash)
+        if hasattr(self._db, 'blobopen'):
+            with self._db.blobopen("images", "data", row['rowid'], readonly=True) as blob:
+                while True:
+                    chunk = blob.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+        else:
+            # substr() on a blob column only reads the pages it needs
+            for offset in range(1, row['size'] + 1, chunk_size):
+                yield self._db.execute("SELECT substr(data, ?, ?) AS chunk FROM images WHERE rowid=?",
+                                       (offset, chunk_size, row['rowid'])).fetchone()['chunk']
+
+    def get_image_variant(self, image_hash, columns, rows):
+        """Return the image's variant for an area of columns x rows terminal cells as {'data': ...}, where
+        data is None if the original is shown as is, or None if no variant has been made yet"""
+        return self._db.execute("SELECT data FROM image_variants WHERE hash=? AND columns=? AND rows=?",
+                                (image_hash, columns, rows)).fetchone()
+
+    def add_image_variant(self, image_hash, columns, rows, data):
+        with self._write_lock:
+            self._db.execute("INSERT OR REPLACE INTO image_variants (hash, columns, rows, data) VALUES (?, ?, ?, ?)",
+                             (image_hash, columns, rows, data))
+            self._db.commit()
+
+    def get_image_downloads(self, max_attempts=None, tango_ids=None):
+        """Return the queued image downloads, optionally only those tried fewer than max_attempts times, and
+        only those of the tango with the given ids"""
+        conditions = []
+        params = []
+        if max_attempts is not None:
+            conditions.append("attempts < ?")
+            params.append(max_attempts)
+        if tango_ids is not None:
+            tango_ids = list(tango_ids)
+            conditions.append(f"tango_id IN ({', '.join('?' for _ in tango_ids)})")
+            params.extend(tango_ids)
+        return self._db.execute(f"SELECT * FROM image_downloads WHERE {' AND '.join(conditions) or '1'} ORDER BY id",
+                                params).fetchall()
+
+    def queue_missing_image_downloads(self):
+        """Queue a download for every tango with an image_url but no image that isn't queued already.
+        Returns the number of downloads queued."""
+        with self._write_lock, self._db:
+            return self._db.execute("""INSERT INTO image_downloads (lang, tango_id, url)
+                SELECT lang, id, trim(image_url) FROM cards c
+                WHERE trim(coalesce(image_url, '')) != '' AND image_hash IS NULL
+                    AND NOT EXISTS (SELECT 1 FROM image_downloads d WHERE d.tango_id = c.id)
+                ORDER BY id""").rowcount
+
+    def finish_image_download(self, download, data):
+        """Store the downloaded image, point the download's tango at it and remove the download from the queue"""
+        return self.finish_image_downloads([(download, data)])[0]
+
+    def finish_image_downloads(self, results):
+        """finish_image_download for each (download, data) pair, in one transaction. Returns the image hashes."""
+        image_hashes = []
+        for download, data in results:
+            if download['lang'] not in self._all_languages:
+                raise ValueError("No such language: " + download['lang'])
+            image_hashes.append(hashlib.sha256(data).hexdigest())
+        with self._write_lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO images (hash, data) VALUES (?, ?)",
+                                 [(image_hash, data) for image_hash, (_, data) in zip(image_hashes, results)])
+            self._db.executemany("UPDATE cards SET image_hash=? WHERE id=?",
+                                 [(image_hash, download['tango_id'])
+                                  for image_hash, (download, _) in zip(image_hashes, results)])
+            self._db.executemany("DELETE FROM image_downloads WHERE id=?",
+                                 [(download['id'],) for download, _ in results])
+        return image_hashes
+
+    def fail_image_download(self, download, error):
+        self.fail_image_downloads([(download, error)])
+
+    def fail_image_downloads(self, failures):
+        """Count a failed attempt for each (download, error) pair, in one transaction"""
+        with self._write_lock, self._db:
+            self._db.executemany("UPDATE image_downloads SET attempts = attempts + 1, last_error=? WHERE id=?",
+                                 [(str(error), download['id']) for download, error in failures])
+
+    def get_sync_peer(self, name):
+        """Return how far changes have been exported to the named peer, as {'card_seq': ..., 'review_id': ...}"""
+        row = self._db.execute("SELECT card_seq, review_id FROM sync_peers WHERE name=?", (name,)).fetchone()
+        return row or {"card_seq": 0, "review_id": 0}
+
+    def set_sync_peer(self, name, card_seq, review_id):
+        with self._write_lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO sync_peers (name, card_seq, review_id) VALUES (?, ?, ?)",
+                             (name, card_seq, review_id))
+
+    def get_sync_marks(self):
+        """Return the latest card change and review, as {'card_seq': ..., 'review_id': ...}"""
+        return self._db.execute("""SELECT (SELECT coalesce(max(seq), 0) FROM card_changes) AS card_seq,
+            (SELECT coalesce(max(id), 0) FROM review_history) AS review_id""").fetchone()
+
+    def iter_changed_cards(self, peer, after_seq, up_to_seq):
+        """Generate the cards changed after card change after_seq, up to and including up_to_seq, except
+        for changes imported from peer"""
+        yield from self._db.cursor().execute("""SELECT c.* FROM card_changes l JOIN cards c ON c.id = l.card_id
+            WHERE l.seq > ? AND l.seq <= ? AND l.origin IS NOT ? ORDER BY l.seq""", (after_seq, up_to_seq, peer))
+
+    def iter_new_reviews(self, peer, after_id, up_to_id):
+        """Generate the reviews logged after review after_id, up to and including up_to_id, with the guid
+        of their card, except for reviews imported from peer"""
+        yield from self._db.cursor().execute("""SELECT c.guid AS card, h.timestamp, h.score, h.data
+            FROM review_history h JOIN cards c ON c.id = h.tango_id
+            WHERE h.id > ? AND h.id <= ? AND h.origin IS NOT ? ORDER BY h.id""", (after_id, up_to_id, peer))
+
+    def merge_synced_cards(self, peer, cards):
+        """Add or update cards from the tango-cho of peer, matching them by guid. Of two versions of a card,
+        the one modified last wins (ties are broken by comparing the fields, so every tango-cho picks the
+        same one). A card's image_hash is only used if the image is stored here; otherwise its image is
+        downloaded from its image_url. The changes are not exported back to peer. Returns the ids of the
+        added cards and of the updated ones."""
+        added = []
+        updated = []
+        fields = ", ".join(sync_fields)
+        with self._write_lock, self._db:
+            for card in cards:
+                if card['lang'] not in self._all_languages:
+                    self._db.execute("INSERT OR IGNORE INTO languages (name) VALUES (?)", (card['lang'],))
+                    self._all_languages.append(card['lang'])
+                local = self._db.execute("SELECT * FROM cards WHERE guid=?", (card['guid'],)).fetchone()
+                image_hash = card.get('image_hash')
+                if image_hash and not self._db.execute("SELECT 1 FROM images WHERE hash=?", (image_hash,)).fetchone():
+                    image_hash = None
+                if local is None:
+                    tango_id = self._db.execute(f"""INSERT INTO cards (lang, guid, modified, image_hash, {fields})
+                        VALUES (?, ?, ?, ?, {', '.join('?' for _ in sync_fields)})""",
+                                                (card['lang'], card['guid'], card['modified'], image_hash,
+                                                 *(card.get(field) for field in sync_fields))).lastrowid
+                    # replaced by replaying the card's history once its reviews are merged too
+                    self._insert_default_sm2p(self._db, [{"lang": card['lang'], "id": tango_id,
+                                                          "created": card.get('created') or 0}])
+                    added.append(tango_id)
+                elif _sync_key(card) > _sync_key(local):
+                    tango_id = local['id']
+                    if image_hash is None and card.get('image_url') == local['image_url']:
+                        image_hash = local['image_hash']
+                    self._db.execute(f"""UPDATE cards SET modified = ?, image_hash = ?,
+                        {', '.join(f'{field} = ?' for field in sync_fields)} WHERE id = ?""",
+                                     (card['modified'], image_hash, *(card.get(field) for field in sync_fields),
+                                      tango_id))
+                    if card['modified'] == local['modified']:
+                        # a tie broken by the fields leaves modified as it was, which cards_sync_modified takes
+                        # for an edit made here and bumps; put back the synced time so both sides agree on it
+                        self._db.execute("UPDATE cards SET modified = ? WHERE id = ?", (card['modified'], tango_id))
+                    updated.append(tango_id)
+                else:
+                    if image_hash and not local['image_hash'] and card.get('image_url') == local['image_url']:
+                        self._db.execute("UPDATE cards SET image_hash = ? WHERE id = ?", (image_hash, local['id']))
+                    continue
+                self._db.execute("UPDATE card_changes SET origin = ? WHERE card_id = ?", (peer, tango_id))
+                if image_hash is None and (card.get('image_url') or '').strip():
+                    self._db.execute("DELETE FROM image_downloads WHERE tango_id = ?", (tango_id,))
+                    self._db.execute("INSERT INTO image_downloads (lang, tango_id, url) VALUES (?, ?, ?)",
+                                     (card['lang'], tango_id, card['image_url'].strip()))
+        return added, updated
+
+    def merge_synced_reviews(self, peer, reviews):
+        """Add the reviews from the tango-cho of peer that aren't in the history yet; a review is identified
+        by its card's guid, its time and its score. Returns the ids of the cards that got new reviews and the
+        number of reviews of cards that don't exist here."""
+        reviewed = set()
+        unknown = 0
+        with self._write_lock, self._db:
+            for review in reviews:
+                card = self._db.execute("SELECT id, lang FROM cards WHERE guid=?", (review['card'],)).fetchone()
+                if card is None:
+                    unknown += 1
+                    continue
+                if self._db.execute("""INSERT INTO review_history (lang, tango_id, timestamp, score, data, origin)
+                        SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM review_history
+                            WHERE lang = ? AND tango_id = ? AND timestamp = ? AND score = ?)""",
+                                    (card['lang'], card['id'], review['timestamp'], review['score'], review.get('data'),
+                                     peer, card['lang'], card['id'], review['timestamp'], review['score'])).rowcount:
+                    reviewed.add(card['id'])
+        return reviewed, unknown
 
     def log_study(self, tango, score):
         cursor = self._db.cursor()
-        date_now = get_formatted_datetime(get_current_datetime())
+        date_now = get_current_timestamp()
         debug_print(f'''
             INSERT INTO review_history (lang, tango_id, timestamp, score)
-            VALUES(:lang, :id, '{date_now}', '{str(score)}')''')
-        cursor.execute(f'''
-            INSERT INTO review_history (lang, tango_id, timestamp, score)
-            VALUES(:lang, :id, '{date_now}', '{str(score)}')''', tango)
-        self._db.commit()
+            VALUES(:lang, :id, {date_now}, '{str(score)}')''')
+        with self._write_lock:
+            cursor.execute(f'''
+                INSERT INTO review_history (lang, tango_id, timestamp, score)
+                VALUES(:lang, :id, {date_now}, '{str(score)}')''', {"lang": tango['lang'], "id": tango['id']})
+            self._db.commit()
+
+    def record_review(self, tango, score, sm2p_vars, timestamp):
+        """Add a review of the tango to the history and save its new SM2+ variables, atomically. In
+        write-behind mode the transaction is committed later, together with the reviews after it."""
+        row = {**tango, **sm2p_vars, "timestamp": timestamp, "score": str(score)}
+        with self._write_lock:
+            if not self._db.in_transaction:
+                self._db.execute("BEGIN")
+            # a savepoint lets a failed review be undone without losing the rest of a write-behind group
+            self._db.execute("SAVEPOINT record_review")
+            try:
+                self._db.execute("""INSERT INTO review_history (lang, tango_id, timestamp, score)
+                    VALUES (:lang, :id, :timestamp, :score)""", row)
+                self._db.execute("""INSERT OR REPLACE INTO sm2_plus
+                    (lang, tango_id, difficulty, daysBetweenReviews, dateLastReviewed, nextDue)
+                    VALUES (:lang, :id, :difficulty, :daysBetweenReviews, :dateLastReviewed, :nextDue)""", row)
+            except Exception:
+                self._db.execute("ROLLBACK TO record_review")
+                raise
+            finally:
+                self._db.execute("RELEASE record_review")
+            if self._write_behind_interval is None:
+                self._db.commit()
+            elif self._commit_timer is None:
+                self._commit_timer = threading.Timer(self._write_behind_interval, self.flush)
+                self._commit_timer.daemon = True
+                self._commit_timer.start()
+
+    def enable_write_behind(self, interval=5.0):
+        """Group-commit reviews: instead of committing each one, record_review commits at most every
+        interval seconds, and whatever is left is committed by flush() or on exit."""
+        if self._write_behind_interval is None:
+            atexit.register(self.flush)
+        self._write_behind_interval = interval
+
+    def flush(self):
+        """Commit any reviews held back by write-behind mode"""
+        with self._write_lock:
+            if self._commit_timer is not None:
+                self._commit_timer.cancel()
+                self._commit_timer = None
+            self._db.commit()
+
+
+# with TANGO_PROFILE=1, every query is timed
+profile_methods(Model, "model")
+
+
+def _is_legal_language(lang):
+    # 'all' stands for every language
+    return bool(lang) and lang != 'all'
+
+
+def _select_columns(columns, table=None):
+    """Return the SQL list of the given columns of cards, or of all of them if columns is None"""
+    prefix = f"{table}." if table else ""
+    if columns is None:
+        return prefix + "*"
+    unknown = set(columns) - card_columns
+    if unknown:
+        raise ValueError("No such columns: " + ", ".join(sorted(unknown)))
+    return ", ".join(prefix + column for column in columns)
+
+
+def _sync_key(card):
+    # orders the versions of a card for merging synced cards
+    return card['modified'] or 0, json.dumps([card.get(field) for field in sync_fields])
+
+
+def _to_search_query(query):
+    """Turn what the user typed into an FTS5 query, quoting each word so that punctuation in it isn't
+    taken for query syntax"""
+    terms = []
+    for word in query.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return " ".join(terms)
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
-model_instance = Model()
+model_instance = None
 
 
 def get_model():
+    global model_instance
+    if model_instance is None:
+        model_instance = Model()
     return model_instance
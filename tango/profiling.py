@@ -0,0 +1,82 @@
+# Opt-in timing of model queries, SM2+ updates and screen transitions. Run tango with TANGO_PROFILE=1
+# to append the duration of each timed operation to ~/.tangocho/profile.log, and summarize them with
+# 'tango profile report'. When profiling is off, the decorators return the functions unchanged.
+import functools
+import inspect
+import logging
+import math
+import os
+import time
+
+from .utils import app_data_path, log_to_file
+
+PROFILE_FILE_NAME = "profile.log"
+profile_path = app_data_path / PROFILE_FILE_NAME
+
+enabled = os.environ.get("TANGO_PROFILE", "") not in ("", "0")
+
+# records are "operation<TAB>seconds" lines, written by the logging thread
+profile_logger = logging.getLogger("tango.profile")
+profile_logger.setLevel(logging.INFO)
+profile_logger.propagate = False
+
+
+def record(operation, seconds):
+    if not profile_logger.handlers:
+        log_to_file(profile_logger, PROFILE_FILE_NAME, "%(message)s")
+    profile_logger.info("%s\t%.9f", operation, seconds)
+
+
+def profiled(operation):
+    """Decorator recording the time each call takes as operation. Generators are timed until they are
+    exhausted or closed."""
+    def decorate(function):
+        if not enabled:
+            return function
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def timed_generator(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    yield from function(*args, **kwargs)
+                finally:
+                    record(operation, time.perf_counter() - start)
+            return timed_generator
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(operation, time.perf_counter() - start)
+        return timed
+    return decorate
+
+
+def profile_methods(cls, prefix):
+    """Time every public method of cls as prefix.method_name"""
+    if enabled:
+        for name, attr in list(vars(cls).items()):
+            if not name.startswith('_') and inspect.isfunction(attr):
+                setattr(cls, name, profiled(f"{prefix}.{name}")(attr))
+    return cls
+
+
+def read_profile(path=None):
+    """Return {operation: [seconds, ...]} from a profile log"""
+    timings = {}
+    with open(path or profile_path, encoding="utf-8") as f:
+        for line in f:
+            operation, _, seconds = line.rstrip("\n").partition("\t")
+            try:
+                timings.setdefault(operation, []).append(float(seconds))
+            except ValueError:
+                # a line cut short when tango was killed
+                continue
+    return timings
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of a non-empty sorted list"""
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
@@ -1,21 +1,98 @@
 # Determines which words should be studied in the current session using
 # the SM2+ algorithm described here: http://www.blueraja.com/blog/477/a-better-spaced-repetition-learning-algorithm-sm2
+from itertools import islice
+
 from . import model
-from .utils import get_datetime_from_string, get_current_datetime
+from .profiling import profiled
+from .utils import get_current_timestamp
 
 correct_threshold = 0.5
 
+# performance rating for each Score, by name
+performance_ratings = {
+    "BAD": 0.0,
+    "OK": 0.5,
+    "GREAT": 1.0,
+}
+
 DAY_TO_SECONDS = 24 * 60 * 60
 
 
 def get_default_variables(tango):
-    return {"difficulty": 0.3, "dateLastReviewed": tango['created'], 'daysBetweenReviews': .25}
+    sm2p_vars = {"difficulty": 0.3, "dateLastReviewed": tango['created'], 'daysBetweenReviews': .25}
+    sm2p_vars['nextDue'] = get_next_due(sm2p_vars)
+    return sm2p_vars
+
 
+def get_next_due(sm2p_vars):
+    """Return the time (in epoch seconds) at which a tango with the given variables is due for review"""
+    return int(sm2p_vars['dateLastReviewed'] + sm2p_vars['daysBetweenReviews'] * DAY_TO_SECONDS)
 
+
+@profiled("sm2.update_sm2p")
 def update_sm2p(tango, performance_rating):
-    sm2p_vars = _get_vars_for_tango(tango)
+    date_now = get_current_timestamp()
+    sm2p_vars = get_updated_variables(_get_vars_for_tango(tango), performance_rating, date_now)
+    model.get_model().update_sm2p_vars(tango, sm2p_vars)
+
+
+@profiled("sm2.record_review")
+def record_review(tango, score):
+    """Log a review of the tango with the given Score and update its SM2+ variables, all in one transaction"""
+    date_now = get_current_timestamp()
+    sm2p_vars = get_updated_variables(_get_vars_for_tango(tango), performance_ratings[score.name], date_now)
+    model.get_model().record_review(tango, score, sm2p_vars, date_now)
+
+
+def replay_reviews(review_rows):
+    """Generate the (lang, id, difficulty, daysBetweenReviews, dateLastReviewed, nextDue) that each tango
+    ends up with after its reviews, from (lang, id, created, timestamp, score) rows ordered by tango and
+    then by time, as generated by Model.iter_review_replay. Reviews with unknown scores are skipped."""
+    # scores are stored as str(Score), e.g. 'Score.GREAT'
+    ratings = {f"Score.{name}": rating for name, rating in performance_ratings.items()}
+    key = sm2p_vars = None
+    for lang, tango_id, created, timestamp, score in review_rows:
+        if (lang, tango_id) != key:
+            if key is not None:
+                yield key + _vars_tuple(sm2p_vars)
+            key = (lang, tango_id)
+            # tango without a creation time start at their first review, or are simply due
+            if created is None:
+                created = timestamp or 0
+            sm2p_vars = get_default_variables({"created": created})
+        rating = ratings.get(score)
+        if rating is not None:
+            sm2p_vars = get_updated_variables(sm2p_vars, rating, timestamp)
+    if key is not None:
+        yield key + _vars_tuple(sm2p_vars)
+
+
+def _vars_tuple(sm2p_vars):
+    return (sm2p_vars['difficulty'], sm2p_vars['daysBetweenReviews'], sm2p_vars['dateLastReviewed'],
+            sm2p_vars['nextDue'])
+
+
+@profiled("sm2.rebuild_schedule")
+def rebuild_schedule(batch_size=10000, tango_ids=None):
+    """Recompute the SM2+ variables of every tango (or only of the tango with the given ids) by replaying
+    the review history. Returns the number of tango."""
+    tango_model = model.get_model()
+    # reviews held back in write-behind mode have to be in the history before it is replayed
+    tango_model.flush()
+    if tango_ids is None:
+        return tango_model.replace_sm2p_vars(replay_reviews(tango_model.iter_review_replay()), batch_size)
+    count = 0
+    sm2p_rows = replay_reviews(tango_model.iter_review_replay(tango_ids))
+    while batch := list(islice(sm2p_rows, batch_size)):
+        tango_model.save_sm2p_vars(batch)
+        count += len(batch)
+    return count
+
+
+def get_updated_variables(sm2p_vars, performance_rating, date_now):
+    """Return the SM2+ variables that result from a review at date_now with the given performance rating"""
+    sm2p_vars = dict(sm2p_vars)
     correct = performance_rating >= correct_threshold
-    date_now = get_current_datetime()
     if correct:
         percent_overdue = min(2, _get_percent_overdue(date_now, sm2p_vars))
     else:
@@ -28,7 +105,8 @@ def update_sm2p(tango, performance_rating):
         sm2p_vars['daysBetweenReviews'] *= 1 / difficulty_weight ** 2
 
     sm2p_vars['dateLastReviewed'] = date_now
-    model.get_model().update_sm2p_vars(tango, sm2p_vars)
+    sm2p_vars['nextDue'] = get_next_due(sm2p_vars)
+    return sm2p_vars
 
 
 def _get_vars_for_tango(tango):
@@ -36,8 +114,7 @@ def _get_vars_for_tango(tango):
 
 
 def _get_percent_overdue(date_now, sm2p_vars):
-    delta = date_now - get_datetime_from_string(sm2p_vars['dateLastReviewed'])
-    delta_days = float(delta.total_seconds()) / DAY_TO_SECONDS
+    delta_days = (date_now - sm2p_vars['dateLastReviewed']) / DAY_TO_SECONDS
     return delta_days / sm2p_vars['daysBetweenReviews']
 
 
@@ -45,16 +122,8 @@ def _get_difficulty_weight(difficulty):
     return 3 - 1.7 * difficulty
 
 
-def prioritize_study(tango_list):
-    """Given the list of all entries available for study, return a list of the ones that should
-    be studied, in the order that they should be studied."""
-    date_now = get_current_datetime()
-    prioritized_tango_list = []
-    for tango in tango_list:
-        sm2p_vars = _get_vars_for_tango(tango)
-        tango['percent_overdue'] = _get_percent_overdue(date_now, sm2p_vars)
-        if tango['percent_overdue'] >= 1:
-            prioritized_tango_list.append(tango)
-
-    prioritized_tango_list.sort(key=lambda t: t['percent_overdue'], reverse=True)
-    return prioritized_tango_list
+@profiled("sm2.prioritize_study")
+def prioritize_study(lang):
+    """Return (lang, id, percent_overdue) entries for the tango of the given language (or 'all')
+    that should be studied, in the order that they should be studied."""
+    return model.get_model().get_due_tango(lang, get_current_timestamp())
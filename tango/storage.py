@@ -0,0 +1,120 @@
+# Where the tango-cho lives and how connections to it are opened. Model (and the worker threads with
+# models of their own) get their connections from the current engine, which the CLI picks per
+# invocation with --engine and --db.
+import itertools
+import sqlite3
+from pathlib import Path
+
+from .utils import app_data_path
+
+default_db_path = app_data_path / "tango.db"
+
+ENGINES = ['sqlite', 'memory']
+
+
+class SqliteEngine:
+    """A tango-cho database file"""
+    # WAL: commits don't wait for the disk and readers don't block the writer.
+    # synchronous=NORMAL: in WAL mode, a power loss can lose the last commits but never corrupts the database.
+    # cache_size: up to 64MB of pages are kept in memory (negative sizes are in KiB).
+    # mmap_size: up to 256MB of the file are read through memory mapping instead of read() calls.
+    # busy_timeout: wait for another tango process's write instead of failing right away.
+    pragmas = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64 * 1024,
+        "mmap_size": 256 * 2 ** 20,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    }
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path is not None else default_db_path
+
+    def exists(self):
+        return self.path.exists()
+
+    def connect(self):
+        # sqlite creates the database file, but not the directory it goes in
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # connections are shared with the write-behind commit timer, see Model.enable_write_behind
+        db = sqlite3.connect(str(self.path), check_same_thread=False)
+        _apply_pragmas(db, self.pragmas)
+        return db
+
+    def __str__(self):
+        return str(self.path)
+
+
+class MemoryEngine:
+    """A tango-cho that only lives in memory, for tests and benchmarks. All connections from the same
+    engine see the same database (through sqlite's shared cache), so worker threads can open their own
+    models as usual. The database is discarded when the engine is closed or the process exits."""
+    # connections share one cache, so reads must not wait for a write-behind transaction to be committed
+    pragmas = {
+        "read_uncommitted": 1,
+        "temp_store": "MEMORY",
+    }
+    _names = itertools.count()
+
+    def __init__(self, name=None):
+        if name is None:
+            name = f"tango-{next(self._names)}"
+        self.uri = f"file:{name}?mode=memory&cache=shared"
+        # an in-memory database is deleted when its last connection closes; this one keeps it alive
+        self._keep_alive = self._connect()
+
+    def exists(self):
+        return self._keep_alive is not None and \
+            self._keep_alive.execute("SELECT count(*) FROM sqlite_master").fetchone()[0] > 0
+
+    def connect(self):
+        if self._keep_alive is None:
+            raise sqlite3.ProgrammingError("The in-memory tango-cho has been closed")
+        return self._connect()
+
+    def _connect(self):
+        db = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        _apply_pragmas(db, self.pragmas)
+        return db
+
+    def close(self):
+        if self._keep_alive is not None:
+            self._keep_alive.close()
+            self._keep_alive = None
+
+    def __str__(self):
+        return ":memory:"
+
+
+def _apply_pragmas(db, pragmas):
+    for name, value in pragmas.items():
+        # pragmas don't take parameters; the values are our own constants
+        db.execute(f"PRAGMA {name}={value}")
+
+
+def create_engine(engine='sqlite', path=None):
+    """Return a new engine of the given kind ('sqlite' or 'memory'). path is the database file of a
+    sqlite engine, by default ~/.tangocho/tango.db; ':memory:' selects the memory engine."""
+    if engine == 'memory' or str(path) == ':memory:':
+        return MemoryEngine()
+    if engine == 'sqlite':
+        return SqliteEngine(path)
+    raise ValueError(f"Unknown storage engine {engine}; choose one of {', '.join(ENGINES)}")
+
+
+engine_instance = None
+
+
+def configure(engine='sqlite', path=None):
+    """Select the engine that models use from now on. Must be called before the first model is opened."""
+    global engine_instance
+    engine_instance = create_engine(engine, path)
+    return engine_instance
+
+
+def get_engine():
+    global engine_instance
+    if engine_instance is None:
+        engine_instance = SqliteEngine()
+    return engine_instance
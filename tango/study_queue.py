@@ -0,0 +1,94 @@
+# The order in which due tango are studied during a session. Tango are kept in heaps, most overdue
+# first, so that taking the next tango, re-queueing a failed one and adding tango that become due
+# during the session each take O(log n), without ever re-sorting the deck.
+import heapq
+import itertools
+
+from . import model
+from .sm2_plus import correct_threshold, performance_ratings
+from .utils import get_current_timestamp
+
+# failed tango are shown again after this many other tango
+RELEARN_GAP = 5
+# seconds between checks for tango that have become due since the last check
+REFRESH_INTERVAL = 60
+
+
+class StudyQueue:
+    """The (lang, id) of the tango left to study in a session"""
+
+    def __init__(self, lang, entries, now, relearn_gap=RELEARN_GAP, refresh_interval=REFRESH_INTERVAL):
+        """entries are the (lang, id, percent_overdue) tuples of the tango due at now, in any order, as
+        returned by Model.get_due_tango"""
+        self.lang = lang
+        self.relearn_gap = relearn_gap
+        self.refresh_interval = refresh_interval
+        # breaks ties in insertion order, so that heap items never compare their keys
+        self._counter = itertools.count()
+        # (-percent_overdue, counter, lang, id)
+        self._due = [(-percent_overdue, next(self._counter), tango_lang, tango_id)
+                     for tango_lang, tango_id, percent_overdue in entries]
+        heapq.heapify(self._due)
+        # failed tango: (step to show them again at, counter, lang, id)
+        self._relearn = []
+        self._queued = {item[2:] for item in self._due}
+        # the number of tango taken so far
+        self._step = 0
+        self._last_refresh = now
+
+    @classmethod
+    def load(cls, lang, **kwargs):
+        """Queue the tango of the given language (or 'all') that are due now"""
+        now = get_current_timestamp()
+        return cls(lang, model.get_model().get_due_tango(lang, now), now, **kwargs)
+
+    def __len__(self):
+        return len(self._due) + len(self._relearn)
+
+    def _takes_relearn(self, due, relearn, step):
+        # a failed tango is shown once enough other tango have been, or when nothing else is left
+        return bool(relearn) and (not due or relearn[0][0] <= step)
+
+    def pop(self):
+        """Remove and return the (lang, id) of the tango to study next, or None if there are none left"""
+        self._refresh()
+        if not self:
+            return None
+        source = self._relearn if self._takes_relearn(self._due, self._relearn, self._step) else self._due
+        key = heapq.heappop(source)[2:]
+        self._queued.discard(key)
+        self._step += 1
+        return key
+
+    def peek(self, count):
+        """Return the (lang, id) of the next count (or fewer) tango, without removing them"""
+        # the count smallest items of a heap are all among its first 2 ** count - 1
+        due = sorted(self._due[:2 ** count - 1])[:count]
+        relearn = sorted(self._relearn[:2 ** count - 1])[:count]
+        upcoming = []
+        step = self._step
+        while len(upcoming) < count and (due or relearn):
+            source = relearn if self._takes_relearn(due, relearn, step) else due
+            upcoming.append(source.pop(0)[2:])
+            step += 1
+        return upcoming
+
+    def reviewed(self, tango, score):
+        """Update the queue after a review of the tango with the given Score. A failed tango is queued
+        again, to be shown after relearn_gap other tango."""
+        key = (tango['lang'], tango['id'])
+        if performance_ratings[score.name] < correct_threshold and key not in self._queued:
+            heapq.heappush(self._relearn, (self._step + self.relearn_gap, next(self._counter), *key))
+            self._queued.add(key)
+
+    def _refresh(self):
+        """Queue the tango that have become due since the last refresh, with an indexed range query"""
+        now = get_current_timestamp()
+        if now - self._last_refresh < self.refresh_interval:
+            return
+        for tango_lang, tango_id, percent_overdue in model.get_model().get_due_tango(self.lang, now,
+                                                                                   since=self._last_refresh):
+            if (tango_lang, tango_id) not in self._queued:
+                heapq.heappush(self._due, (-percent_overdue, next(self._counter), tango_lang, tango_id))
+                self._queued.add((tango_lang, tango_id))
+        self._last_refresh = now
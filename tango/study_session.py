@@ -0,0 +1,53 @@
+# A study session without a user interface. 'tango study' and 'tango review --batch' both review
+# through it, and so can scripts and other front-ends:
+#
+#     session = StudySession('ja')
+#     while (tango := session.next()) is not None:
+#         session.record(tango, Score.OK)
+#     session.finish()
+from . import model
+from .model import Score
+from .sm2_plus import record_review
+from .study_queue import StudyQueue
+
+
+class StudySession:
+    """The tango due in a language (or 'all'), in the order they should be studied, and the reviews of
+    them. Reviews are recorded as soon as they are scored; with write_behind they are committed in
+    groups, and finish() commits the rest."""
+
+    def __init__(self, lang, queue=None, write_behind=True):
+        self.lang = lang
+        self.queue = queue if queue is not None else StudyQueue.load(lang)
+        # the number of reviews with each score, by Score name
+        self.scores = dict.fromkeys(Score.__members__, 0)
+        if write_behind:
+            model.get_model().enable_write_behind()
+
+    def __len__(self):
+        """The number of tango left to study, including failed tango that will be shown again"""
+        return len(self.queue)
+
+    def next_key(self):
+        """Remove and return the (lang, id) of the tango to study next, or None if there are none left"""
+        return self.queue.pop()
+
+    def next(self):
+        """Remove and return the tango to study next, or None if there are none left"""
+        key = self.next_key()
+        return None if key is None else model.get_model().get_tango(*key)
+
+    def record(self, tango, score):
+        """Record a review of the tango with the given Score, updating its schedule and requeueing it if
+        it failed"""
+        record_review(tango, score)
+        self.queue.reviewed(tango, score)
+        self.scores[score.name] += 1
+
+    @property
+    def reviewed(self):
+        return sum(self.scores.values())
+
+    def finish(self):
+        """Commit the reviews held back by write-behind mode"""
+        model.get_model().flush()
@@ -1,34 +1,75 @@
+import atexit
 import base64
-import datetime
 import json
 import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from string import Template
+from subprocess import Popen, PIPE
 from urllib.parse import quote as url_quote
 
-import requests
-from dateutil import parser
-
 app_data_path = Path.home() / '.tangocho'
-app_data_path.mkdir(parents=True, exist_ok=True)
 
 # ASCII ctrl-a is 1, ASCII a is 97, etc.
 ascii_ctrl_diff = 96
 
 logger = logging.getLogger(__name__)
-fh = logging.FileHandler(str(app_data_path / "debug.log"))
-fh.setLevel(logging.DEBUG)
-logger.addHandler(fh)
 logger.setLevel(logging.DEBUG)
 
 # languages where we show a pronunciation field
 PRON_LANGS = ['JP', 'ZH', 'KO']
 
 
+def get_app_data_path():
+    """Return the directory holding the tango-cho and the debug log, creating it the first time"""
+    app_data_path.mkdir(parents=True, exist_ok=True)
+    return app_data_path
+
+
+_log_setup_lock = threading.Lock()
+_log_listeners = []
+
+
+def log_to_file(file_logger, file_name, fmt=None):
+    """Send file_logger's records to file_name in the app data directory. Records are handed to a background
+    thread that does the writing, so logging never waits on the disk; whatever is queued is written at exit."""
+    with _log_setup_lock:
+        if file_logger.handlers:
+            return
+        # logging.handlers imports socket, pickle etc., which most invocations never need
+        from logging.handlers import QueueHandler, QueueListener
+        fh = logging.FileHandler(str(get_app_data_path() / file_name))
+        if fmt is not None:
+            fh.setFormatter(logging.Formatter(fmt))
+        records = queue.SimpleQueue()
+        listener = QueueListener(records, fh)
+        listener.start()
+        if not _log_listeners:
+            atexit.register(_stop_log_listeners)
+        _log_listeners.append((file_logger, listener))
+        file_logger.addHandler(QueueHandler(records))
+
+
+def _stop_log_listeners():
+    for file_logger, listener in _log_listeners:
+        # writes what is still queued; anything logged later (by other exit handlers) is written directly
+        listener.stop()
+        for handler in list(file_logger.handlers):
+            file_logger.removeHandler(handler)
+        for handler in listener.handlers:
+            file_logger.addHandler(handler)
+    _log_listeners.clear()
+
+
 def debug_print(message):
-    """Print message to log file (colocated with dictionary files) and flush immediately"""
+    """Print message to log file (colocated with dictionary files) without waiting for it to be written"""
+    # the log file is only opened once something is logged, so that commands that don't log stay fast
+    if not logger.handlers:
+        log_to_file(logger, "debug.log")
     logger.debug(message)
-    logger.handlers[0].flush()
 
 
 # Pretend to be a browser or some servers won't allow image access (lookin' at you, Etsy!)
@@ -36,12 +77,36 @@ REQUEST_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
 
 
-def get_url_as_base64text(url):
+# (connect, read) timeouts in seconds for downloads
+REQUEST_TIMEOUT = (5, 30)
+
+_http_session = None
+
+
+def get_http_session():
+    """Return the shared HTTP session, which pools connections and retries failed requests a few times"""
+    global _http_session
+    if _http_session is None:
+        # requests takes a while to import, and most commands never download anything
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=retry)
+        _http_session = requests.Session()
+        _http_session.headers.update(REQUEST_HEADERS)
+        _http_session.mount('http://', adapter)
+        _http_session.mount('https://', adapter)
+    return _http_session
+
+
+def get_url_content(url):
     # handle data URLs, which for example Google image search gives for image URLs
-    data_url_prefix = 'data:image/jpeg;base64,'
-    if url.startswith(data_url_prefix):
-        return url[len(data_url_prefix) + 1:]
-    return base64.b64encode(requests.get(url, headers=REQUEST_HEADERS).content).decode('ascii')
+    if url.startswith('data:') and ';base64,' in url:
+        return base64.b64decode(url[url.index(';base64,') + len(';base64,'):])
+    response = get_http_session().get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.content
 
 
 # TODO: make language-agnostic
@@ -103,25 +168,15 @@ def get_dictionary_command(lang, word):
 
 
 
-def get_current_datetime():
-    return datetime.datetime.now(datetime.timezone.utc)
-
-
-date_format = "%a %b %d %H:%M:%S %Z %Y"
-
-
-def get_formatted_datetime(timestamp):
-    return timestamp.strftime(date_format)
-
-
-def get_datetime_from_string(timestamp_string):
-    return parser.parse(timestamp_string)
+def get_current_timestamp():
+    """Return the current time as integer epoch seconds, which is how all dates are stored"""
+    return int(time.time())
 
 
 # Data-related functions
 
 def save_tango(lang, tango):
-    output_file = app_data_path / (lang + '.txt')
+    output_file = get_app_data_path() / (lang + '.txt')
     with open(output_file, 'a') as f:
         print(json.dumps(tango), file=f)
 
@@ -134,13 +189,38 @@ class ExternalCallException(Exception):
         else:
             self.command += '; read -n1 -r -p "Press any key to continue..."'
 
-class ImgCatException(Exception):
-    def __init__(self, last_scene, tango):
+class DictionaryLookupException(Exception):
+    def __init__(self, last_scene, lang, headword):
         self.last_scene = last_scene
-        if not tango['image_base64']:
-            raise ValueError("No image exists for tango: " + tango.get('headword', 'UNKNOWN'))
-        self.tango = tango
-
-    def print(self):
-        print(f"\033]1337;File=size={len(self.tango['image_base64'])};inline=1:{self.tango['image_base64']}\a")
-        input("Press Enter to continue...")
+        self.lang = lang
+        self.headword = headword
+
+    def page(self, lookup_cache):
+        """Show the dictionary entry of the headword in less, running the dictionary command if it isn't cached"""
+        command = get_dictionary_command(self.lang, self.headword)
+        output = lookup_cache.get(self.lang, self.headword, command)
+        if output is None:
+            print(f"Looking up {self.headword}...")
+            output = lookup_cache.lookup(self.lang, self.headword)
+        process = Popen("less -KR", shell=True, stdin=PIPE)
+        try:
+            process.communicate(output)
+        except BrokenPipeError:
+            # less was quit before reading everything
+            process.wait()
+
+
+@contextmanager
+def suspended_screen(screen):
+    """Give the terminal back for ordinary output (e.g. an image) while keeping the asciimatics screen, its
+    scenes and their state alive, instead of closing the screen and building it again afterwards"""
+    import curses
+    curses.def_prog_mode()
+    curses.endwin()
+    try:
+        yield
+    finally:
+        curses.reset_prog_mode()
+        curses.doupdate()
+        # the terminal no longer shows what the screen's buffer thinks it does
+        screen.force_update(full_refresh=True)
@@ -0,0 +1,120 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from tango import model, storage, utils
+
+
+@pytest.fixture(autouse=True)
+def app_data(tmp_path, monkeypatch):
+    """Keep the debug log and anything else written to ~/.tangocho in a temporary directory"""
+    path = tmp_path / ".tangocho"
+    monkeypatch.setattr(utils, "app_data_path", path)
+    return path
+
+
+class TangoCho:
+    """A tango-cho in memory. activate() makes it the one that get_model() and the commands use."""
+
+    def __init__(self, monkeypatch):
+        self._monkeypatch = monkeypatch
+        self.engine = storage.MemoryEngine()
+        self.model = model.Model(self.engine)
+
+    def activate(self):
+        self._monkeypatch.setattr(storage, "engine_instance", self.engine)
+        self._monkeypatch.setattr(model, "model_instance", self.model)
+        return self.model
+
+    def query(self, sql, params=()):
+        """Return the rows of a query as plain tuples"""
+        cursor = self.model._db.cursor()
+        cursor.row_factory = None
+        return cursor.execute(sql, params).fetchall()
+
+
+@pytest.fixture
+def make_tango_cho(monkeypatch):
+    created = []
+
+    def make():
+        tango_cho = TangoCho(monkeypatch)
+        created.append(tango_cho)
+        return tango_cho
+
+    yield make
+    for tango_cho in created:
+        tango_cho.engine.close()
+
+
+@pytest.fixture
+def tango_cho(make_tango_cho):
+    """An empty tango-cho, already active"""
+    tango_cho = make_tango_cho()
+    tango_cho.activate()
+    return tango_cho
+
+
+def make_tango(headword, **fields):
+    """The fields of a new tango, as add_tango takes them"""
+    tango = {"headword": headword, "pronunciation": "", "morphology": "", "definition": "", "example": "",
+             "image_url": "", "image_hash": None, "notes": "", "source": ""}
+    tango.update(fields)
+    return tango
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        host = self.headers['Host'].split(':')[0]
+        with server.lock:
+            server.requests.append((host, self.path))
+            server.active[host] = server.active.get(host, 0) + 1
+            server.peak[host] = max(server.peak.get(host, 0), server.active[host])
+        try:
+            time.sleep(server.delay)
+            data = server.files.get(self.path)
+            if data is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with server.lock:
+                server.active[host] -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageServer(ThreadingHTTPServer):
+    """Serves files (path -> bytes) on 127.0.0.1, reachable as two hosts: 127.0.0.1 and localhost. Records
+    the (host, path) of each request and the most requests each host was serving at once."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _ImageHandler)
+        self.files = {}
+        self.requests = []
+        self.active = {}
+        self.peak = {}
+        self.delay = 0
+        self.lock = threading.Lock()
+
+    def url(self, path, host="127.0.0.1"):
+        return f"http://{host}:{self.server_address[1]}{path}"
+
+
+@pytest.fixture
+def image_server():
+    server = ImageServer()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
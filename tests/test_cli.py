@@ -0,0 +1,26 @@
+import pytest
+from click.testing import CliRunner
+
+from tango import cli, model, storage
+
+
+@pytest.fixture(autouse=True)
+def fresh_engine(monkeypatch):
+    # main() selects the engine, and the first command opens the model, for the whole process
+    monkeypatch.setattr(storage, "engine_instance", None)
+    monkeypatch.setattr(model, "model_instance", None)
+
+
+def test_memory_engine_rejects_a_database_file(tmp_path):
+    result = CliRunner().invoke(cli.main, ["--engine", "memory", "--db", str(tmp_path / "tango.db"), "search", "猫"])
+    assert result.exit_code == 2
+    assert "--engine memory" in result.output
+    assert not (tmp_path / "tango.db").exists()
+
+
+@pytest.mark.parametrize("args", [["--db", ":memory:"], ["--engine", "memory", "--db", ":memory:"],
+                                  ["--engine", "memory"]])
+def test_memory_engine(args):
+    result = CliRunner().invoke(cli.main, args + ["search", "猫"])
+    assert result.exit_code == 0, result.output
+    assert isinstance(storage.engine_instance, storage.MemoryEngine)
@@ -0,0 +1,30 @@
+import hashlib
+
+from tango.downloads import ImageDownloader
+
+from .conftest import make_tango
+
+
+def test_downloads_only_the_images_of_the_session(tango_cho, image_server):
+    tango_model = tango_cho.model
+    tango_model.add_language("ja")
+    image_server.files["/new.png"] = b"new image"
+    image_server.files["/old.png"] = b"old image"
+    # queued by an import, before the session
+    tango_model.import_tango("ja", [make_tango("古い", image_url=image_server.url("/old.png"))])
+    downloader = ImageDownloader()
+    downloader.start()
+    new_id = tango_model.add_tango("ja", make_tango("新しい", image_url=image_server.url("/new.png")))
+    missing_id = tango_model.add_tango("ja", make_tango("無い", image_url=image_server.url("/missing.png")))
+    downloader.notify(new_id)
+    downloader.notify(missing_id)
+    downloader.stop(finish_queue=True, timeout=10)
+
+    assert not downloader._thread.is_alive()
+    assert tango_model.get_tango("ja", new_id)['image_hash'] == hashlib.sha256(b"new image").hexdigest()
+    assert [path for _, path in image_server.requests] in (["/new.png", "/missing.png"],
+                                                           ["/missing.png", "/new.png"])
+    # the failed download stays queued for next time, and the import's is left to 'tango images backfill'
+    downloads = tango_model.get_image_downloads()
+    assert [(download['url'].rsplit('/', 1)[1], download['attempts']) for download in downloads] == \
+        [("old.png", 0), ("missing.png", 1)]
@@ -0,0 +1,86 @@
+import hashlib
+
+from tango.commands.images import backfill
+
+from .conftest import make_tango
+
+HOSTS = ["127.0.0.1", "localhost"]
+
+
+def queue_images(tango_cho, image_server):
+    """Queue the downloads of four images and a missing one on each host, one host after the other"""
+    tango = []
+    for host in HOSTS:
+        for index in range(4):
+            path = f"/{host}-{index}.png"
+            image_server.files[path] = path.encode()
+            tango.append(make_tango(f"{host}-{index}", image_url=image_server.url(path, host)))
+        tango.append(make_tango(f"{host}-missing", image_url=image_server.url("/missing.png", host)))
+    tango_cho.model.add_language("ja")
+    tango_cho.model.import_tango("ja", tango)
+
+
+def record_writes(tango_cho, monkeypatch):
+    """Return a list that gets the number of results of each write of finished and failed downloads"""
+    writes = []
+    for name in ("finish_image_downloads", "fail_image_downloads"):
+        write = getattr(tango_cho.model, name)
+
+        def record(results, write=write, name=name):
+            writes.append((name, len(results)))
+            return write(results)
+        monkeypatch.setattr(tango_cho.model, name, record)
+    return writes
+
+
+def attempts(tango_cho):
+    return sorted(tango_cho.query("SELECT url, attempts FROM image_downloads"))
+
+
+def test_backfill_limits_each_host_and_goes_round_them(tango_cho, image_server):
+    queue_images(tango_cho, image_server)
+    image_server.delay = 0.05
+    backfill(workers=8, per_host=2, batch_size=50, max_attempts=None)
+
+    assert image_server.peak == {host: 2 for host in HOSTS}
+    # the second host's downloads start right away, although they were all queued after the first host's
+    assert sorted(host for host, _ in image_server.requests[:4]) == sorted(HOSTS * 2)
+    for headword, image_hash in tango_cho.query("SELECT headword, image_hash FROM cards"):
+        if headword.endswith("missing"):
+            assert image_hash is None
+        else:
+            path = f"/{headword}.png"
+            assert image_hash == hashlib.sha256(path.encode()).hexdigest()
+
+
+def test_backfill_counts_attempts(tango_cho, image_server):
+    queue_images(tango_cho, image_server)
+    backfill(workers=8, per_host=2, batch_size=50, max_attempts=None)
+    missing = [(image_server.url("/missing.png", host), 1) for host in HOSTS]
+    assert attempts(tango_cho) == sorted(missing)
+
+    # downloads that already failed max_attempts times are skipped
+    requests = len(image_server.requests)
+    backfill(workers=8, per_host=2, batch_size=50, max_attempts=1)
+    assert len(image_server.requests) == requests
+    backfill(workers=8, per_host=2, batch_size=50, max_attempts=None)
+    assert attempts(tango_cho) == sorted((url, 2) for url, _ in missing)
+
+
+def test_backfill_writes_results_in_batches(tango_cho, image_server, monkeypatch):
+    queue_images(tango_cho, image_server)
+    writes = record_writes(tango_cho, monkeypatch)
+    backfill(workers=1, per_host=1, batch_size=3, max_attempts=None)
+
+    # with one download at a time, every write but the last has exactly batch_size results
+    assert sum(count for name, count in writes if name == "finish_image_downloads") == 8
+    assert sum(count for name, count in writes if name == "fail_image_downloads") == 2
+    # a write stores the finished downloads and then counts the failed ones
+    rounds = []
+    previous = None
+    for name, count in writes:
+        if name == "finish_image_downloads" or previous != "finish_image_downloads":
+            rounds.append(0)
+        rounds[-1] += count
+        previous = name
+    assert rounds == [3, 3, 3, 1]
@@ -0,0 +1,95 @@
+import json
+import sqlite3
+import zipfile
+
+import pytest
+from click.testing import CliRunner
+
+from tango import cli
+
+
+@pytest.fixture
+def ja(tango_cho):
+    tango_cho.model.add_language("ja")
+    return tango_cho
+
+
+def import_file(path, *args):
+    return CliRunner().invoke(cli.main, ["import", "ja", str(path), *args])
+
+
+def cards(tango_cho):
+    return tango_cho.query("SELECT headword, definition, notes FROM cards ORDER BY id")
+
+
+def write_anki_collection(path, notes):
+    collection = sqlite3.connect(str(path))
+    collection.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY, flds TEXT)")
+    collection.executemany("INSERT INTO notes (flds) VALUES (?)", [("\x1f".join(fields),) for fields in notes])
+    collection.commit()
+    collection.close()
+
+
+def test_csv_header_names_the_columns(ja, tmp_path):
+    path = tmp_path / "words.csv"
+    path.write_text("Definition, Headword,notes\ncat,猫,a pet\ndog,犬,\n", encoding="utf-8")
+    result = import_file(path)
+    assert result.exit_code == 0, result.output
+    assert cards(ja) == [("猫", "cat", "a pet"), ("犬", "dog", "")]
+
+
+def test_tsv_without_header_uses_the_default_columns(ja, tmp_path):
+    path = tmp_path / "words.tsv"
+    path.write_text("猫\tcat\n犬\tdog\n", encoding="utf-8")
+    assert import_file(path).exit_code == 0
+    assert cards(ja) == [("猫", "cat", ""), ("犬", "dog", "")]
+
+
+def test_columns_option_overrides_a_missing_header(ja, tmp_path):
+    path = tmp_path / "words.tsv"
+    path.write_text("a pet\t猫\tcat\n", encoding="utf-8")
+    assert import_file(path, "--columns", "notes,headword,definition").exit_code == 0
+    assert cards(ja) == [("猫", "cat", "a pet")]
+
+
+def test_reimport_updates_by_headword(ja, tmp_path):
+    path = tmp_path / "words.csv"
+    path.write_text("headword,definition\n猫,cat\n犬,dog\n鳥,bird\n", encoding="utf-8")
+    result = import_file(path)
+    assert "Added 3 and updated 0 tango" in result.stderr
+    # one changed, one the same, one new; a headword twice in a file counts once, the last one winning
+    path.write_text("headword,definition\n猫,cat\n犬,hound\n犬,dog (animal)\n馬,horse\n", encoding="utf-8")
+    result = import_file(path)
+    assert "Added 1 and updated 1 tango" in result.stderr
+    assert cards(ja) == [("猫", "cat", ""), ("犬", "dog (animal)", ""), ("鳥", "bird", ""), ("馬", "horse", "")]
+
+
+def test_reimport_matches_numeric_headwords(ja, tmp_path):
+    path = tmp_path / "words.jsonl"
+    path.write_text(json.dumps({"headword": 42, "definition": "forty-two"}) + "\n", encoding="utf-8")
+    assert "Added 1 and updated 0 tango" in import_file(path).stderr
+    path.write_text(json.dumps({"headword": 42, "definition": "the answer"}) + "\n", encoding="utf-8")
+    assert "Added 0 and updated 1 tango" in import_file(path).stderr
+    assert cards(ja) == [("42", "the answer", "")]
+
+
+def test_anki_package(ja, tmp_path):
+    write_anki_collection(tmp_path / "collection.anki2", [("猫", "cat"), ("犬", "dog")])
+    path = tmp_path / "deck.apkg"
+    with zipfile.ZipFile(path, "w") as package:
+        package.write(tmp_path / "collection.anki2", "collection.anki2")
+    assert import_file(path).exit_code == 0
+    assert cards(ja) == [("猫", "cat", ""), ("犬", "dog", "")]
+
+
+def test_anki_packages_with_a_compressed_collection_are_refused(ja, tmp_path):
+    # the collection.anki2 next to a collection.anki21b only has a note asking to update Anki
+    write_anki_collection(tmp_path / "collection.anki2", [("Please update to the latest Anki version", "")])
+    path = tmp_path / "deck.apkg"
+    with zipfile.ZipFile(path, "w") as package:
+        package.write(tmp_path / "collection.anki2", "collection.anki2")
+        package.writestr("collection.anki21b", b"(zstd data)")
+    result = import_file(path)
+    assert result.exit_code == 1
+    assert "Support older Anki versions" in result.output
+    assert cards(ja) == []
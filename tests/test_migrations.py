@@ -0,0 +1,234 @@
+import base64
+import hashlib
+import uuid
+
+import pytest
+
+from tango.migrations import SCHEMA_VERSION, _to_epoch, get_schema_version, legacy_guid_namespace, migrate, \
+    set_schema_version
+from tango.model import Model
+from tango.sm2_plus import get_default_variables
+from tango.storage import SqliteEngine
+
+BASELINE_FIELDS = ["created", "headword", "pronunciation", "morphology", "definition", "example", "image_url",
+                   "image_base64", "notes", "source"]
+IMAGE = b"\x89PNG a picture of a cat"
+OTHER_IMAGE = b"\x89PNG a picture of a dog"
+
+# (lang, id, created, headword, image_base64) of the tango of the baseline tango-cho
+BASELINE_TANGO = [
+    ("ja", 1, "Tue Jan 02 03:04:05 UTC 2018", "猫", base64.b64encode(IMAGE).decode()),
+    ("ja", 2, "Wed Jan 03 03:04:05 UTC 2018", "犬", "not base64"),
+    ("ja", 3, "Thu Jan 04 03:04:05 UTC 2018", "鳥", None),
+    ("fr", 1, "Fri Jan 05 03:04:05 UTC 2018", "chat", base64.b64encode(IMAGE).decode()),
+    ("fr", 2, "Sat Jan 06 03:04:05 UTC 2018", "chien", base64.b64encode(OTHER_IMAGE).decode()),
+]
+# ja 3 is deleted, so ja's AUTOINCREMENT sequence is ahead of its largest id
+DELETED = ("ja", 3)
+# a tango that was never listed for study, so it has no schedule yet
+UNSCHEDULED = ("fr", 2)
+# a schedule without a date of the last review
+UNDATED = ("ja", 2)
+
+
+def make_baseline(path, extra_tango=()):
+    """Write a tango-cho with the schema of the first version of tango: a table per language with text
+    dates and base64 images, and text dates in review_history and sm2_plus. extra_tango are added to
+    those of BASELINE_TANGO, as a copy of the tango-cho might have."""
+    db = SqliteEngine(path).connect()
+    db.execute("""CREATE TABLE review_history (id INTEGER PRIMARY KEY, lang TEXT, tango_id INTEGER, timestamp TEXT,
+        score TEXT, data TEXT)""")
+    db.execute("""CREATE TABLE sm2_plus (lang TEXT, tango_id INTEGER, difficulty REAL, daysBetweenReviews REAL,
+        dateLastReviewed TEXT, PRIMARY KEY (lang, tango_id))""")
+    for lang in ("ja", "fr"):
+        db.execute(f"CREATE TABLE '{lang}' (id INTEGER PRIMARY KEY AUTOINCREMENT," +
+                   ",".join(f"'{field}' TEXT" for field in BASELINE_FIELDS) + ")")
+    for lang, tango_id, created, headword, image in [*BASELINE_TANGO, *extra_tango]:
+        db.execute(f"INSERT INTO '{lang}' (id, created, headword, definition, image_base64) VALUES (?, ?, ?, ?, ?)",
+                   (tango_id, created, headword, f"{headword} in English", image))
+        db.execute("INSERT INTO sm2_plus VALUES (?, ?, 0.3, 0.25, ?)", (lang, tango_id, created))
+        db.execute("INSERT INTO review_history (lang, tango_id, timestamp, score) VALUES (?, ?, ?, 'Score.OK')",
+                   (lang, tango_id, created.replace("03:04:05", "12:00:00")))
+    lang, tango_id = DELETED
+    db.execute(f"DELETE FROM '{lang}' WHERE id = ?", (tango_id,))
+    db.execute("DELETE FROM sm2_plus WHERE lang = ? AND tango_id = ?", (lang, tango_id))
+    db.execute("DELETE FROM review_history WHERE lang = ? AND tango_id = ?", (lang, tango_id))
+    db.execute("DELETE FROM sm2_plus WHERE lang = ? AND tango_id = ?", UNSCHEDULED)
+    db.execute("UPDATE sm2_plus SET dateLastReviewed = NULL WHERE lang = ? AND tango_id = ?", UNDATED)
+    db.commit()
+    return db
+
+
+def dump(db):
+    """The data of a migrated tango-cho, for comparing migrations"""
+    tables = {
+        "cards": "SELECT * FROM cards ORDER BY id",
+        "sm2_plus": "SELECT * FROM sm2_plus ORDER BY tango_id",
+        "review_history": "SELECT * FROM review_history ORDER BY id",
+        "images": "SELECT hash, data FROM images ORDER BY hash",
+        "sqlite_sequence": "SELECT * FROM sqlite_sequence WHERE name = 'cards'",
+    }
+    return {table: db.execute(sql).fetchall() for table, sql in tables.items()}
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = tmp_path / "tango.db"
+    make_baseline(path).close()
+    return path
+
+
+@pytest.fixture
+def migrated(baseline):
+    db = SqliteEngine(baseline).connect()
+    migrate(db, batch_size=1, echo=lambda message: None)
+    yield db
+    db.close()
+
+
+def test_migrates_to_the_current_version(baseline, migrated):
+    assert get_schema_version(migrated) == SCHEMA_VERSION
+    # the migrated tango-cho opens without asking for another migration
+    tango_model = Model(SqliteEngine(baseline))
+    assert tango_model.get_languages() == ["ja", "fr"]
+    assert len(tango_model.get_tango_for_language('all')) == 4
+
+
+def test_dates_become_epoch_seconds(migrated):
+    created = {headword: created for headword, created in migrated.execute("SELECT headword, created FROM cards")}
+    assert created == {headword: _to_epoch(text) for _, _, text, headword, _ in BASELINE_TANGO
+                       if headword != "鳥"}
+    assert _to_epoch("Tue Jan 02 03:04:05 UTC 2018") == 1514862245
+    for tango_id, timestamp in migrated.execute("SELECT tango_id, timestamp FROM review_history"):
+        card_created, = migrated.execute("SELECT created FROM cards WHERE id = ?", (tango_id,)).fetchone()
+        assert timestamp == card_created + (12 * 60 * 60 - (3 * 60 * 60 + 4 * 60 + 5))
+    for date_last_reviewed, next_due, days in migrated.execute(
+            "SELECT dateLastReviewed, nextDue, daysBetweenReviews FROM sm2_plus"):
+        assert next_due == date_last_reviewed + days * 24 * 60 * 60
+
+
+def test_images_are_stored_once(migrated):
+    images = dict(migrated.execute("SELECT hash, data FROM images"))
+    assert images == {hashlib.sha256(IMAGE).hexdigest(): IMAGE, hashlib.sha256(OTHER_IMAGE).hexdigest(): OTHER_IMAGE}
+    image_hashes = dict(migrated.execute("SELECT headword, image_hash FROM cards"))
+    # the same image in two languages is stored once; an undecodable one is dropped
+    assert image_hashes == {"猫": hashlib.sha256(IMAGE).hexdigest(), "chat": hashlib.sha256(IMAGE).hexdigest(),
+                            "chien": hashlib.sha256(OTHER_IMAGE).hexdigest(), "犬": None}
+
+
+def test_card_ids_are_shifted_past_earlier_languages(migrated):
+    # ja keeps its ids; fr's start after the highest id ja ever used, including the deleted 3
+    ids = {(lang, headword): tango_id for tango_id, lang, headword in migrated.execute(
+        "SELECT id, lang, headword FROM cards")}
+    assert ids == {("ja", "猫"): 1, ("ja", "犬"): 2, ("fr", "chat"): 4, ("fr", "chien"): 5}
+    assert migrated.execute("SELECT seq FROM sqlite_sequence WHERE name = 'cards'").fetchone()[0] == 5
+    # the schedules and the history moved along with their cards
+    for table in ("sm2_plus", "review_history"):
+        rows = migrated.execute(f"SELECT t.lang, c.lang FROM {table} t JOIN cards c ON c.id = t.tango_id").fetchall()
+        assert sorted(rows) == [("fr", "fr"), ("fr", "fr"), ("ja", "ja"), ("ja", "ja")]
+    assert {name for name, in migrated.execute("SELECT name FROM languages")} == {"ja", "fr"}
+    tables = {name for name, in migrated.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert not tables & {"ja", "fr", "ja_migrating", "fr_migrating"}
+
+
+def legacy_guids(tango):
+    """The guids that migrating gives the given baseline tango, by headword"""
+    return {headword: uuid.uuid5(legacy_guid_namespace, f"{lang}:{tango_id}:{_to_epoch(created)}").hex
+            for lang, tango_id, created, headword, _ in tango}
+
+
+def test_guids_are_derived_from_the_original_cards(migrated):
+    guids = dict(migrated.execute("SELECT headword, guid FROM cards"))
+    # from the id each tango had in its language's table, not the shifted card id
+    expected = legacy_guids(BASELINE_TANGO)
+    del expected["鳥"]
+    assert guids == expected
+    for created, modified in migrated.execute("SELECT created, modified FROM cards"):
+        assert modified == created
+    # every card is sent on the first sync
+    changed = [card_id for card_id, in migrated.execute("SELECT card_id FROM card_changes ORDER BY card_id")]
+    assert changed == [1, 2, 4, 5]
+    assert "cards_legacy_ids" not in [name for name, in migrated.execute("SELECT name FROM sqlite_master")]
+
+
+def test_copies_migrated_separately_agree_on_guids(tmp_path, migrated):
+    path = tmp_path / "copy.db"
+    make_baseline(path).close()
+    db = SqliteEngine(path).connect()
+    migrate(db, batch_size=1000, echo=lambda message: None)
+    assert db.execute("SELECT id, guid FROM cards ORDER BY id").fetchall() == \
+        migrated.execute("SELECT id, guid FROM cards ORDER BY id").fetchall()
+
+
+def test_diverged_copies_agree_on_the_guids_of_their_common_tango(tmp_path, migrated):
+    # a copy that got another ja tango before migrating; its fr cards end up with other ids
+    extra = ("ja", 4, "Sun Jan 07 03:04:05 UTC 2018", "馬", None)
+    path = tmp_path / "copy.db"
+    make_baseline(path, [extra]).close()
+    db = SqliteEngine(path).connect()
+    migrate(db, batch_size=1000, echo=lambda message: None)
+    ids = dict(db.execute("SELECT headword, id FROM cards"))
+    assert ids["chat"] != dict(migrated.execute("SELECT headword, id FROM cards"))["chat"]
+    guids = dict(db.execute("SELECT headword, guid FROM cards"))
+    assert guids.pop("馬") == legacy_guids([extra])["馬"]
+    assert guids == dict(migrated.execute("SELECT headword, guid FROM cards"))
+
+
+def test_tango_without_a_schedule_get_the_default(migrated):
+    schedules = migrated.execute("""SELECT c.headword, c.created, s.difficulty, s.daysBetweenReviews,
+        s.dateLastReviewed, s.nextDue FROM cards c JOIN sm2_plus s ON s.tango_id = c.id""").fetchall()
+    assert len(schedules) == 4
+    headword, created, *schedule = [row for row in schedules if row[0] == "chien"][0]
+    default = get_default_variables({"created": created})
+    assert schedule == [default["difficulty"], default["daysBetweenReviews"], default["dateLastReviewed"],
+                        default["nextDue"]]
+
+
+def default_schedule(db, headword):
+    """The schedule of the tango and the one a new tango created at the same time gets"""
+    created, *schedule = db.execute("""SELECT c.created, s.difficulty, s.daysBetweenReviews, s.dateLastReviewed,
+        s.nextDue FROM cards c JOIN sm2_plus s ON s.tango_id = c.id WHERE c.headword = ?""", (headword,)).fetchone()
+    default = get_default_variables({"created": created})
+    return schedule, [default["difficulty"], default["daysBetweenReviews"], default["dateLastReviewed"],
+                      default["nextDue"]]
+
+
+def test_undated_schedules_start_over(migrated):
+    schedule, default = default_schedule(migrated, "犬")
+    assert schedule == default
+
+
+def test_schedules_without_a_due_time_are_repaired(migrated):
+    # as migration 1 used to leave undated schedules
+    migrated.execute("UPDATE sm2_plus SET dateLastReviewed = NULL, nextDue = NULL WHERE tango_id = 1")
+    set_schema_version(migrated, 9)
+    migrate(migrated, batch_size=1, echo=lambda message: None)
+    schedule, default = default_schedule(migrated, "猫")
+    assert schedule == default
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.mark.parametrize("interrupt_at", [
+    "  ja: 1 rows",  # half way through copying a language table to epoch dates
+    "Migrating to version 2",  # between two migrations
+    "  Moving fr",  # after ja was moved into the cards table
+    "Migrating to version 9",  # with the ids of the language tables waiting to be turned into guids
+])
+def test_interrupted_migration_resumes(tmp_path, baseline, migrated, interrupt_at):
+    path = tmp_path / "interrupted.db"
+    make_baseline(path).close()
+
+    def echo(message):
+        if message.startswith(interrupt_at):
+            raise Interrupted(message)
+
+    db = SqliteEngine(path).connect()
+    with pytest.raises(Interrupted):
+        migrate(db, batch_size=1, echo=echo)
+    db.close()
+    db = SqliteEngine(path).connect()
+    migrate(db, batch_size=1, echo=lambda message: None)
+    assert dump(db) == dump(migrated)
@@ -0,0 +1,118 @@
+import sqlite3
+import time
+
+import pytest
+
+from tango import model
+from tango.model import Model, Score
+from tango.sm2_plus import get_default_variables, get_updated_variables
+from tango.storage import SqliteEngine
+
+from .conftest import make_tango
+
+# after the tango are created, so reviewed tango are those last reviewed at NOW or later
+NOW = 4_000_000_000
+
+
+@pytest.fixture(autouse=True)
+def exit_hooks(monkeypatch):
+    """The functions registered to run on exit, instead of registering them"""
+    hooks = []
+    monkeypatch.setattr(model.atexit, "register", hooks.append)
+    return hooks
+
+
+@pytest.fixture
+def tango_model(tmp_path):
+    """A tango-cho in a file, so that a second connection sees only what was committed"""
+    tango_model = Model(SqliteEngine(tmp_path / "tango.db"))
+    tango_model.add_language("ja")
+    yield tango_model
+    tango_model.flush()
+    tango_model._db.close()
+
+
+def add(tango_model, headword):
+    tango_id = tango_model.add_tango("ja", make_tango(headword))
+    return {"lang": "ja", "id": tango_id}
+
+
+def review(tango_model, tango, score=Score.OK, timestamp=NOW):
+    sm2p_vars = get_updated_variables(get_default_variables({"created": NOW - 86400}), 0.5, timestamp)
+    tango_model.record_review(tango, score, sm2p_vars, timestamp)
+
+
+def committed(tango_model):
+    """The (tango_id, timestamp) of the reviews and the ids of the tango reviewed, as another connection
+    sees them"""
+    db = tango_model.engine.connect()
+    try:
+        history = db.execute("SELECT tango_id, timestamp FROM review_history ORDER BY id").fetchall()
+        reviewed = db.execute("SELECT tango_id FROM sm2_plus WHERE dateLastReviewed >= ?", (NOW,)).fetchall()
+        return history, [tango_id for tango_id, in reviewed]
+    finally:
+        db.close()
+
+
+def fail_schedule_writes(tango_model):
+    tango_model._db.execute("""CREATE TEMP TRIGGER fail_sm2_plus BEFORE INSERT ON sm2_plus BEGIN
+            SELECT RAISE(ABORT, 'disk full');
+        END""")
+
+
+def test_reviews_are_committed_one_by_one(tango_model):
+    tango = add(tango_model, "猫")
+    review(tango_model, tango)
+    assert committed(tango_model) == ([(tango["id"], NOW)], [tango["id"]])
+
+
+def test_failed_review_leaves_no_history(tango_model):
+    tango = add(tango_model, "猫")
+    fail_schedule_writes(tango_model)
+    with pytest.raises(sqlite3.IntegrityError, match="disk full"):
+        review(tango_model, tango)
+    tango_model.flush()
+    assert committed(tango_model) == ([], [])
+
+
+def test_failed_review_keeps_the_rest_of_its_write_behind_group(tango_model):
+    first, second = add(tango_model, "猫"), add(tango_model, "犬")
+    tango_model.enable_write_behind(interval=3600)
+    review(tango_model, first)
+    fail_schedule_writes(tango_model)
+    with pytest.raises(sqlite3.IntegrityError):
+        review(tango_model, second, timestamp=NOW + 10)
+    tango_model._db.execute("DROP TRIGGER fail_sm2_plus")
+    review(tango_model, second, timestamp=NOW + 20)
+    tango_model.flush()
+    assert committed(tango_model) == ([(first["id"], NOW), (second["id"], NOW + 20)], [first["id"], second["id"]])
+
+
+def test_write_behind_commits_on_flush(tango_model):
+    tango = add(tango_model, "猫")
+    tango_model.enable_write_behind(interval=3600)
+    review(tango_model, tango)
+    review(tango_model, tango, timestamp=NOW + 10)
+    assert committed(tango_model) == ([], [])
+    tango_model.flush()
+    assert committed(tango_model) == ([(tango["id"], NOW), (tango["id"], NOW + 10)], [tango["id"]])
+
+
+def test_write_behind_commits_after_the_interval(tango_model):
+    tango = add(tango_model, "猫")
+    tango_model.enable_write_behind(interval=0.05)
+    review(tango_model, tango)
+    deadline = time.monotonic() + 5
+    while committed(tango_model) == ([], []) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert committed(tango_model) == ([(tango["id"], NOW)], [tango["id"]])
+
+
+def test_write_behind_commits_on_exit(tango_model, exit_hooks):
+    tango = add(tango_model, "猫")
+    tango_model.enable_write_behind(interval=3600)
+    review(tango_model, tango)
+    assert committed(tango_model) == ([], [])
+    for hook in exit_hooks:
+        hook()
+    assert committed(tango_model) == ([(tango["id"], NOW)], [tango["id"]])
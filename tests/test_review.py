@@ -0,0 +1,108 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from tango import cli
+from tango.model import Score
+from tango.study_session import StudySession
+from tango.utils import get_current_timestamp
+
+from .conftest import make_tango
+
+DAY = 24 * 60 * 60
+
+
+@pytest.fixture
+def due_tango(tango_cho):
+    """Three ja tango, due one, two and three days ago; the most overdue is first"""
+    tango_cho.model.add_language("ja")
+    now = get_current_timestamp()
+    ids = [tango_cho.model.add_tango("ja", make_tango(headword)) for headword in ["猫", "犬", "鳥"]]
+    tango_cho.model.save_sm2p_vars([("ja", tango_id, 0.3, 1.0, now - (4 - i) * DAY, now - (3 - i) * DAY)
+                                    for i, tango_id in enumerate(ids)])
+    return ids
+
+
+def schedule(tango_cho, tango_id):
+    return tango_cho.query("""SELECT difficulty, daysBetweenReviews, dateLastReviewed, nextDue FROM sm2_plus
+        WHERE tango_id = ?""", (tango_id,))[0]
+
+
+def review(answers):
+    result = CliRunner().invoke(cli.main, ["review", "ja", "--batch"], input="".join(line + "\n" for line in answers))
+    assert result.exit_code == 0, result.output
+    return [json.loads(line) for line in result.stdout.splitlines()]
+
+
+def test_scores_update_the_schedule(tango_cho, due_tango):
+    before = [schedule(tango_cho, tango_id) for tango_id in due_tango]
+    lines = review(['{"score": "GREAT"}', '{"score": "ok"}', '{"score": "GREAT"}'])
+    assert [(line["type"], line.get("id")) for line in lines] == [("tango", due_tango[0]), ("tango", due_tango[1]),
+                                                                  ("tango", due_tango[2]), ("end", None)]
+    assert lines[0]["headword"] == "猫"
+    for tango_id, old in zip(due_tango, before):
+        new = schedule(tango_cho, tango_id)
+        assert new != old
+        # reviewed just now, and not due again yet
+        assert new[2] >= get_current_timestamp() - 60 and new[3] > get_current_timestamp()
+    history = tango_cho.query("SELECT tango_id, score FROM review_history ORDER BY id")
+    assert history == [(due_tango[0], str(Score.GREAT)), (due_tango[1], str(Score.OK)),
+                       (due_tango[2], str(Score.GREAT))]
+    assert lines[-1] == {"type": "end", "reviewed": 3, "scores": {"BAD": 0, "OK": 1, "GREAT": 2}, "left": 0}
+
+
+def test_null_skips_a_tango(tango_cho, due_tango):
+    skipped = schedule(tango_cho, due_tango[0])
+    lines = review(['{"score": null}', '{"score": "OK"}'])
+    assert [line.get("id") for line in lines[:3]] == due_tango
+    assert schedule(tango_cho, due_tango[0]) == skipped
+    assert tango_cho.query("SELECT tango_id FROM review_history") == [(due_tango[1],)]
+    # stdin ended while the third tango was waiting for its score
+    assert lines[-1] == {"type": "end", "reviewed": 1, "scores": {"BAD": 0, "OK": 1, "GREAT": 0}, "left": 1}
+
+
+@pytest.mark.parametrize("answer, message", [
+    ("not json", "Expecting value"),
+    ('["OK"]', "expected a JSON object"),
+    ('{}', "missing score"),
+    ('{"score": "meh"}', "unknown score 'meh'"),
+    ('{"id": 999999, "score": "OK"}', "expected a score for tango ja:"),
+])
+def test_malformed_answers_are_reported_and_the_tango_asked_again(tango_cho, due_tango, answer, message):
+    lines = review([answer, '{"score": "OK"}'])
+    assert [line["type"] for line in lines[:3]] == ["tango", "error", "tango"]
+    assert message in lines[1]["message"]
+    # the answer after the error is the first tango's
+    assert lines[0]["id"] == due_tango[0] and lines[2]["id"] == due_tango[1]
+    assert tango_cho.query("SELECT tango_id FROM review_history") == [(due_tango[0],)]
+    assert lines[-1]["reviewed"] == 1 and lines[-1]["left"] == 2
+
+
+def test_failed_tango_are_asked_again(tango_cho, due_tango):
+    lines = review(['{"score": "BAD"}', '{"score": "OK"}', '{"score": "OK"}', '{"score": "GREAT"}'])
+    # the failed tango comes back once nothing else is left
+    assert [line.get("id") for line in lines] == [*due_tango, due_tango[0], None]
+    assert lines[-1] == {"type": "end", "reviewed": 4, "scores": {"BAD": 1, "OK": 2, "GREAT": 1}, "left": 0}
+
+
+def test_session_commits_on_finish(tango_cho, due_tango):
+    session = StudySession("ja")
+    assert len(session) == 3
+    tango = session.next()
+    session.record(tango, Score.OK)
+    assert session.reviewed == 1 and len(session) == 2
+    # held back by write-behind mode until finish()
+    assert tango_cho.model._db.in_transaction
+    session.finish()
+    assert not tango_cho.model._db.in_transaction
+    assert tango_cho.query("SELECT tango_id FROM review_history") == [(due_tango[0],)]
+
+
+@pytest.mark.parametrize("command", [["study"], ["review", "--batch"]])
+def test_unknown_languages_are_refused(tango_cho, due_tango, command):
+    result = CliRunner().invoke(cli.main, [*command, "jp"])
+    assert result.exit_code == 2
+    assert "no tango-cho for 'jp' exists" in result.output
+    with pytest.raises(ValueError, match="No such language: jp"):
+        tango_cho.model.get_due_tango("jp", get_current_timestamp())
@@ -0,0 +1,39 @@
+import random
+
+from click.testing import CliRunner
+
+from tango import cli, sm2_plus
+from tango.model import Score
+
+from .conftest import make_tango
+
+SCHEDULE_SQL = """SELECT lang, tango_id, difficulty, daysBetweenReviews, dateLastReviewed, nextDue FROM sm2_plus
+    ORDER BY tango_id"""
+
+
+def test_rebuild_reproduces_the_live_schedule(tango_cho, monkeypatch):
+    rng = random.Random(0)
+    ids = []
+    for lang, headwords in (("ja", ["猫", "犬", "鳥", "馬"]), ("fr", ["chat", "chien", "oiseau"])):
+        tango_cho.model.add_language(lang)
+        ids += [(lang, tango_cho.model.add_tango(lang, make_tango(headword))) for headword in headwords]
+    clock = [tango_cho.query("SELECT max(created) FROM cards")[0][0]]
+    monkeypatch.setattr(sm2_plus, "get_current_timestamp", lambda: clock[0])
+    # review the tango in an interleaved order over a few months, the way studying would; the last one
+    # is never reviewed
+    for _ in range(60):
+        clock[0] += rng.randint(600, 3 * 24 * 60 * 60)
+        lang, tango_id = rng.choice(ids[:-1])
+        sm2_plus.record_review({"lang": lang, "id": tango_id}, rng.choice(list(Score)))
+    tango_cho.model.flush()
+    live = tango_cho.query(SCHEDULE_SQL)
+    assert len(live) == len(ids)
+
+    result = CliRunner().invoke(cli.main, ["rebuild-schedule", "--yes", "--batch-size", "3"])
+    assert result.exit_code == 0, result.output
+    assert f"Rebuilt the schedule of {len(ids)} tango" in result.stderr
+    # the replay does the same arithmetic in the same order, so the schedules are exactly the same
+    assert tango_cho.query(SCHEDULE_SQL) == live
+    # and rebuilding only some tango leaves the rest alone
+    sm2_plus.rebuild_schedule(tango_ids=[tango_id for _, tango_id in ids[:2]])
+    assert tango_cho.query(SCHEDULE_SQL) == live
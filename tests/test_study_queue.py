@@ -0,0 +1,96 @@
+import random
+
+import pytest
+
+from tango import study_queue
+from tango.model import Score
+from tango.study_queue import RELEARN_GAP, StudyQueue
+
+from .conftest import make_tango
+
+NOW = 1_700_000_000
+
+
+def make_queue(entries, **kwargs):
+    """A queue of the given entries that never looks for more, since there is no tango-cho behind it"""
+    return StudyQueue("ja", entries, NOW, refresh_interval=float("inf"), **kwargs)
+
+
+def pop_all(queue):
+    popped = []
+    while (key := queue.pop()) is not None:
+        popped.append(key)
+    return popped
+
+
+def test_pops_most_overdue_first():
+    queue = make_queue([("ja", 1, 1.5), ("ja", 2, 3.0), ("ja", 3, 1.0), ("ja", 4, 3.0)])
+    assert len(queue) == 4
+    # ties are taken in the order they were given
+    assert pop_all(queue) == [("ja", 2), ("ja", 4), ("ja", 1), ("ja", 3)]
+    assert len(queue) == 0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_peek_shows_what_pop_takes(seed):
+    rng = random.Random(seed)
+    entries = [("ja", tango_id, rng.choice([1.0, 1.5, 2.0, rng.random() * 10])) for tango_id in range(40)]
+    queue = make_queue(entries, relearn_gap=3)
+    while len(queue):
+        count = rng.randint(1, 7)
+        upcoming = queue.peek(count)
+        assert queue.peek(count) == upcoming
+        taken = [queue.pop() for _ in range(min(count, len(queue)))]
+        assert taken == upcoming
+        # fail some tango, so that the relearn heap takes part in the order too
+        for lang, tango_id in taken:
+            if rng.random() < 0.3:
+                queue.reviewed({"lang": lang, "id": tango_id}, Score.BAD)
+
+
+def test_failed_tango_come_back_after_the_gap():
+    queue = make_queue([("ja", tango_id, 10 - tango_id) for tango_id in range(8)])
+    first = queue.pop()
+    queue.reviewed({"lang": "ja", "id": first[1]}, Score.BAD)
+    # failing it again before it is shown doesn't queue it twice
+    queue.reviewed({"lang": "ja", "id": first[1]}, Score.BAD)
+    second = queue.pop()
+    queue.reviewed({"lang": "ja", "id": second[1]}, Score.GREAT)
+    order = pop_all(queue)
+    assert order.index(first) == RELEARN_GAP - 1
+    assert order.count(first) == 1 and second not in order
+    assert len(order) == 7
+
+
+def test_failed_tango_are_shown_when_nothing_else_is_due():
+    queue = make_queue([("ja", 1, 2.0), ("ja", 2, 1.0)])
+    queue.reviewed({"lang": "ja", "id": queue.pop()[1]}, Score.BAD)
+    assert queue.peek(3) == [("ja", 2), ("ja", 1)]
+    assert pop_all(queue) == [("ja", 2), ("ja", 1)]
+
+
+def test_refresh_adds_tango_that_became_due(tango_cho, monkeypatch):
+    tango_cho.model.add_language("ja")
+    ids = [tango_cho.model.add_tango("ja", make_tango(headword)) for headword in ["猫", "犬", "鳥"]]
+    due = {ids[0]: NOW - 100, ids[1]: NOW + 30, ids[2]: NOW + 1000}
+    tango_cho.model.save_sm2p_vars([("ja", tango_id, 0.3, 1.0, next_due - 86400, next_due)
+                                    for tango_id, next_due in due.items()])
+    clock = [NOW]
+    monkeypatch.setattr(study_queue, "get_current_timestamp", lambda: clock[0])
+    queue = StudyQueue.load("ja", refresh_interval=60)
+    assert queue.peek(5) == [("ja", ids[0])]
+
+    # 犬 is due now, but the queue only looks again once refresh_interval has passed
+    clock[0] = NOW + 59
+    assert queue.pop() == ("ja", ids[0])
+    queue.reviewed({"lang": "ja", "id": ids[0]}, Score.BAD)
+    assert len(queue) == 1
+
+    clock[0] = NOW + 60
+    # 猫 is queued to be relearned; moving it into the checked range doesn't queue it a second time
+    tango_cho.model.save_sm2p_vars([("ja", ids[0], 0.3, 1.0, NOW + 50 - 86400, NOW + 50)])
+    assert queue.pop() == ("ja", ids[1])
+    assert pop_all(queue) == [("ja", ids[0])]
+    # the next check only looks at what became due after the last one
+    clock[0] = NOW + 2000
+    assert pop_all(queue) == [("ja", ids[2])]
@@ -0,0 +1,157 @@
+import json
+
+import pytest
+
+from tango.commands import sync
+from tango.migrations import sync_fields
+from tango.model import Score
+from tango.sm2_plus import get_default_variables, get_updated_variables, performance_ratings
+
+from .conftest import make_tango
+
+CARD_SQL = f"SELECT guid, lang, modified, {', '.join(sync_fields)} FROM cards ORDER BY guid"
+REVIEW_SQL = """SELECT c.guid, h.timestamp, h.score FROM review_history h JOIN cards c ON c.id = h.tango_id
+    ORDER BY c.guid, h.timestamp, h.score"""
+SCHEDULE_SQL = """SELECT c.guid, s.difficulty, s.daysBetweenReviews, s.dateLastReviewed, s.nextDue
+    FROM sm2_plus s JOIN cards c ON c.id = s.tango_id ORDER BY c.guid"""
+
+
+@pytest.fixture
+def laptop(make_tango_cho):
+    tango_cho = make_tango_cho()
+    tango_cho.name = "laptop"
+    tango_cho.model.add_language("ja")
+    return tango_cho
+
+
+@pytest.fixture
+def desktop(make_tango_cho):
+    tango_cho = make_tango_cho()
+    tango_cho.name = "desktop"
+    return tango_cho
+
+
+def send(source, target, path, full=False):
+    """Export source's changes for target to path and import them into target"""
+    source.activate()
+    sync.export(target.name, str(path), full, True)
+    target.activate()
+    sync.import_(source.name, str(path), 1000)
+
+
+def exchange(first, second, tmp_path):
+    send(first, second, tmp_path / "to-second.jsonl")
+    send(second, first, tmp_path / "to-first.jsonl")
+
+
+def set_card(tango_cho, headword, modified, **fields):
+    """Edit a card as if it had been edited at modified"""
+    assignments = ", ".join(f"{field} = ?" for field in fields)
+    tango_cho.query(f"UPDATE cards SET {assignments}, modified = ? WHERE headword = ?",
+                    (*fields.values(), modified, headword))
+    tango_cho.model._db.commit()
+
+
+def add_review(tango_cho, headword, timestamp, score):
+    """Review a tango at timestamp, the way the study session records reviews"""
+    tango_cho.activate()
+    tango = tango_cho.query("SELECT lang, id FROM cards WHERE headword = ?", (headword,))[0]
+    tango = {"lang": tango[0], "id": tango[1]}
+    sm2p_vars = dict(tango_cho.model.get_sm2p_vars(tango))
+    sm2p_vars = get_updated_variables(sm2p_vars, performance_ratings[score.name], timestamp)
+    tango_cho.model.record_review(tango, score, sm2p_vars, timestamp)
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_tie_converges(laptop, desktop, tmp_path):
+    laptop.model.add_tango("ja", make_tango("露", definition="dew"))
+    exchange(laptop, desktop, tmp_path)
+    # both sides edit the card with the same modified time, e.g. two copies of a migrated tango-cho whose
+    # cards were all modified when they were created; the fields decide which edit wins
+    set_card(laptop, "露", 1000, definition="AAA")
+    set_card(desktop, "露", 1000, definition="BBB")
+    exchange(laptop, desktop, tmp_path)
+    assert laptop.query(CARD_SQL) == desktop.query(CARD_SQL)
+    assert laptop.query("SELECT definition, modified FROM cards") == [("BBB", 1000)]
+
+
+def test_two_way_exchange(laptop, desktop, tmp_path):
+    laptop.model.add_tango("ja", make_tango("猫", definition="cat"))
+    laptop.model.add_tango("ja", make_tango("犬", definition="dog"))
+    add_review(laptop, "猫", 2000, Score.GREAT)
+    exchange(laptop, desktop, tmp_path)
+
+    desktop.model.add_language("fr")
+    desktop.model.add_tango("fr", make_tango("chat", definition="cat"))
+    set_card(desktop, "犬", 2_000_000_000, definition="dog, hound")
+    add_review(desktop, "犬", 2500, Score.BAD)
+    exchange(desktop, laptop, tmp_path)
+
+    assert laptop.query(CARD_SQL) == desktop.query(CARD_SQL)
+    assert len(laptop.query(CARD_SQL)) == 3
+    assert laptop.query(REVIEW_SQL) == desktop.query(REVIEW_SQL)
+    assert len(laptop.query(REVIEW_SQL)) == 2
+    # every card has a schedule, including those that came without reviews
+    assert len(laptop.query(SCHEDULE_SQL)) == len(desktop.query(SCHEDULE_SQL)) == 3
+    assert laptop.model.get_languages() == ["ja", "fr"]
+    # nothing is sent back to where it came from
+    send(laptop, desktop, tmp_path / "again.jsonl")
+    assert [line["type"] for line in read_lines(tmp_path / "again.jsonl")] == ["header", "end"]
+
+
+def test_import_is_idempotent(laptop, desktop, tmp_path):
+    laptop.model.add_tango("ja", make_tango("猫", definition="cat"))
+    add_review(laptop, "猫", 2000, Score.OK)
+    path = tmp_path / "changes.jsonl"
+    send(laptop, desktop, path)
+    state = desktop.query(CARD_SQL), desktop.query(REVIEW_SQL), desktop.query(SCHEDULE_SQL)
+    sync.import_(laptop.name, str(path), 1000)
+    assert (desktop.query(CARD_SQL), desktop.query(REVIEW_SQL), desktop.query(SCHEDULE_SQL)) == state
+    assert len(state[0]) == 1 and len(state[1]) == 1
+
+
+@pytest.mark.parametrize("laptop_time, desktop_time, winner", [(5000, 4000, "laptop"), (4000, 5000, "desktop")])
+def test_last_writer_wins(laptop, desktop, tmp_path, laptop_time, desktop_time, winner):
+    laptop.model.add_tango("ja", make_tango("露", definition="dew"))
+    exchange(laptop, desktop, tmp_path)
+    set_card(laptop, "露", laptop_time, definition="laptop")
+    set_card(desktop, "露", desktop_time, definition="desktop")
+    exchange(laptop, desktop, tmp_path)
+    assert laptop.query(CARD_SQL) == desktop.query(CARD_SQL)
+    assert laptop.query("SELECT definition, modified FROM cards") == [(winner, max(laptop_time, desktop_time))]
+
+
+def test_schedules_are_replayed_from_merged_history(laptop, desktop, tmp_path):
+    start = 1_700_000_000
+    laptop.model.add_tango("ja", make_tango("猫", definition="cat"))
+    exchange(laptop, desktop, tmp_path)
+    # both review the same tango before syncing, so each side's schedule only knows its own review
+    add_review(laptop, "猫", start + 86400, Score.GREAT)
+    add_review(desktop, "猫", start + 2 * 86400, Score.BAD)
+    exchange(laptop, desktop, tmp_path)
+
+    assert laptop.query(REVIEW_SQL) == desktop.query(REVIEW_SQL)
+    assert laptop.query(SCHEDULE_SQL) == pytest.approx(desktop.query(SCHEDULE_SQL))
+    # the schedule is the one that replaying both reviews in order gives
+    created = laptop.query("SELECT created FROM cards")[0][0]
+    sm2p_vars = get_updated_variables(get_default_variables({"created": created}), 1.0, start + 86400)
+    sm2p_vars = get_updated_variables(sm2p_vars, 0.0, start + 2 * 86400)
+    guid, *schedule = laptop.query(SCHEDULE_SQL)[0]
+    assert schedule == pytest.approx([sm2p_vars["difficulty"], sm2p_vars["daysBetweenReviews"],
+                                      sm2p_vars["dateLastReviewed"], sm2p_vars["nextDue"]])
+
+
+def test_new_cards_are_recorded_once(laptop):
+    laptop.model.add_tango("ja", make_tango("猫"))
+    laptop.model.import_tango("ja", iter([{"headword": "犬"}, {"headword": "鳥"}]))
+    # a card written to card_changes twice would have skipped a seq
+    assert laptop.query("SELECT seq FROM card_changes ORDER BY seq") == [(1,), (2,), (3,)]
+    cards = laptop.query("SELECT guid, created, modified FROM cards")
+    assert len({guid for guid, _, _ in cards}) == 3
+    for guid, created, modified in cards:
+        assert len(guid) == 32 and int(guid, 16) >= 0
+        assert modified == created